@@ -1,18 +1,36 @@
 import streamlit as st
-from streamlit_folium import st_folium
 import pandas as pd
+import numpy as np
 import folium
-from folium.plugins import AntPath
+from folium.plugins import AntPath, FastMarkerCluster
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
+from geopy.adapters import RequestsAdapter
+from geopy.location import Location
 import time
 import re
 import polyline
 import os
+import json
+import hashlib
+import sqlite3
+import threading
+import zlib
+import gzip
+import glob
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from functools import partial
 from datetime import datetime
 
+from extracao import (
+    normalizar_texto, normalizar_serie, regex_de_trie, SUFIXOS_JURIDICOS,
+    classificar_pessoa_juridica, extrair_cooperativas, extrair_associados
+)
+
 # ==============================================================================
 # CONFIGURAÇÃO INICIAL
 # ==============================================================================
@@ -27,95 +45,558 @@ st.title("🌱 Mapa das Algodoeiras e Cooperativas de Mato Grosso")
 st.markdown("Sistema completo para mapeamento e visualização interativa do setor algodoeiro.")
 
 # ==============================================================================
-# FUNÇÕES AUXILIARES - GEOCODIFICAÇÃO MELHORADA
+# PERSISTÊNCIA LOCAL - CACHE EM DISCO
 # ==============================================================================
 
-def is_pessoa_juridica(nome):
+DIRETORIO_CACHE = os.environ.get(
+    "ALGODOEIRAS_DIR_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+)
+
+def obter_configuracao(nome, padrao):
     """
-    Verifica se um nome provavelmente pertence a uma empresa.
+    Lê uma configuração das variáveis de ambiente ou do st.secrets
     """
-    if not nome or pd.isna(nome):
-        return False
-        
-    keywords = [
-        'ltda', 's.a', 's/a', 's.a.', 'eireli', 'mei', 'me', 'empresa',
-        'agropecuária', 'agropecuaria', 'agrícola', 'agricola', 
-        'fazenda', 'grupo', 'agro', 'produtos', 'investimentos',
-        'comércio', 'comercio', 'algodão', 'algodao', 'cotton',
-        'industrial', 'exportação', 'exportadora', 'comercial',
-        'holding', 'corporation', 'corp', 'inc', 'cooperative',
-        'cooperativa', 'agrônoma', 'agronoma', 'sementes',
-        'agricultura', 'ranch', 'farm', 'agribusiness',
-        'algodoeira', 'agricola', 'agroindustrial', 'cooperativa'
-    ]
+    if nome in os.environ:
+        return os.environ[nome]
+    try:
+        return st.secrets.get(nome, padrao)
+    except Exception:
+        # Sem secrets.toml configurado
+        return padrao
+
+class CacheSQLite:
+    """
+    Cache chave/valor persistente em SQLite com TTL e despejo LRU.
+
+    Os valores são serializados em JSON. Um valor None é guardado como
+    resultado negativo ("não encontrado") e expira com ttl_negativo.
+    """
+
+    def __init__(self, caminho, tabela, ttl, ttl_negativo, max_itens):
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        self.tabela = tabela
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self.max_itens = max_itens
+        self.acertos = 0
+        self.falhas = 0
+        self._insercoes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {tabela} ("
+            "chave TEXT PRIMARY KEY, valor TEXT, expira_em REAL, acessado_em REAL)"
+        )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{tabela}_acesso ON {tabela} (acessado_em)"
+        )
+        self._conn.commit()
+
+    def obter(self, chave):
+        """
+        Retorna (encontrado, valor). Um acerto negativo retorna (True, None).
+        """
+        agora = time.time()
+        with self._lock:
+            linha = self._conn.execute(
+                f"SELECT valor, expira_em FROM {self.tabela} WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None or linha[1] < agora:
+                if linha is not None:
+                    self._conn.execute(f"DELETE FROM {self.tabela} WHERE chave = ?", (chave,))
+                    self._conn.commit()
+                self.falhas += 1
+                return False, None
+            # Atualiza o último acesso para o despejo LRU
+            self._conn.execute(
+                f"UPDATE {self.tabela} SET acessado_em = ? WHERE chave = ?", (agora, chave)
+            )
+            self._conn.commit()
+            self.acertos += 1
+            return True, json.loads(linha[0])
+
+    def salvar(self, chave, valor):
+        agora = time.time()
+        ttl = self.ttl_negativo if valor is None else self.ttl
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.tabela} (chave, valor, expira_em, acessado_em) "
+                "VALUES (?, ?, ?, ?)",
+                (chave, json.dumps(valor, ensure_ascii=False), agora + ttl, agora)
+            )
+            self._insercoes += 1
+            # Verifica o limite de tamanho periodicamente, não a cada inserção
+            if self._insercoes % 100 == 0:
+                self._despejar(agora)
+            self._conn.commit()
+
+    def _despejar(self, agora):
+        self._conn.execute(f"DELETE FROM {self.tabela} WHERE expira_em < ?", (agora,))
+        total = self._conn.execute(f"SELECT COUNT(*) FROM {self.tabela}").fetchone()[0]
+        excesso = total - self.max_itens
+        if excesso > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.tabela} WHERE chave IN ("
+                f"SELECT chave FROM {self.tabela} ORDER BY acessado_em ASC LIMIT ?)",
+                (excesso,)
+            )
+
+    def obter_varios(self, chaves):
+        """
+        Busca várias chaves de uma vez. Retorna {chave: valor} só com os acertos.
+        """
+        agora = time.time()
+        encontrados = {}
+        with self._lock:
+            for inicio in range(0, len(chaves), 500):
+                lote = chaves[inicio:inicio + 500]
+                marcadores = ','.join('?' * len(lote))
+                linhas = self._conn.execute(
+                    f"SELECT chave, valor FROM {self.tabela} "
+                    f"WHERE chave IN ({marcadores}) AND expira_em >= ?",
+                    (*lote, agora)
+                ).fetchall()
+                for chave, valor in linhas:
+                    encontrados[chave] = json.loads(valor)
+            self._conn.executemany(
+                f"UPDATE {self.tabela} SET acessado_em = ? WHERE chave = ?",
+                [(agora, chave) for chave in encontrados]
+            )
+            self._conn.commit()
+            self.acertos += len(encontrados)
+            self.falhas += len(chaves) - len(encontrados)
+        return encontrados
+
+    def salvar_varios(self, itens):
+        agora = time.time()
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.tabela} (chave, valor, expira_em, acessado_em) "
+                "VALUES (?, ?, ?, ?)",
+                [(chave, json.dumps(valor, ensure_ascii=False), agora + self.ttl, agora)
+                 for chave, valor in itens.items()]
+            )
+            self._insercoes += len(itens)
+            self._despejar(agora)
+            self._conn.commit()
+
+    def limpar(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.tabela}")
+            self._conn.commit()
+
+@st.cache_resource(show_spinner=False)
+def obter_cache_geocodificacao():
+    """
+    Cache de geocodificação compartilhado entre sessões e reinicializações
+    """
+    return CacheSQLite(
+        os.path.join(DIRETORIO_CACHE, "geocodificacao.sqlite"),
+        "geocodificacao",
+        ttl=float(obter_configuracao("GEOCODE_CACHE_TTL_DIAS", 30)) * 86400,
+        ttl_negativo=float(obter_configuracao("GEOCODE_CACHE_TTL_NEGATIVO_HORAS", 24)) * 3600,
+        max_itens=int(obter_configuracao("GEOCODE_CACHE_MAX_ITENS", 100000))
+    )
+
+# ==============================================================================
+# CAMADA HTTP COMPARTILHADA
+# ==============================================================================
+
+@st.cache_resource(show_spinner=False)
+def obter_sessao_http():
+    """
+    Sessão HTTP única do processo (scraping, ORS e Nominatim), com pool de
+    conexões keep-alive e novas tentativas com backoff exponencial e jitter
+    para falhas de conexão, 429 e 5xx (respeitando Retry-After)
+    """
+    tentativas = Retry(
+        total=int(obter_configuracao("HTTP_TENTATIVAS", 3)),
+        backoff_factor=float(obter_configuracao("HTTP_BACKOFF", 0.5)),
+        backoff_jitter=float(obter_configuracao("HTTP_BACKOFF_JITTER", 0.5)),
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({'GET', 'POST'}),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    tamanho_pool = max(10, int(obter_configuracao("GEOCODE_WORKERS", 4)) * 2)
+    adaptador = HTTPAdapter(pool_connections=10, pool_maxsize=tamanho_pool, max_retries=tentativas)
+    sessao = requests.Session()
+    sessao.mount("http://", adaptador)
+    sessao.mount("https://", adaptador)
+    return sessao
+
+class AdaptadorGeopy(RequestsAdapter):
+    """
+    Adaptador do geopy que usa a sessão HTTP compartilhada
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.session.close()
+        self.session = obter_sessao_http()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def __del__(self):
+        # A sessão é compartilhada e não deve ser fechada junto com o geocodificador
+        pass
+
+class CachePaginas:
+    """
+    Cache em disco das páginas baixadas, com os validadores (ETag e
+    Last-Modified) usados nas requisições condicionais.
+
+    Uma página salva como pendente só passa a valer (e a gerar 304) depois
+    de confirmada, quando seus registros já foram processados; se algo
+    falhar antes disso, a próxima coleta baixa e processa a página de novo.
+    """
+
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _caminho(self, url, extensao):
+        return os.path.join(self.diretorio, hashlib.sha1(url.encode('utf-8')).hexdigest() + extensao)
+
+    def obter(self, url):
+        """
+        Retorna (metadados, conteúdo) da última versão baixada, ou (None, None)
+        """
+        try:
+            with open(self._caminho(url, ".json"), encoding='utf-8') as arquivo:
+                metadados = json.load(arquivo)
+            with open(self._caminho(url, ".html"), 'rb') as arquivo:
+                return metadados, arquivo.read()
+        except (OSError, ValueError):
+            return None, None
+
+    def salvar(self, url, response, pendente=False):
+        sufixo = ".pendente" if pendente else ""
+        # Conteúdo antes dos metadados: validadores nunca apontam para um corpo ausente
+        with open(self._caminho(url, sufixo + ".html"), 'wb') as arquivo:
+            arquivo.write(response.content)
+        metadados = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'baixada_em': time.time()
+        }
+        with open(self._caminho(url, sufixo + ".json"), 'w', encoding='utf-8') as arquivo:
+            json.dump(metadados, arquivo)
+
+    def confirmar(self, urls):
+        """
+        Promove as versões pendentes das páginas a versões válidas
+        """
+        for url in urls:
+            try:
+                os.replace(self._caminho(url, ".pendente.html"), self._caminho(url, ".html"))
+                os.replace(self._caminho(url, ".pendente.json"), self._caminho(url, ".json"))
+            except OSError:
+                # Página sem versão pendente (respondeu 304)
+                pass
+
+    def limpar(self):
+        for nome in os.listdir(self.diretorio):
+            os.remove(os.path.join(self.diretorio, nome))
+
+@st.cache_resource(show_spinner=False)
+def obter_cache_paginas():
+    return CachePaginas(os.path.join(DIRETORIO_CACHE, "paginas"))
+
+def baixar_pagina(url, headers=None, timeout=30, confirmar=True):
+    """
+    Baixa uma página com GET condicional. Retorna (conteúdo, alterada):
+    quando o servidor responde 304, o conteúdo vem do cache em disco e
+    alterada é False. Com confirmar=False a nova versão fica pendente até
+    obter_cache_paginas().confirmar([url]).
+    """
+    cache = obter_cache_paginas()
+    metadados, conteudo = cache.obter(url)
     
-    nome_lower = nome.lower()
+    cabecalhos = dict(headers or {})
+    if metadados:
+        if metadados.get('etag'):
+            cabecalhos['If-None-Match'] = metadados['etag']
+        if metadados.get('last_modified'):
+            cabecalhos['If-Modified-Since'] = metadados['last_modified']
     
-    for keyword in keywords:
-        if keyword in nome_lower:
-            return True
+    response = obter_sessao_http().get(url, headers=cabecalhos, timeout=timeout)
+    if response.status_code == 304 and conteudo is not None:
+        return conteudo, False
+    response.raise_for_status()
     
-    if re.search(r'\b(ltda|s\.a|s/a|eireli|mei|me)\b', nome_lower):
-        return True
+    # Servidores sem validadores: compara o conteúdo com a última versão
+    alterada = conteudo != response.content
+    cache.salvar(url, response, pendente=not confirmar)
+    return response.content, alterada
+
+# ==============================================================================
+# GAZETTEER DOS MUNICÍPIOS DE MT
+# ==============================================================================
+
+ARQUIVO_MUNICIPIOS_MT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "dados", "municipios_mt.csv"
+)
+
+class GazetteerMT:
+    """
+    Municípios de Mato Grosso com variantes de nome e coordenadas da sede,
+    carregados do CSV em dados/ e compilados em um único matcher.
+    """
+
+    def __init__(self, caminho):
+        self.municipios = pd.read_csv(caminho, dtype={'Variantes': str}).set_index('Municipio')
         
-    return False
+        # Variante normalizada -> nome oficial
+        self.variantes = {}
+        for municipio, variantes in self.municipios['Variantes'].fillna('').items():
+            nomes = [municipio] + [v for v in variantes.split('|') if v]
+            for chave in normalizar_serie(pd.Series(nomes)):
+                self.variantes[chave] = municipio
+        
+        self.padrao = regex_de_trie(self.variantes)
+
+    def detectar(self, texto):
+        """
+        Retorna o nome oficial do primeiro município citado no texto, ou None
+        """
+        encontrado = self.padrao.search(normalizar_serie(pd.Series([texto])).iloc[0])
+        return self.variantes[encontrado.group(1)] if encontrado else None
+
+    def detectar_em_serie(self, serie):
+        """
+        Detecta municípios em uma coluna inteira em uma única passada
+        """
+        encontrados = normalizar_serie(serie).str.extract(self.padrao, expand=False)
+        return encontrados.map(self.variantes)
+
+    def coordenadas(self, municipio):
+        """
+        Retorna (lat, lon) da sede do município, aceitando qualquer variante do nome
+        """
+        if not municipio:
+            return None
+        municipio = self.variantes.get(normalizar_serie(pd.Series([municipio])).iloc[0])
+        if municipio is None:
+            return None
+        linha = self.municipios.loc[municipio]
+        return float(linha['Latitude']), float(linha['Longitude'])
+
+    def nome_oficial(self, municipio):
+        if not municipio:
+            return None
+        return self.variantes.get(normalizar_serie(pd.Series([municipio])).iloc[0])
+
+@st.cache_resource(show_spinner=False)
+def obter_gazetteer():
+    return GazetteerMT(ARQUIVO_MUNICIPIOS_MT)
+
+# ==============================================================================
+# FUNÇÕES AUXILIARES - GEOCODIFICAÇÃO MELHORADA
+# ==============================================================================
+
+class LimitadorTaxa:
+    """
+    Token bucket thread-safe: libera até `taxa` requisições por segundo,
+    permitindo rajadas de até `capacidade` requisições.
+    """
+
+    def __init__(self, taxa, capacidade=1):
+        self.taxa = float(taxa)
+        self.capacidade = float(capacidade)
+        self._tokens = float(capacidade)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.taxa
+            time.sleep(espera)
+
+@st.cache_resource(show_spinner=False)
+def obter_limitador(provedor, taxa, capacidade=1):
+    """
+    Limitador compartilhado por provedor entre todas as sessões
+    """
+    return LimitadorTaxa(taxa, capacidade)
+
+@st.cache_resource(show_spinner=False)
+def obter_geocodificador():
+    """
+    Retorna a função de geocodificação do Nominatim configurado.
+
+    Por padrão usa o servidor público (1 requisição/s). Com NOMINATIM_URL
+    apontando para uma instância própria, a taxa passa a ser
+    NOMINATIM_REQ_POR_SEGUNDO (padrão 10).
+    """
+    url_nominatim = obter_configuracao("NOMINATIM_URL", "")
+    
+    if url_nominatim:
+        url = urlparse(url_nominatim)
+        geolocator = Nominatim(
+            user_agent="algodoeiras_mt_app_v8",
+            domain=url.netloc + url.path.rstrip('/'),
+            scheme=url.scheme or 'https',
+            adapter_factory=AdaptadorGeopy
+        )
+        taxa = float(obter_configuracao("NOMINATIM_REQ_POR_SEGUNDO", 10))
+        limitador = obter_limitador(url.netloc, taxa, capacidade=max(1, int(taxa)))
+    else:
+        geolocator = Nominatim(user_agent="algodoeiras_mt_app_v8", adapter_factory=AdaptadorGeopy)
+        limitador = obter_limitador("nominatim.openstreetmap.org", 1)
+    
+    # As novas tentativas ficam com a sessão HTTP compartilhada; a taxa fica com o token bucket
+    def geocode_limitado(*args, **kwargs):
+        limitador.adquirir()
+        return geolocator.geocode(*args, **kwargs)
+    
+    return geocode_limitado
 
-def geocodificar_empresa(nome, cidade="Mato Grosso", estado="MT", tipo="Algodoeira"):
+def consultar_nominatim(consulta, timeout=15):
     """
-    Geocodifica uma empresa individual com estratégias aprimoradas
+    Consulta o Nominatim passando antes pelo cache persistente.
+    Retorna um Location do geopy ou None quando nada é encontrado.
+    Erros de rede são propagados e não ficam no cache.
     """
-    geolocator = Nominatim(user_agent="algodoeiras_mt_app_v8")
+    cache = obter_cache_geocodificacao()
+    chave = normalizar_texto(consulta)
     
+    encontrado, raw = cache.obter(chave)
+    if not encontrado:
+        location = obter_geocodificador()(consulta, timeout=timeout)
+        raw = location.raw if location else None
+        cache.salvar(chave, raw)
+    
+    if raw is None:
+        return None
+    return Location(raw.get('display_name', consulta), (float(raw['lat']), float(raw['lon'])), raw)
+
+# Confiança de cada estratégia de consulta quando o Nominatim encontra a empresa
+ESTRATEGIAS_GEOCODIFICACAO = {
+    'endereco': 1.0,
+    'nome_cidade': 1.0,
+    'nome_canonico_cidade': 0.9,
+    'tipo_nome_cidade': 0.9,
+    'nome_algodao_cidade': 0.8,
+    'nome_estado': 0.6,
+    'cidade': 0.3
+}
+# Classes do OSM que descrevem uma localidade, e não o estabelecimento
+CLASSES_LOCALIDADE = {'place', 'boundary'}
+CONFIANCA_CENTROIDE_CIDADE = 0.2
+CONFIANCA_CENTROIDE_ESTADO = 0.05
+CONFIANCA_SUFICIENTE = 0.85
+CENTROIDE_MT = (-12.6819, -56.9211)
+
+def avaliar_confianca(estrategia, raw, distancia_cidade_km=None):
+    """
+    Confiança (0 a 1) de um resultado do Nominatim: o peso da estratégia
+    que encontrou a empresa, limitado quando o resultado é uma localidade,
+    reduzido quando cai longe do município detectado e ajustado pela
+    importância informada pelo Nominatim
+    """
+    confianca = ESTRATEGIAS_GEOCODIFICACAO[estrategia]
+    if raw.get('class') in CLASSES_LOCALIDADE:
+        confianca = min(confianca, CONFIANCA_CENTROIDE_CIDADE + 0.1)
+    if distancia_cidade_km is not None:
+        if distancia_cidade_km > 50:
+            confianca *= 0.5
+        elif distancia_cidade_km > 15:
+            confianca *= 0.8
+    importancia = float(raw.get('importance') or 0)
+    confianca *= 0.85 + 0.15 * min(importancia / 0.5, 1.0)
+    return round(confianca, 3)
+
+def proveniencia(metodo, confianca, consulta=None, raw=None, distancia_cidade_km=None, aproximada=False):
+    """
+    Colunas de proveniência da geocodificação de uma empresa
+    """
+    raw = raw or {}
+    return {
+        'Confianca': confianca,
+        'Metodo': metodo,
+        'Consulta': consulta,
+        'Importancia': float(raw['importance']) if raw.get('importance') is not None else None,
+        'ClasseOSM': f"{raw['class']}/{raw.get('type', '')}" if raw.get('class') else None,
+        'DistanciaCidadeKm': round(float(distancia_cidade_km), 2) if distancia_cidade_km is not None else None,
+        'Aproximada': int(aproximada)
+    }
+
+def geocodificar_empresa(nome, cidade="Mato Grosso", estado="MT", tipo="Algodoeira", cidade_detectada=None,
+                         endereco=None, aprofundar=False):
+    """
+    Geocodifica uma empresa individual com estratégias aprimoradas.
+    Em lotes, cidade_detectada pode vir pré-calculada por detectar_em_serie.
+
+    Normalmente fica com o primeiro resultado dentro de MT. Com
+    aprofundar=True (regeocodificação) tenta também o endereço conhecido e
+    o nome sem sufixos societários, e fica com o resultado de maior
+    confiança. O resultado inclui as colunas de proveniência.
+    """
     try:
-        # Dicionário de cidades importantes de MT para melhorar a precisão
-        cidades_mt_coordenadas = {
-            'sinop': (-11.8484, -55.5126),
-            'cuiabá': (-15.6010, -56.0974),
-            'cuiaba': (-15.6010, -56.0974),
-            'rondonópolis': (-16.4676, -54.6378),
-            'rondonopolis': (-16.4676, -54.6378),
-            'lucas do rio verde': (-13.0678, -55.9125),
-            'sorriso': (-12.5425, -55.7211),
-            'tangará da serra': (-14.6229, -57.4823),
-            'campo verde': (-15.5454, -55.1626),
-            'nova mutum': (-13.8234, -56.0731),
-            'primavera do leste': (-15.5601, -54.2971),
-            'campo novo do parecis': (-13.6747, -57.8931)
-        }
+        gazetteer = obter_gazetteer()
         
-        # Verifica se o nome da empresa contém referência a cidades
-        cidade_detectada = cidade
-        for cidade_chave, coords in cidades_mt_coordenadas.items():
-            if cidade_chave in nome.lower():
-                cidade_detectada = cidade_chave.title()
-                break
+        # Verifica se o nome da empresa contém referência a municípios de MT
+        if cidade_detectada is None:
+            cidade_detectada = (gazetteer.detectar(nome) or
+                                gazetteer.nome_oficial(cidade) or
+                                cidade)
+        coordenadas_cidade = gazetteer.coordenadas(cidade_detectada)
         
         # Estratégias de busca melhoradas
         queries = [
-            f"{nome}, {cidade_detectada}, {estado}, Brasil",
-            f"{nome}, {estado}, Brasil",
-            f"{tipo} {nome}, {cidade_detectada}, {estado}, Brasil",
-            f"{nome} algodão, {cidade_detectada}, {estado}, Brasil",
-            f"{cidade_detectada}, {estado}, Brasil"
+            ('nome_cidade', f"{nome}, {cidade_detectada}, {estado}, Brasil"),
+            ('nome_estado', f"{nome}, {estado}, Brasil"),
+            ('tipo_nome_cidade', f"{tipo} {nome}, {cidade_detectada}, {estado}, Brasil"),
+            ('nome_algodao_cidade', f"{nome} algodão, {cidade_detectada}, {estado}, Brasil")
         ]
+        if aprofundar:
+            queries.insert(1, ('nome_canonico_cidade', f"{nomes_canonicos([nome]).iat[0]}, {cidade_detectada}, {estado}, Brasil"))
+            if endereco and not str(endereco).startswith("Localização aproximada"):
+                queries.insert(0, ('endereco', str(endereco)))
+        # Municípios conhecidos usam as coordenadas do gazetteer, sem consulta à rede
+        if coordenadas_cidade is None:
+            queries.append(('cidade', f"{cidade_detectada}, {estado}, Brasil"))
         
-        location = None
-        for query in queries:
+        melhor = None
+        for estrategia, query in queries:
             try:
-                location = geolocator.geocode(query, timeout=15)
-                if location and location.latitude and location.longitude:
-                    # Verifica se a localização está em Mato Grosso
-                    if -18.0 < location.latitude < -8.0 and -62.0 < location.longitude < -50.0:
-                        break
-                    else:
-                        location = None  # Descarta localizações fora de MT
+                location = consultar_nominatim(query)
             except Exception as e:
                 continue
+            if not (location and location.latitude and location.longitude):
+                continue
+            # Descarta localizações fora de Mato Grosso
+            if not (-18.0 < location.latitude < -8.0 and -62.0 < location.longitude < -50.0):
+                continue
+            
+            distancia = None
+            if coordenadas_cidade is not None:
+                distancia = float(haversine_km(*coordenadas_cidade, location.latitude, location.longitude))
+            confianca = avaliar_confianca(estrategia, location.raw, distancia)
+            if melhor is None or confianca > melhor[0]:
+                melhor = (confianca, estrategia, query, location, distancia)
+            if not aprofundar or confianca >= CONFIANCA_SUFICIENTE:
+                break
         
-        if location and location.latitude and location.longitude:
-            endereco = location.address
-            latitude = location.latitude
-            longitude = location.longitude
+        # Um resultado pior que o centroide do município (longe dele, ou só a
+        # localidade) dá lugar ao centroide
+        if melhor and coordenadas_cidade is not None and melhor[0] < CONFIANCA_CENTROIDE_CIDADE:
+            melhor = None
+        
+        if melhor:
+            confianca, estrategia, query, location, distancia = melhor
             
             # Extrai cidade do endereço
             address_dict = location.raw.get('address', {})
@@ -132,15 +613,17 @@ def geocodificar_empresa(nome, cidade="Mato Grosso", estado="MT", tipo="Algodoei
                 'Tipo': tipo,
                 'Cidade': cidade_final,
                 'Estado': estado,
-                'Latitude': latitude,
-                'Longitude': longitude,
-                'Endereco': endereco,
-                'Fonte': 'Manual'
+                'Latitude': location.latitude,
+                'Longitude': location.longitude,
+                'Endereco': location.address,
+                'Fonte': 'Manual',
+                **proveniencia(f"nominatim:{estrategia}", confianca, query, location.raw, distancia,
+                               aproximada=estrategia == 'cidade')
             }
         else:
             # Fallback: usa coordenadas da cidade específica se detectada
-            if cidade_detectada.lower() in cidades_mt_coordenadas:
-                lat, lon = cidades_mt_coordenadas[cidade_detectada.lower()]
+            if coordenadas_cidade is not None:
+                lat, lon = coordenadas_cidade
                 return {
                     'Nome': nome,
                     'Telefone': "Não Informado", 
@@ -150,7 +633,8 @@ def geocodificar_empresa(nome, cidade="Mato Grosso", estado="MT", tipo="Algodoei
                     'Latitude': lat,
                     'Longitude': lon,
                     'Endereco': f"Localização aproximada - {cidade_detectada}, {estado}",
-                    'Fonte': 'Manual (Cidade Aproximada)'
+                    'Fonte': 'Manual (Cidade Aproximada)',
+                    **proveniencia('centroide_cidade', CONFIANCA_CENTROIDE_CIDADE, distancia_cidade_km=0.0, aproximada=True)
                 }
             else:
                 # Fallback geral para Mato Grosso
@@ -160,10 +644,11 @@ def geocodificar_empresa(nome, cidade="Mato Grosso", estado="MT", tipo="Algodoei
                     'Tipo': tipo, 
                     'Cidade': cidade_detectada,
                     'Estado': estado,
-                    'Latitude': -12.6819,
-                    'Longitude': -56.9211,
+                    'Latitude': CENTROIDE_MT[0],
+                    'Longitude': CENTROIDE_MT[1],
                     'Endereco': f"Localização aproximada - {cidade_detectada}, {estado}",
-                    'Fonte': 'Manual (Aproximado)'
+                    'Fonte': 'Manual (Aproximado)',
+                    **proveniencia('centroide_estado', CONFIANCA_CENTROIDE_ESTADO, aproximada=True)
                 }
             
     except Exception as e:
@@ -174,67 +659,146 @@ def geocodificar_empresa(nome, cidade="Mato Grosso", estado="MT", tipo="Algodoei
             'Tipo': tipo, 
             'Cidade': cidade,
             'Estado': estado,
-            'Latitude': -12.6819,
-            'Longitude': -56.9211,
+            'Latitude': CENTROIDE_MT[0],
+            'Longitude': CENTROIDE_MT[1],
             'Endereco': f"Localização aproximada - {cidade}, {estado}",
-            'Fonte': 'Manual (Erro)'
+            'Fonte': 'Manual (Erro)',
+            **proveniencia('erro', 0.0, aproximada=True)
         }
 
 # ==============================================================================
 # SISTEMA DE ROTEAMENTO
 # ==============================================================================
 
-def calcular_rota(origem_lat, origem_lon, destino_lat, destino_lon, metodo='carro'):
+PERFIS_ORS = {
+    'carro': 'driving-car',
+    'caminhao': 'driving-hgv'
+}
+
+class ChamadasCompartilhadas:
     """
-    Calcula rota entre dois pontos usando OpenRouteService API
+    Agrupa chamadas idênticas simultâneas: a primeira executa a função e as
+    demais aguardam e recebem o mesmo resultado
     """
-    try:
-        # Usando OpenRouteService (gratuito, requer API key)
-        # Você pode obter uma API key gratuita em: https://openrouteservice.org/
-        api_key = st.secrets.get("OPENROUTE_API_KEY", "5b3ce3597851110001cf6248eac86a1a4c704c65b1a9b1b1f6c5a8a4")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._em_andamento = {}
+
+    def executar(self, chave, funcao):
+        with self._lock:
+            futuro = self._em_andamento.get(chave)
+            lider = futuro is None
+            if lider:
+                futuro = Future()
+                self._em_andamento[chave] = futuro
         
-        url = "https://api.openrouteservice.org/v2/directions/driving-car"
+        if not lider:
+            return futuro.result()
         
-        headers = {
-            'Accept': 'application/json, application/geo+json, application/gpx+json, img/png; charset=utf-8',
-            'Authorization': api_key,
-            'Content-Type': 'application/json; charset=utf-8'
-        }
+        try:
+            resultado = funcao()
+            futuro.set_result(resultado)
+            return resultado
+        except Exception as e:
+            futuro.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._em_andamento[chave]
+
+@st.cache_resource(show_spinner=False)
+def obter_chamadas_ors():
+    return ChamadasCompartilhadas()
+
+@st.cache_resource(show_spinner=False)
+def obter_cache_rotas():
+    """
+    Cache de rotas do OpenRouteService, com a geometria ainda codificada em polyline
+    """
+    return CacheSQLite(
+        os.path.join(DIRETORIO_CACHE, "rotas.sqlite"),
+        "rotas",
+        ttl=float(obter_configuracao("ROTA_CACHE_TTL_DIAS", 7)) * 86400,
+        ttl_negativo=0,
+        max_itens=int(obter_configuracao("ROTA_CACHE_MAX_ITENS", 5000))
+    )
+
+def _cabecalhos_ors():
+    # Usando OpenRouteService (gratuito, requer API key)
+    # Você pode obter uma API key gratuita em: https://openrouteservice.org/
+    api_key = obter_configuracao("OPENROUTE_API_KEY", "5b3ce3597851110001cf6248eac86a1a4c704c65b1a9b1b1f6c5a8a4")
+    
+    return {
+        'Accept': 'application/json, application/geo+json, application/gpx+json, img/png; charset=utf-8',
+        'Authorization': api_key,
+        'Content-Type': 'application/json; charset=utf-8'
+    }
+
+def _requisitar_rota_ors(origem_lat, origem_lon, destino_lat, destino_lon, perfil):
+    """
+    Faz a requisição de rota ao OpenRouteService.
+    Retorna o resumo com a geometria codificada, ou None se não houver rota.
+    """
+    url = f"https://api.openrouteservice.org/v2/directions/{perfil}"
+    
+    body = {
+        "coordinates": [
+            [origem_lon, origem_lat],
+            [destino_lon, destino_lat]
+        ],
+        "instructions": "false",
+        "preference": "recommended"
+    }
+    
+    response = obter_sessao_http().post(url, json=body, headers=_cabecalhos_ors(), timeout=30)
+    
+    if response.status_code == 200:
+        data = response.json()
         
-        body = {
-            "coordinates": [
-                [origem_lon, origem_lat],
-                [destino_lon, destino_lat]
-            ],
-            "instructions": "false",
-            "preference": "recommended"
-        }
+        if 'routes' in data and len(data['routes']) > 0:
+            route = data['routes'][0]
+            return {
+                'geometria': route['geometry'],
+                'distancia_km': round(route['summary']['distance'] / 1000, 1),
+                'duracao_min': round(route['summary']['duration'] / 60, 1)
+            }
+    
+    return None
+
+def calcular_rota(origem_lat, origem_lon, destino_lat, destino_lon, metodo='carro'):
+    """
+    Calcula rota entre dois pontos usando OpenRouteService API.
+
+    Rotas já calculadas vêm do cache em disco (coordenadas arredondadas a
+    ~10 m) e requisições idênticas simultâneas compartilham uma única chamada.
+    """
+    try:
+        perfil = PERFIS_ORS.get(metodo, 'driving-car')
+        chave = (f"{perfil}:{origem_lat:.4f},{origem_lon:.4f}:"
+                 f"{destino_lat:.4f},{destino_lon:.4f}")
+        cache = obter_cache_rotas()
         
-        response = requests.post(url, json=body, headers=headers, timeout=30)
+        def buscar():
+            encontrado, rota = cache.obter(chave)
+            if not encontrado:
+                rota = _requisitar_rota_ors(origem_lat, origem_lon, destino_lat, destino_lon, perfil)
+                if rota:
+                    cache.salvar(chave, rota)
+            return rota
         
-        if response.status_code == 200:
-            data = response.json()
+        rota = obter_chamadas_ors().executar(chave, buscar)
+        
+        if rota:
+            # Decodifica a geometria polyline no formato [lat, lon]
+            coordinates = polyline.decode(rota['geometria'], 5)
             
-            if 'routes' in data and len(data['routes']) > 0:
-                route = data['routes'][0]
-                geometry = route['geometry']
-                
-                # Decodifica a geometria polyline
-                coordinates = polyline.decode(geometry, 5)
-                
-                # Converte para formato [lat, lon]
-                route_coordinates = [[lat, lon] for lat, lon in coordinates]
-                
-                # Calcula distância e duração
-                distance_km = route['summary']['distance'] / 1000
-                duration_min = route['summary']['duration'] / 60
-                
-                return {
-                    'rota_coordenadas': route_coordinates,
-                    'distancia_km': round(distance_km, 1),
-                    'duracao_min': round(duration_min, 1),
-                    'sucesso': True
-                }
+            return {
+                'rota_coordenadas': [[lat, lon] for lat, lon in coordinates],
+                'distancia_km': rota['distancia_km'],
+                'duracao_min': rota['duracao_min'],
+                'sucesso': True
+            }
         
         # Fallback: linha reta se a API falhar
         return {
@@ -260,280 +824,2374 @@ def calcular_distancia_reta(lat1, lon1, lat2, lon2):
     """
     Calcula distância em linha reta entre dois pontos (fórmula de Haversine)
     """
-    from math import radians, sin, cos, sqrt, atan2
-    
+    return round(float(haversine_km(lat1, lon1, lat2, lon2)), 1)
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Mesma fórmula de calcular_distancia_reta, vetorizada com NumPy.
+    Aceita escalares ou arrays e segue as regras de broadcasting.
+    """
     R = 6371  # Raio da Terra em km
     
-    lat1_rad = radians(lat1)
-    lon1_rad = radians(lon1)
-    lat2_rad = radians(lat2)
-    lon2_rad = radians(lon2)
+    lat1_rad, lon1_rad, lat2_rad, lon2_rad = (
+        np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2)
+    )
     
     dlat = lat2_rad - lat1_rad
     dlon = lon2_rad - lon1_rad
     
-    a = sin(dlat/2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    
-    return round(R * c, 1)
-
-def geocodificar_endereco(endereco):
-    """
-    Geocodifica um endereço para coordenadas
-    """
-    geolocator = Nominatim(user_agent="algodoeiras_mt_app_v8")
+    a = np.sin(dlat/2)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon/2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
     
-    try:
-        location = geolocator.geocode(f"{endereco}, Mato Grosso, Brasil", timeout=15)
-        if location:
-            return {
-                'endereco': location.address,
-                'latitude': location.latitude,
-                'longitude': location.longitude,
-                'sucesso': True
-            }
-        else:
-            return {
-                'sucesso': False,
-                'erro': 'Endereço não encontrado'
-            }
-    except Exception as e:
-        return {
-            'sucesso': False,
-            'erro': str(e)
-        }
+    return R * c
 
 # ==============================================================================
-# WEB SCRAPING (mantido igual)
+# ÍNDICE ESPACIAL
 # ==============================================================================
 
-@st.cache_data(show_spinner=False, ttl=3600)
-def carregar_cooperativas():
+class IndiceEspacial:
     """
-    Web scraping robusto para cooperativas com múltiplas estratégias
+    Índice em grade regular (células de `tamanho_celula` graus) sobre as
+    posições das empresas no DataFrame. Aceita inserções incrementais e
+    responde consultas de vizinhos mais próximos e de raio visitando só as
+    células próximas ao ponto consultado.
     """
-    st.write("🏢 Coletando dados de cooperativas...")
-    
-    url = "https://ampa.com.br/consulta-cooperativas/"
-    lista_cooperativas = []
-    
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'pt-BR,pt;q=0.9,en;q=0.8',
-        }
-        
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
+
+    KM_POR_GRAU = 111.32
+
+    def __init__(self, tamanho_celula=0.25, geracao=None):
+        self.tamanho_celula = tamanho_celula
+        self.geracao = geracao
+        self.celulas = {}
+        self.latitudes = np.empty(0)
+        self.longitudes = np.empty(0)
+        self.nomes = []
+
+    @property
+    def n(self):
+        return len(self.nomes)
+
+    def _celula(self, lat, lon):
+        return int(np.floor(lat / self.tamanho_celula)), int(np.floor(lon / self.tamanho_celula))
+
+    def adicionar(self, latitudes, longitudes, nomes):
+        """
+        Indexa novas linhas; as posições continuam a numeração atual
+        """
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        inicio = self.n
         
-        # ESTRATÉGIA 1: Buscar por tabelas tradicionais
-        tabelas = soup.find_all('table')
-        st.write(f"🔍 Encontradas {len(tabelas)} tabelas na página")
+        validos = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        linhas = np.floor(latitudes[validos] / self.tamanho_celula).astype(int)
+        colunas = np.floor(longitudes[validos] / self.tamanho_celula).astype(int)
+        for posicao, linha, coluna in zip(np.flatnonzero(validos) + inicio, linhas, colunas):
+            self.celulas.setdefault((linha, coluna), []).append(posicao)
         
-        # ESTRATÉGIA 2: Buscar por divs que podem conter tabelas
-        divs_com_tabelas = soup.find_all('div', class_=re.compile(r'table|wrapper|content', re.I))
-        st.write(f"🔍 Encontrados {len(divs_com_tabelas)} divs que podem conter tabelas")
+        self.latitudes = np.concatenate([self.latitudes, latitudes])
+        self.longitudes = np.concatenate([self.longitudes, longitudes])
+        self.nomes.extend(nomes)
+
+    def compativel(self, df):
+        """
+        Verifica se o DataFrame apenas cresceu desde a última indexação
+        """
+        if self.n > len(df):
+            return False
+        if self.n == 0:
+            return True
+        nomes = df['Nome']
+        return nomes.iat[0] == self.nomes[0] and nomes.iat[self.n - 1] == self.nomes[-1]
+
+    def _candidatos_anel(self, linha, coluna, raio):
+        posicoes = []
+        for i in range(linha - raio, linha + raio + 1):
+            for j in range(coluna - raio, coluna + raio + 1):
+                if max(abs(i - linha), abs(j - coluna)) == raio:
+                    posicoes.extend(self.celulas.get((i, j), ()))
+        return posicoes
+
+    def mais_proximos(self, lat, lon, k, mascara=None):
+        """
+        Retorna (posições, distâncias em km) dos k pontos mais próximos.
+        `mascara` opcional restringe as posições elegíveis.
+        """
+        if not self.celulas or k <= 0:
+            return np.empty(0, dtype=int), np.empty(0)
         
-        # ESTRATÉGIA 3: Buscar diretamente por dados estruturados
-        texto_completo = soup.get_text()
-        linhas = texto_completo.split('\n')
+        linha, coluna = self._celula(lat, lon)
+        linhas = [c[0] for c in self.celulas]
+        colunas = [c[1] for c in self.celulas]
+        raio_maximo = max(abs(linha - min(linhas)), abs(linha - max(linhas)),
+                          abs(coluna - min(colunas)), abs(coluna - max(colunas)))
+        # Anéis mais próximos que a grade ocupada estão vazios
+        raio_inicial = max(0, min(linhas) - linha, linha - max(linhas),
+                           min(colunas) - coluna, coluna - max(colunas))
         
-        st.write("📝 Analisando conteúdo da página...")
+        posicoes = np.empty(0, dtype=int)
+        distancias = np.empty(0)
+        for raio in range(raio_inicial, raio_maximo + 1):
+            novas = np.array(self._candidatos_anel(linha, coluna, raio), dtype=int)
+            if mascara is not None and len(novas):
+                novas = novas[mascara[novas]]
+            if len(novas):
+                posicoes = np.concatenate([posicoes, novas])
+                distancias = np.concatenate([
+                    distancias,
+                    haversine_km(lat, lon, self.latitudes[novas], self.longitudes[novas])
+                ])
+            
+            # Qualquer ponto fora dos anéis visitados está a pelo menos esta distância
+            if len(posicoes) >= k:
+                lat_limite = min(abs(lat) + (raio + 1) * self.tamanho_celula, 89.0)
+                distancia_minima_fora = (raio * self.tamanho_celula * self.KM_POR_GRAU *
+                                         np.cos(np.radians(lat_limite)))
+                if np.partition(distancias, k - 1)[k - 1] <= distancia_minima_fora:
+                    break
         
-        # Padrões para identificar cooperativas
-        padroes_cooperativas = [
-            r'([A-Z][A-Za-z\s&]+)\s+([A-Z][A-Za-z\s]+Cooperativa[A-Za-z\s]+)\s+([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})\s+(\(?\d{2}\)?[\s-]?\d{4,5}[\s-]?\d{4})',
-            r'([A-Z][A-Za-z\s&]+)\s+([A-Z][A-Za-z\s]+)\s+([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})\s+(\(?\d{2}\)?[\s-]?\d{4,5}[\s-]?\d{4})',
-        ]
+        ordem = np.argsort(distancias)[:k]
+        return posicoes[ordem], distancias[ordem]
+
+    def dentro_do_raio(self, lat, lon, raio_km, mascara=None):
+        """
+        Retorna (posições, distâncias em km) de todos os pontos até raio_km,
+        ordenados pela distância
+        """
+        delta_lat = raio_km / self.KM_POR_GRAU
+        delta_lon = raio_km / (self.KM_POR_GRAU * max(np.cos(np.radians(abs(lat) + delta_lat)), 0.01))
+        linha_min, coluna_min = self._celula(lat - delta_lat, lon - delta_lon)
+        linha_max, coluna_max = self._celula(lat + delta_lat, lon + delta_lon)
         
-        cooperativas_encontradas = 0
+        candidatos = []
+        for (linha, coluna), posicoes in self.celulas.items():
+            if linha_min <= linha <= linha_max and coluna_min <= coluna <= coluna_max:
+                candidatos.extend(posicoes)
+        candidatos = np.array(candidatos, dtype=int)
+        if mascara is not None and len(candidatos):
+            candidatos = candidatos[mascara[candidatos]]
         
-        for linha in linhas:
-            linha_limpa = linha.strip()
-            
-            # Pula linhas muito curtas ou claramente não-dados
-            if len(linha_limpa) < 10 or len(linha_limpa) > 200:
-                continue
-                
-            # Verifica se parece ser uma linha de dados de cooperativa
-            if any(palavra in linha_limpa.lower() for palavra in ['cooperativa', 'caap', 'email', '@', '(', ')']):
-                # Tenta extrair dados usando regex
-                for padrao in padroes_cooperativas:
-                    matches = re.findall(padrao, linha_limpa)
-                    if matches:
-                        for match in matches:
-                            if len(match) >= 2:
-                                fantasia = match[0].strip()
-                                nome_cooperativa = match[1].strip()
-                                email = match[2] if len(match) > 2 else "Não Informado"
-                                telefone = match[3] if len(match) > 3 else "Não Informado"
-                                
-                                # Prefere o nome completo da cooperativa
-                                nome_final = nome_cooperativa if 'cooperativa' in nome_cooperativa.lower() else fantasia
-                                
-                                if nome_final and is_pessoa_juridica(nome_final):
-                                    lista_cooperativas.append({
-                                        'Nome': nome_final,
-                                        'Telefone': telefone,
-                                        'Email': email,
-                                        'Tipo': 'Cooperativa',
-                                        'Cidade': 'Mato Grosso',
-                                        'Estado': 'MT'
-                                    })
-                                    cooperativas_encontradas += 1
-        
-        st.write(f"📊 Total de cooperativas identificadas: {cooperativas_encontradas}")
-        
-        if lista_cooperativas:
-            df = pd.DataFrame(lista_cooperativas)
-            df = df.drop_duplicates(subset=['Nome'])
-            st.success(f"✅ Cooperativas: {len(df)} encontradas")
-            return geocodificar_empresas_em_lote(df)
-        else:
-            st.warning("Nenhuma cooperativa encontrada automaticamente.")
-            return pd.DataFrame()
-            
-    except Exception as e:
-        st.error(f"❌ Erro ao coletar cooperativas: {str(e)}")
-        return pd.DataFrame()
+        distancias = haversine_km(lat, lon, self.latitudes[candidatos], self.longitudes[candidatos])
+        dentro = distancias <= raio_km
+        ordem = np.argsort(distancias[dentro])
+        return candidatos[dentro][ordem], distancias[dentro][ordem]
 
-@st.cache_data(show_spinner=False, ttl=3600)
-def carregar_associados_ativos():
+def obter_indice_espacial(df, geracao=None):
     """
-    Web scraping robusto para associados ativos com múltiplas estratégias
+    Retorna o índice espacial das empresas da sessão. Quando o DataFrame só
+    ganhou linhas no fim, apenas as novas são indexadas; `geracao` muda
+    quando linhas existentes foram alteradas e força a reconstrução.
     """
-    st.write("👥 Coletando dados de associados ativos...")
+    indice = st.session_state.get('indice_espacial')
+    if indice is None or not indice.compativel(df) or indice.geracao != geracao:
+        indice = IndiceEspacial(geracao=geracao)
     
-    url = "https://ampa.com.br/consulta-associados-ativos/"
-    lista_associados = []
+    if indice.n < len(df):
+        novas = df.iloc[indice.n:]
+        indice.adicionar(novas['Latitude'], novas['Longitude'], novas['Nome'].tolist())
     
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'pt-BR,pt;q=0.9,en;q=0.8',
-        }
+    st.session_state.indice_espacial = indice
+    return indice
+
+# ==============================================================================
+# ÍNDICE DE FILTROS
+# ==============================================================================
+
+COLUNAS_FILTRO = ['Tipo', 'Cidade', 'Fonte']
+
+class IndiceFiltros:
+    """
+    Índices invertidos (categoria -> posições das linhas) das colunas de
+    filtro, com as contagens por categoria já calculadas.
+
+    É montado uma vez por versão da base; filtrar é a união das posições
+    das categorias escolhidas em cada coluna e a interseção entre colunas,
+    sem percorrer nem copiar o DataFrame inteiro.
+    """
+
+    def __init__(self, df, versao):
+        self.versao = versao
+        self.n = len(df)
+        self.posicoes = {}
+        self.contagens = {}
+        for coluna in COLUNAS_FILTRO:
+            if coluna not in df.columns:
+                continue
+            categorias = pd.Categorical(df[coluna].astype('string'))
+            codigos = categorias.codes
+            ordem = np.argsort(codigos, kind='stable')
+            # Linhas sem valor (código -1) ficam fora de todas as categorias
+            limites = np.searchsorted(codigos[ordem], np.arange(len(categorias.categories) + 1))
+            self.posicoes[coluna] = {
+                categoria: ordem[limites[i]:limites[i + 1]]
+                for i, categoria in enumerate(categorias.categories)
+            }
+            self.contagens[coluna] = {categoria: len(p) for categoria, p in self.posicoes[coluna].items()}
         
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
+        coordenadas = df.reindex(columns=['Latitude', 'Longitude'])
+        self.com_coordenadas = np.flatnonzero(coordenadas.notna().all(axis=1).to_numpy())
+
+    def opcoes(self, coluna):
+        """
+        Categorias da coluna em ordem alfabética
+        """
+        return list(self.contagens.get(coluna, {}))
+
+    def contagem(self, coluna, categoria=None):
+        """
+        Número de linhas da categoria, ou de categorias distintas da coluna
+        """
+        contagens = self.contagens.get(coluna, {})
+        return len(contagens) if categoria is None else contagens.get(categoria, 0)
+
+    def filtrar(self, selecoes, apenas_com_coordenadas=False):
+        """
+        Posições (ordenadas) das linhas que atendem a todas as seleções
+        {coluna: [categorias]}; lista vazia significa sem filtro na coluna
+        """
+        resultado = self.com_coordenadas if apenas_com_coordenadas else None
+        for coluna, categorias in selecoes.items():
+            if not categorias or coluna not in self.posicoes:
+                continue
+            posicoes = np.sort(np.concatenate(
+                [self.posicoes[coluna].get(c, np.empty(0, dtype=np.int64)) for c in categorias]
+            ))
+            resultado = posicoes if resultado is None else np.intersect1d(resultado, posicoes, assume_unique=True)
+        return np.arange(self.n) if resultado is None else resultado
+
+    def aplicar(self, df, selecoes, apenas_com_coordenadas=False):
+        """
+        Linhas do DataFrame que atendem às seleções. Sem filtro efetivo (todas
+        as linhas passam) devolve o próprio DataFrame, sem cópia posicional.
+        """
+        posicoes = self.filtrar(selecoes, apenas_com_coordenadas)
+        # Posições são únicas: o mesmo tamanho significa todas as linhas
+        return df if len(posicoes) == len(df) else df.iloc[posicoes]
+
+def obter_indice_filtros(df, versao):
+    """
+    Retorna o índice de filtros da sessão, reconstruído só quando a base muda
+    """
+    indice = st.session_state.get('indice_filtros')
+    if indice is None or indice.versao != versao or indice.n != len(df):
+        indice = IndiceFiltros(df, versao)
+        st.session_state.indice_filtros = indice
+    return indice
+
+# ==============================================================================
+# ÍNDICE DE BUSCA TEXTUAL
+# ==============================================================================
+
+COLUNAS_BUSCA = ['Nome', 'Cidade', 'Endereco', 'Telefone', 'Email']
+
+def _trigramas(texto):
+    """
+    Trigramas das palavras de um texto normalizado, marcando o início de
+    cada palavra (" si", "sin", "ino", "nop" para "sinop"); sem marca de
+    fim, um prefixo gera apenas trigramas contidos na palavra completa
+    """
+    trigramas = set()
+    for palavra in texto.split():
+        palavra = ' ' + palavra
+        trigramas.update(palavra[i:i + 3] for i in range(len(palavra) - 2))
+    return trigramas
+
+class IndiceBusca:
+    """
+    Índice invertido de trigramas (trigrama -> posições das linhas) sobre
+    Nome, Cidade, Endereco, Telefone e Email, sem acentos nem caixa.
+
+    A busca conta, por linha, quantos trigramas da consulta ela contém e
+    aceita as que têm pelo menos FRACAO_MINIMA deles: prefixos casam por
+    inteiro e erros de digitação custam só alguns trigramas. Linhas novas
+    são indexadas incrementalmente; `geracao` muda quando linhas existentes
+    foram alteradas e força a reconstrução.
+    """
+
+    FRACAO_MINIMA = 0.6
+
+    def __init__(self, geracao=None):
+        self.geracao = geracao
+        self.n = 0
+        self.nomes = []
+        self.cidades = []
+        self.posicoes_nome = {}
+        self._nomes_normalizados = []
+        self._blocos = {}
+        self._lock = threading.Lock()
+
+    def compativel(self, df):
+        """
+        Verifica se o DataFrame é o mesmo indexado, possivelmente com novas linhas no fim
+        """
+        if len(df) < self.n:
+            return False
+        return self.n == 0 or df['Nome'].iat[self.n - 1] == self.nomes[-1]
+
+    def sincronizar(self, df):
+        """
+        Indexa as linhas de df que ainda não estão no índice. A verificação,
+        o recorte e a inclusão ocorrem sob o lock, para que sessões
+        simultâneas não indexem as mesmas linhas duas vezes
+        """
+        with self._lock:
+            inicio = self.n
+            if len(df) > inicio and self.compativel(df):
+                self._adicionar(df.iloc[inicio:], inicio)
+
+    def _adicionar(self, df, inicio):
+        """
+        Indexa as linhas de df como posições inicio, inicio+1, ... (chamado
+        com o lock). Os trigramas são calculados uma vez por palavra
+        distinta e expandidos para as linhas com numpy, gerando um bloco de
+        posições por trigrama
+        """
+        colunas = df.reindex(columns=COLUNAS_BUSCA).fillna('').astype(str).reset_index(drop=True)
+        textos = normalizar_serie(colunas['Nome'].str.cat([colunas[c] for c in COLUNAS_BUSCA[1:]], sep=' '))
+        palavras = textos.str.split().explode().dropna()
+        codigos, vocabulario = pd.factorize(palavras)
+        trigramas_palavra = [sorted(_trigramas(p)) for p in vocabulario]
+        tamanhos = np.fromiter(map(len, trigramas_palavra), dtype=np.int64, count=len(vocabulario))
+        ids_trigramas, trigramas = pd.factorize(
+            pd.Series([t for lista in trigramas_palavra for t in lista], dtype=object)
+        )
+        
+        # Cada ocorrência de palavra vira len(trigramas da palavra) pares (trigrama, linha)
+        repeticoes = tamanhos[codigos]
+        inicios = np.cumsum(tamanhos) - tamanhos
+        deslocamentos = np.arange(repeticoes.sum()) - np.repeat(np.cumsum(repeticoes) - repeticoes, repeticoes)
+        trigrama_par = ids_trigramas[np.repeat(inicios[codigos], repeticoes) + deslocamentos]
+        linha_par = np.repeat(palavras.index.to_numpy(dtype=np.int64), repeticoes)
         
-        soup = BeautifulSoup(response.content, 'html.parser')
+        m = max(len(colunas), 1)
+        pares = np.sort(trigrama_par.astype(np.int64) * m + linha_par)
+        pares = pares[np.r_[True, np.diff(pares) != 0]]
+        trigrama_par, linha_par = np.divmod(pares, m)
+        cortes = np.flatnonzero(np.diff(trigrama_par)) + 1
         
-        # ESTRATÉGIA 1: Buscar por qualquer elemento que possa conter dados
-        elementos_potenciais = soup.find_all(['div', 'p', 'span', 'li', 'td', 'tr'])
+        for a, b in zip(np.r_[0, cortes], np.r_[cortes, len(pares)]):
+            if b > a:
+                trigrama = trigramas[trigrama_par[a]]
+                self._blocos.setdefault(trigrama, []).append(linha_par[a:b] + inicio)
+        for posicao, nome in enumerate(colunas['Nome'], start=inicio):
+            self.posicoes_nome.setdefault(nome, posicao)
+        self.nomes.extend(colunas['Nome'].tolist())
+        self.cidades.extend(colunas['Cidade'].tolist())
+        self._nomes_normalizados.extend(normalizar_serie(colunas['Nome']).tolist())
+        self.n = inicio + len(colunas)
+
+    def _postagens(self, trigrama):
+        blocos = self._blocos.get(trigrama)
+        if not blocos:
+            return np.empty(0, dtype=np.int64)
+        if len(blocos) > 1:
+            blocos[:] = [np.concatenate(blocos)]
+        return blocos[0]
+
+    def buscar(self, consulta, limite=10):
+        """
+        Retorna as posições das melhores linhas para a consulta: mais
+        trigramas em comum primeiro, depois nomes que começam com a
+        consulta e nomes mais curtos
+        """
+        consulta = normalizar_serie(pd.Series([consulta])).iat[0]
+        trigramas = _trigramas(consulta)
+        if not trigramas:
+            return []
         
-        st.write(f"🔍 Analisando {len(elementos_potenciais)} elementos na página...")
+        with self._lock:
+            contagens = np.bincount(
+                np.concatenate([self._postagens(t) for t in trigramas]), minlength=self.n
+            )
+            minimo = max(1, int(np.ceil(len(trigramas) * self.FRACAO_MINIMA)))
+            candidatos = np.flatnonzero(contagens >= minimo)
+            # Só os melhores por contagem passam pelo desempate por nome
+            if len(candidatos) > limite * 20:
+                corte = np.partition(contagens[candidatos], -limite * 20)[-limite * 20]
+                candidatos = candidatos[contagens[candidatos] >= corte][:limite * 50]
+            nomes = [self._nomes_normalizados[p] for p in candidatos]
         
-        associados_encontrados = 0
-        padrao_telefone = r'\(?\d{2}\)?[\s-]?\d{4,5}[\s-]?\d{4}'
+        ordem = sorted(
+            range(len(candidatos)),
+            key=lambda i: (-contagens[candidatos[i]], not nomes[i].startswith(consulta), len(nomes[i]))
+        )
+        return [int(candidatos[i]) for i in ordem[:limite]]
+
+    def posicao(self, nome):
+        """
+        Posição da empresa pelo nome exato, ou None
+        """
+        return self.posicoes_nome.get(nome)
+
+@st.cache_resource(show_spinner=False)
+def _indices_busca():
+    return {'lock': threading.Lock()}
+
+def obter_indice_busca(df, geracao=None):
+    """
+    Retorna o índice de busca da base, compartilhado entre as sessões.
+    Quando o DataFrame só ganhou linhas no fim, apenas as novas são
+    indexadas.
+    """
+    indices = _indices_busca()
+    with indices['lock']:
+        indice = indices.get('empresas')
+        if indice is None or not indice.compativel(df) or indice.geracao != geracao:
+            indice = IndiceBusca(geracao=geracao)
+            indices['empresas'] = indice
+    
+    indice.sincronizar(df)
+    return indice
+
+# ==============================================================================
+# MATRIZ DE DISTÂNCIAS
+# ==============================================================================
+
+@st.cache_resource(show_spinner=False)
+def obter_cache_matriz():
+    """
+    Cache de pares origem/destino da matriz do OpenRouteService
+    """
+    return CacheSQLite(
+        os.path.join(DIRETORIO_CACHE, "matriz.sqlite"),
+        "matriz",
+        ttl=float(obter_configuracao("ROTA_CACHE_TTL_DIAS", 7)) * 86400,
+        ttl_negativo=0,
+        max_itens=int(obter_configuracao("MATRIZ_CACHE_MAX_ITENS", 500000))
+    )
+
+def _requisitar_matriz_ors(origens, destinos, perfil):
+    """
+    Requisita um bloco da matriz ao OpenRouteService.
+    Retorna (distâncias em km, durações em min); pares sem rota ficam NaN.
+    """
+    url = f"https://api.openrouteservice.org/v2/matrix/{perfil}"
+    
+    body = {
+        "locations": [[lon, lat] for lat, lon in origens] + [[lon, lat] for lat, lon in destinos],
+        "sources": list(range(len(origens))),
+        "destinations": list(range(len(origens), len(origens) + len(destinos))),
+        "metrics": ["distance", "duration"],
+        "units": "km"
+    }
+    
+    # Plano gratuito do ORS: 40 requisições de matriz por minuto
+    obter_limitador("openrouteservice-matriz", float(obter_configuracao("ORS_MATRIZ_REQ_POR_MINUTO", 40)) / 60).adquirir()
+    response = obter_sessao_http().post(url, json=body, headers=_cabecalhos_ors(), timeout=60)
+    response.raise_for_status()
+    data = response.json()
+    
+    distancias = np.array(data['distances'], dtype=float)
+    duracoes = np.array(data['durations'], dtype=float) / 60
+    return distancias, duracoes
+
+def calcular_matriz_distancias(origens, destinos, metodo='carro'):
+    """
+    Calcula a matriz de distâncias/durações entre listas de (lat, lon).
+
+    Pares já conhecidos vêm do cache; os demais são pedidos ao ORS em blocos
+    de ORS_MATRIZ_BLOCO x ORS_MATRIZ_BLOCO. Blocos em que a API falha, e
+    pares para os quais ela não encontra rota (null), usam Haversine
+    vetorizado (duração estimada como em calcular_rota).
+    Retorna um dict com as matrizes 'distancia_km', 'duracao_min' e a
+    máscara booleana 'aproximado'.
+    """
+    perfil = PERFIS_ORS.get(metodo, 'driving-car')
+    origens = [(float(lat), float(lon)) for lat, lon in origens]
+    destinos = [(float(lat), float(lon)) for lat, lon in destinos]
+    n, m = len(origens), len(destinos)
+    
+    distancias = np.full((n, m), np.nan)
+    duracoes = np.full((n, m), np.nan)
+    aproximado = np.zeros((n, m), dtype=bool)
+    falta = np.ones((n, m), dtype=bool)
+    
+    # Consulta o cache para todos os pares
+    chaves = [[f"{perfil}:{olat:.4f},{olon:.4f}:{dlat:.4f},{dlon:.4f}"
+               for dlat, dlon in destinos] for olat, olon in origens]
+    cache = obter_cache_matriz()
+    encontrados = cache.obter_varios([chave for linha in chaves for chave in linha])
+    for i in range(n):
+        for j in range(m):
+            valor = encontrados.get(chaves[i][j])
+            if valor is not None:
+                distancias[i, j], duracoes[i, j] = valor
+                falta[i, j] = False
+    
+    # Requisita ao ORS apenas os blocos com pares faltando
+    bloco = int(obter_configuracao("ORS_MATRIZ_BLOCO", 50))
+    for i0 in range(0, n, bloco):
+        for j0 in range(0, m, bloco):
+            i1, j1 = min(i0 + bloco, n), min(j0 + bloco, m)
+            if not falta[i0:i1, j0:j1].any():
+                continue
+            
+            try:
+                dist_bloco, dur_bloco = _requisitar_matriz_ors(origens[i0:i1], destinos[j0:j1], perfil)
+                distancias[i0:i1, j0:j1] = dist_bloco
+                duracoes[i0:i1, j0:j1] = dur_bloco
+                cache.salvar_varios({
+                    chaves[i][j]: [round(float(dist_bloco[i - i0, j - j0]), 2),
+                                   round(float(dur_bloco[i - i0, j - j0]), 1)]
+                    for i in range(i0, i1) for j in range(j0, j1)
+                    if falta[i, j] and not np.isnan(dist_bloco[i - i0, j - j0])
+                })
+                # Pares sem rota (null) não podem ficar NaN: o otimizador compara distâncias
+                sem_rota = np.isnan(dist_bloco) | np.isnan(dur_bloco)
+            except Exception:
+                sem_rota = falta[i0:i1, j0:j1]
+            
+            if sem_rota.any():
+                # Fallback: linha reta para os pares sem resposta
+                lat_o = np.array([lat for lat, _ in origens[i0:i1]])[:, None]
+                lon_o = np.array([lon for _, lon in origens[i0:i1]])[:, None]
+                lat_d = np.array([lat for lat, _ in destinos[j0:j1]])[None, :]
+                lon_d = np.array([lon for _, lon in destinos[j0:j1]])[None, :]
+                dist_reta = haversine_km(lat_o, lon_o, lat_d, lon_d)
+                distancias[i0:i1, j0:j1][sem_rota] = dist_reta[sem_rota]
+                duracoes[i0:i1, j0:j1][sem_rota] = dist_reta[sem_rota] * 1.5
+                aproximado[i0:i1, j0:j1] |= sem_rota
+    
+    return {
+        'distancia_km': np.round(distancias, 1),
+        'duracao_min': np.round(duracoes, 1),
+        'aproximado': aproximado
+    }
+
+# ==============================================================================
+# ROTEIRO COM VÁRIAS PARADAS
+# ==============================================================================
+
+def _dois_opt(matriz, caminho):
+    """
+    Aplica a melhor inversão 2-opt do caminho (extremos fixos).
+    O custo do trecho invertido é calculado exatamente, então vale para
+    matrizes assimétricas. Retorna True se houve melhoria.
+    """
+    L = len(caminho)
+    if L < 4:
+        return False
+    
+    ida = np.concatenate([[0], np.cumsum(matriz[caminho[:-1], caminho[1:]])])
+    volta = np.concatenate([[0], np.cumsum(matriz[caminho[1:], caminho[:-1]])])
+    
+    # Todos os pares (i, j) de posições internas com i < j
+    i, j = np.triu_indices(L - 2, k=1)
+    i, j = i + 1, j + 1
+    
+    delta = (matriz[caminho[i - 1], caminho[j]] + (volta[j] - volta[i]) + matriz[caminho[i], caminho[j + 1]]
+             - matriz[caminho[i - 1], caminho[i]] - (ida[j] - ida[i]) - matriz[caminho[j], caminho[j + 1]])
+    
+    melhor = np.argmin(delta)
+    if delta[melhor] >= -1e-9:
+        return False
+    
+    caminho[i[melhor]:j[melhor] + 1] = caminho[i[melhor]:j[melhor] + 1][::-1]
+    return True
+
+def _or_opt(matriz, caminho):
+    """
+    Move um segmento de 1 a 3 paradas para outra posição do caminho
+    (primeira melhoria encontrada). Retorna True se houve melhoria.
+    """
+    L = len(caminho)
+    for tamanho in (1, 2, 3):
+        for i in range(1, L - tamanho):
+            fim_segmento = i + tamanho - 1
+            anterior, proximo = caminho[i - 1], caminho[fim_segmento + 1]
+            primeiro, ultimo = caminho[i], caminho[fim_segmento]
+            ganho_remocao = matriz[anterior, primeiro] + matriz[ultimo, proximo] - matriz[anterior, proximo]
+            
+            for p in range(L - 1):
+                if i - 1 <= p <= fim_segmento:
+                    continue
+                custo_insercao = (matriz[caminho[p], primeiro] + matriz[ultimo, caminho[p + 1]]
+                                  - matriz[caminho[p], caminho[p + 1]])
+                if custo_insercao - ganho_remocao < -1e-9:
+                    segmento = caminho[i:fim_segmento + 1].copy()
+                    resto = np.concatenate([caminho[:i], caminho[fim_segmento + 1:]])
+                    posicao = p + 1 if p < i else p + 1 - tamanho
+                    caminho[:] = np.concatenate([resto[:posicao], segmento, resto[posicao:]])
+                    return True
+    return False
+
+def otimizar_roteiro(matriz, retornar=False):
+    """
+    Ordena as paradas minimizando o custo total da matriz, sempre saindo da
+    parada 0: vizinho mais próximo seguido de 2-opt e Or-opt até não haver
+    ganho. Com retornar=True o custo inclui a volta à parada 0.
+    Retorna a ordem das paradas (começando em 0).
+    """
+    matriz = np.nan_to_num(np.asarray(matriz, dtype=float), nan=1e9)
+    n = len(matriz)
+    if n <= 2:
+        return list(range(n))
+    
+    if retornar:
+        custos, fim = matriz, 0
+    else:
+        # Parada fictícia de custo zero fixa no fim torna o caminho aberto
+        custos = np.zeros((n + 1, n + 1))
+        custos[:n, :n] = matriz
+        fim = n
+    
+    # Vizinho mais próximo
+    caminho = [0]
+    visitado = np.zeros(n, dtype=bool)
+    visitado[0] = True
+    for _ in range(n - 1):
+        candidatos = np.where(visitado, np.inf, custos[caminho[-1], :n])
+        proximo = int(np.argmin(candidatos))
+        caminho.append(proximo)
+        visitado[proximo] = True
+    caminho = np.array(caminho + [fim])
+    
+    while _dois_opt(custos, caminho) or _or_opt(custos, caminho):
+        pass
+    
+    return [int(p) for p in caminho[:-1]]
+
+def geocodificar_endereco(endereco):
+    """
+    Geocodifica um endereço para coordenadas
+    """
+    try:
+        location = consultar_nominatim(f"{endereco}, Mato Grosso, Brasil")
+        if location:
+            return {
+                'endereco': location.address,
+                'latitude': location.latitude,
+                'longitude': location.longitude,
+                'sucesso': True
+            }
+        else:
+            return {
+                'sucesso': False,
+                'erro': 'Endereço não encontrado'
+            }
+    except Exception as e:
+        return {
+            'sucesso': False,
+            'erro': str(e)
+        }
+
+# ==============================================================================
+# RESOLUÇÃO DE ENTIDADES (DEDUPLICAÇÃO APROXIMADA)
+# ==============================================================================
+
+PADRAO_SUFIXOS_JURIDICOS = regex_de_trie(normalizar_serie(pd.Series(SUFIXOS_JURIDICOS)).unique())
+DIMENSAO_TRIGRAMAS = 1024
+
+def nomes_canonicos(nomes):
+    """
+    Forma canônica dos nomes: sem acentos, caixa, pontuação e sufixos
+    societários ("AMAGGI AGRO - SAPEZAL LTDA" -> "amaggi agro sapezal")
+    """
+    return (normalizar_serie(pd.Series(nomes))
+            .str.replace(PADRAO_SUFIXOS_JURIDICOS, ' ', regex=True)
+            .str.replace(r'\s+', ' ', regex=True)
+            .str.strip())
+
+def vetores_trigramas(nomes):
+    """
+    Vetores de trigramas de caracteres (com hash em DIMENSAO_TRIGRAMAS
+    posições) normalizados, de modo que o produto escalar entre duas
+    linhas seja a similaridade do cosseno entre os nomes
+    """
+    vetores = np.zeros((len(nomes), DIMENSAO_TRIGRAMAS), dtype=np.float32)
+    for linha, nome in enumerate(nomes):
+        texto = f"  {nome} "
+        for i in range(len(texto) - 2):
+            vetores[linha, zlib.crc32(texto[i:i + 3].encode('utf-8')) % DIMENSAO_TRIGRAMAS] += 1
+    normas = np.linalg.norm(vetores, axis=1, keepdims=True)
+    return vetores / np.maximum(normas, 1e-9)
+
+def _pares_por_bloco(nomes, cidades, max_bloco):
+    """
+    Pares candidatos (i < j) que compartilham ao menos um token do nome,
+    dentro da mesma cidade ou sem cidade conhecida. Blocos maiores que
+    max_bloco (tokens comuns como "agro") são descartados, mantendo o
+    número de comparações bem abaixo de n².
+    """
+    blocos = {}
+    for posicao, (nome, cidade) in enumerate(zip(nomes, cidades)):
+        for token in set(nome.split()):
+            if len(token) < 3:
+                continue
+            blocos.setdefault(('', token), []).append(posicao)
+            if cidade:
+                blocos.setdefault((cidade, token), []).append(posicao)
+    
+    partes = []
+    for membros in blocos.values():
+        if 2 <= len(membros) <= max_bloco:
+            membros = np.asarray(membros, dtype=np.int64)
+            i, j = np.triu_indices(len(membros), k=1)
+            partes.append(membros[i] * len(nomes) + membros[j])
+    if not partes:
+        vazio = np.empty(0, dtype=np.int64)
+        return vazio, vazio
+    codigos = np.unique(np.concatenate(partes))
+    return codigos // len(nomes), codigos % len(nomes)
+
+def agrupar_entidades(df, limiar=None):
+    """
+    Agrupa as linhas que representam a mesma empresa.
+
+    Os nomes são reduzidos à forma canônica; pares candidatos saem de
+    blocos por cidade/token e são aceitos quando a similaridade de
+    trigramas atinge o limiar (DEDUP_LIMIAR_SIMILARIDADE) e as cidades
+    não conflitam. Retorna, para cada linha, a posição do representante
+    do grupo (a primeira ocorrência).
+    """
+    if limiar is None:
+        limiar = float(obter_configuracao("DEDUP_LIMIAR_SIMILARIDADE", 0.85))
+    max_bloco = int(obter_configuracao("DEDUP_MAX_BLOCO", 200))
+    
+    canonicos = nomes_canonicos(df['Nome']).to_numpy()
+    gazetteer = obter_gazetteer()
+    cidades = gazetteer.detectar_em_serie(pd.Series(df['Nome'].to_numpy()))
+    if 'Cidade' in df.columns:
+        cidades = cidades.fillna(gazetteer.detectar_em_serie(pd.Series(df['Cidade'].to_numpy())))
+    cidades = cidades.fillna('').to_numpy()
+    
+    # Nome canônico e cidade idênticos já são a mesma entidade
+    combinacoes, unicos = pd.factorize(pd.Series(canonicos) + '|' + cidades)
+    nomes_unicos = [c.rsplit('|', 1)[0] for c in unicos]
+    cidades_unicas = np.array([c.rsplit('|', 1)[1] for c in unicos], dtype=object)
+    
+    # Union-find entre as combinações únicas
+    pais = np.arange(len(unicos))
+    def raiz(x):
+        while pais[x] != x:
+            pais[x] = pais[pais[x]]
+            x = pais[x]
+        return x
+    
+    i, j = _pares_por_bloco(nomes_unicos, cidades_unicas, max_bloco)
+    # Cidades conhecidas diferentes ou números diferentes ("Unidade 1" x "Unidade 2") nunca se unem
+    numeros_unicos = pd.Series(nomes_unicos, dtype=object).str.findall(r'\d+').str.join(' ').to_numpy()
+    compativeis = ((cidades_unicas[i] == cidades_unicas[j]) | (cidades_unicas[i] == '') | (cidades_unicas[j] == '')) \
+        & (numeros_unicos[i] == numeros_unicos[j])
+    i, j = i[compativeis], j[compativeis]
+    if len(i):
+        vetores = vetores_trigramas(nomes_unicos)
+        for inicio in range(0, len(i), 10000):
+            a, b = i[inicio:inicio + 10000], j[inicio:inicio + 10000]
+            similares = np.einsum('ij,ij->i', vetores[a], vetores[b]) >= limiar
+            for x, y in zip(a[similares], b[similares]):
+                rx, ry = raiz(x), raiz(y)
+                if rx != ry:
+                    pais[max(rx, ry)] = min(rx, ry)
+    
+    grupos = np.array([raiz(x) for x in range(len(unicos))], dtype=np.int64)[combinacoes]
+    # Representante de cada grupo: a primeira linha em que ele aparece
+    return pd.Series(np.arange(len(df))).groupby(grupos).transform('min').to_numpy()
+
+def resolver_entidades(df):
+    """
+    Une as linhas duplicadas (mesma empresa com grafias diferentes) antes
+    da geocodificação. Fica a primeira ocorrência de cada empresa, com
+    Telefone e Email completados pelas demais quando não informados.
+    """
+    if df.empty or 'Nome' not in df.columns:
+        return df
+    
+    df = df.reset_index(drop=True)
+    representantes = agrupar_entidades(df)
+    colunas = [c for c in ('Telefone', 'Email') if c in df.columns]
+    if colunas:
+        informados = df[colunas].replace('Não Informado', np.nan).groupby(representantes).transform('first')
+        df[colunas] = informados.where(informados.notna(), df[colunas])
+    return df[representantes == np.arange(len(df))].reset_index(drop=True)
+
+# ==============================================================================
+# WEB SCRAPING
+# ==============================================================================
+
+CABECALHOS_NAVEGADOR = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'pt-BR,pt;q=0.9,en;q=0.8',
+}
+
+class FonteDados:
+    """
+    Fonte de empresas para a coleta automática.
+
+    `url` pode conter {pagina} para fontes paginadas: as páginas 1, 2, ...
+    são buscadas até `max_paginas` ou até a primeira página sem registros
+    (ou 404). `extrator` recebe o HTML de uma página e retorna a lista de
+    registros no formato de _registro.
+    """
+
+    def __init__(self, nome, url, extrator, max_paginas=1):
+        self.nome = nome
+        self.url = url
+        self.extrator = extrator
+        self.max_paginas = max_paginas if '{pagina}' in url else 1
+
+    def url_pagina(self, pagina):
+        return self.url.format(pagina=pagina) if '{pagina}' in self.url else self.url
+
+# Para incluir uma fonte basta registrar aqui a URL (com {pagina}, se for
+# paginada), o limite de páginas e a função de extração
+FONTES_DADOS = {
+    fonte.nome: fonte for fonte in [
+        FonteDados("Cooperativas", "https://ampa.com.br/consulta-cooperativas/", extrair_cooperativas),
+        FonteDados("Associados Ativos", "https://ampa.com.br/consulta-associados-ativos/", extrair_associados),
+    ]
+}
+
+def _baixar_e_extrair(fonte, pagina):
+    """
+    Baixa e extrai uma página. Retorna (registros, alterada); página
+    inexistente (404) conta como página vazia.
+    """
+    try:
+        conteudo, alterada = baixar_pagina(fonte.url_pagina(pagina), headers=CABECALHOS_NAVEGADOR, confirmar=False)
+    except requests.HTTPError as erro:
+        if erro.response is not None and erro.response.status_code == 404 and pagina > 1:
+            return [], False
+        raise
+    return fonte.extrator(conteudo), alterada
+
+def coletar_paginas(fontes, workers=None):
+    """
+    Busca as páginas de todas as fontes em paralelo, com no máximo
+    SCRAPING_WORKERS downloads simultâneos, e gera (fonte, pagina,
+    registros, alterada, erro) à medida que cada página termina. Uma
+    página que falha vem com a exceção em `erro` sem interromper as
+    demais fontes.
+
+    Fontes paginadas são buscadas em janelas de `workers` páginas; a
+    próxima janela só é aberta se nenhuma página da atual veio vazia ou
+    com erro.
+    """
+    if workers is None:
+        workers = int(obter_configuracao("SCRAPING_WORKERS", 4))
+    
+    proxima = {fonte.nome: 1 for fonte in fontes}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def abrir_janela(fonte):
+            inicio = proxima[fonte.nome]
+            fim = min(inicio + workers, fonte.max_paginas + 1)
+            proxima[fonte.nome] = fim
+            return {
+                executor.submit(_baixar_e_extrair, fonte, pagina): (fonte, pagina)
+                for pagina in range(inicio, fim)
+            }
+        
+        futuros = {}
+        janelas = {}
+        for fonte in fontes:
+            janela = abrir_janela(fonte)
+            futuros.update(janela)
+            janelas[fonte.nome] = {'restantes': len(janela), 'vazia': False}
+        
+        while futuros:
+            concluido = next(as_completed(futuros))
+            fonte, pagina = futuros.pop(concluido)
+            try:
+                registros, alterada = concluido.result()
+                erro = None
+            except Exception as e:
+                registros, alterada, erro = [], False, e
+            yield fonte, pagina, registros, alterada, erro
+            
+            janela = janelas[fonte.nome]
+            janela['restantes'] -= 1
+            janela['vazia'] = janela['vazia'] or not registros
+            if not janela['restantes'] and not janela['vazia'] and proxima[fonte.nome] <= fonte.max_paginas:
+                nova = abrir_janela(fonte)
+                futuros.update(nova)
+                janelas[fonte.nome] = {'restantes': len(nova), 'vazia': False}
+
+def carregar_fontes(nomes):
+    """
+    Coleta as fontes escolhidas e retorna {fonte: (DataFrame, urls)} com
+    os registros já deduplicados e as páginas lidas, que devem ser
+    confirmadas no cache depois de processadas. Fontes em que nenhuma
+    página mudou desde a última coleta ficam de fora, sem reprocessamento.
+    Fontes com alguma página com erro também ficam de fora: uma coleta
+    parcial faria os registros das páginas perdidas parecerem removidos.
+    """
+    fontes = [FONTES_DADOS[nome] for nome in nomes]
+    registros = {fonte.nome: [] for fonte in fontes}
+    alteradas = {fonte.nome: False for fonte in fontes}
+    paginas_lidas = {fonte.nome: [] for fonte in fontes}
+    erros = {}
+    
+    st.write(f"🌐 Coletando {len(fontes)} fonte(s)...")
+    status_text = st.empty()
+    
+    for paginas, (fonte, pagina, registros_pagina, alterada, erro) in enumerate(coletar_paginas(fontes), start=1):
+        if erro is not None:
+            erros.setdefault(fonte.nome, (pagina, erro))
+            continue
+        registros[fonte.nome].extend(registros_pagina)
+        alteradas[fonte.nome] = alteradas[fonte.nome] or alterada
+        paginas_lidas[fonte.nome].append(fonte.url_pagina(pagina))
+        status_text.text(f"{fonte.nome} • página {pagina}: {len(registros_pagina)} registros ({paginas} páginas lidas)")
+    
+    resultado = {}
+    for nome in registros:
+        if nome in erros:
+            pagina, erro = erros[nome]
+            st.error(f"❌ {nome}: erro ao coletar a página {pagina}: {str(erro)}")
+        elif not alteradas[nome]:
+            st.info(f"♻️ {nome}: sem alterações desde a última coleta")
+        elif registros[nome]:
+            resultado[nome] = (resolver_entidades(pd.DataFrame(registros[nome])), paginas_lidas[nome])
+            st.success(f"✅ {nome}: {len(resultado[nome][0])} encontradas")
+        else:
+            st.warning(f"{nome}: nenhum registro encontrado automaticamente.")
+    
+    return resultado
+
+def _geocodificar_linha(row, cidade_detectada=None):
+    """
+    Geocodifica uma linha do lote mantendo os dados originais da empresa
+    """
+    # Tarefas de regeocodificação trazem a confiança anterior e o endereço conhecido
+    confianca_anterior = row.get('ConfiancaAnterior')
+    regeocodificar = confianca_anterior is not None and pd.notna(confianca_anterior)
+    endereco = row.get('Endereco')
+    
+    empresa_geocodificada = geocodificar_empresa(
+        row['Nome'], 
+        row.get('Cidade', 'Mato Grosso'),
+        row.get('Estado', 'MT'),
+        row.get('Tipo', 'Algodoeira'),
+        cidade_detectada=cidade_detectada,
+        endereco=endereco if isinstance(endereco, str) else None,
+        aprofundar=regeocodificar
+    )
+    
+    if empresa_geocodificada:
+        empresa_geocodificada['Telefone'] = row.get('Telefone', 'Não Informado')
+        empresa_geocodificada['Email'] = row.get('Email', 'Não Informado')
+        empresa_geocodificada['Tipo'] = row.get('Tipo', 'Algodoeira')
+        # A origem dos dados é mantida; a qualidade fica nas colunas de proveniência
+        fonte = row.get('Fonte')
+        empresa_geocodificada['Fonte'] = fonte if isinstance(fonte, str) and fonte else 'Web Scraping'
+        
+        # Uma regeocodificação só substitui o registro se a confiança melhorar
+        if regeocodificar and empresa_geocodificada['Confianca'] <= float(confianca_anterior):
+            return None
+    
+    return empresa_geocodificada
+
+def geocodificar_em_fluxo(df):
+    """
+    Geocodifica as empresas em paralelo e gera (posição, resultado) à
+    medida que cada uma termina.
+
+    O número de workers vem de GEOCODE_WORKERS. O limite de taxa é aplicado
+    apenas nas consultas que vão à rede, então acertos de cache não esperam.
+    """
+    workers = int(obter_configuracao("GEOCODE_WORKERS", 4))
+    registros = df.to_dict('records')
+    
+    # Detecta os municípios de todo o lote de uma vez: primeiro no nome, depois na coluna Cidade
+    gazetteer = obter_gazetteer()
+    cidades_detectadas = gazetteer.detectar_em_serie(df['Nome'])
+    if 'Cidade' in df.columns:
+        cidades_detectadas = cidades_detectadas.fillna(gazetteer.detectar_em_serie(df['Cidade']))
+    cidades_detectadas = [c if isinstance(c, str) else None for c in cidades_detectadas]
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futuros = {
+            executor.submit(_geocodificar_linha, registro, cidades_detectadas[posicao]): posicao
+            for posicao, registro in enumerate(registros)
+        }
+        for futuro in as_completed(futuros):
+            yield futuros[futuro], futuro.result()
+
+# ==============================================================================
+# BASE LOCAL DE EMPRESAS (SQLITE + SNAPSHOT PARQUET)
+# ==============================================================================
+
+DIRETORIO_BASE = os.environ.get(
+    "ALGODOEIRAS_DIR_BASE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "base_local")
+)
+
+COLUNAS_EMPRESA = {
+    'Nome': 'TEXT',
+    'Telefone': 'TEXT',
+    'Email': 'TEXT',
+    'Tipo': 'TEXT',
+    'Cidade': 'TEXT',
+    'Estado': 'TEXT',
+    'Latitude': 'REAL',
+    'Longitude': 'REAL',
+    'Endereco': 'TEXT',
+    'Fonte': 'TEXT',
+    # Proveniência da geocodificação
+    'Confianca': 'REAL',
+    'Metodo': 'TEXT',
+    'Consulta': 'TEXT',
+    'Importancia': 'REAL',
+    'ClasseOSM': 'TEXT',
+    'DistanciaCidadeKm': 'REAL',
+    'Aproximada': 'INTEGER'
+}
+
+COLUNAS_PROVENIENCIA = ['Confianca', 'Metodo', 'Consulta', 'Importancia', 'ClasseOSM', 'DistanciaCidadeKm', 'Aproximada']
+
+# Colunas com os dados das empresas em si, comparadas entre coletas de uma fonte
+COLUNAS_DADOS = [coluna for coluna in COLUNAS_EMPRESA if coluna not in COLUNAS_PROVENIENCIA]
+
+def chaves_empresas(nomes):
+    """
+    Chave estável de cada empresa: hash do nome normalizado (sem acentos,
+    caixa ou pontuação), de modo que variações triviais de grafia coincidam
+    """
+    return normalizar_serie(pd.Series(nomes)).map(
+        lambda nome: hashlib.sha1(nome.encode('utf-8')).hexdigest()[:16]
+    )
+
+def hashes_conteudo(df, colunas=None):
+    """
+    Hash de 64 bits do conteúdo de cada linha, para detectar alterações
+    """
+    colunas = df.reindex(columns=list(colunas or COLUNAS_EMPRESA))
+    return pd.util.hash_pandas_object(colunas, index=False).to_numpy().view(np.int64)
+
+class ArmazemEmpresas:
+    """
+    Base de empresas compartilhada entre sessões e reinicializações.
+
+    O SQLite é o registro oficial, com a chave normalizada do nome como
+    chave primária e índices em Nome, Cidade e Tipo. Um índice em memória
+    chave -> hash do conteúdo permite ingerir lotes com custo proporcional
+    ao lote: só linhas novas ou alteradas são gravadas, e o DataFrame em
+    memória é estendido sem releitura da base (as linhas novas ficam em
+    blocos, concatenados só quando alguém lê). Um snapshot Parquet acelera
+    a carga após reinicializar.
+    """
+
+    INTERVALO_SNAPSHOT = 30  # segundos entre regravações do snapshot
+
+    def __init__(self, diretorio):
+        os.makedirs(diretorio, exist_ok=True)
+        self.caminho_snapshot = os.path.join(diretorio, "empresas.parquet")
+        self._lock = threading.RLock()
+        self._df = None
+        self._versao_df = None
+        # Linhas inseridas desde a última concatenação e posição de cada chave no DataFrame
+        self._blocos_novos = []
+        self._posicoes = {}
+        self._ultimo_snapshot = 0
+        self._conn = sqlite3.connect(os.path.join(diretorio, "empresas.sqlite"),
+                                     check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS metadados (chave TEXT PRIMARY KEY, valor TEXT)")
+        self._conn.execute("INSERT OR IGNORE INTO metadados VALUES ('versao', '0')")
+        self._conn.execute("INSERT OR IGNORE INTO metadados VALUES ('geracao', '0')")
+        antigas = self._migrar_chave()
+        colunas = ', '.join(f'"{nome}" {tipo}' for nome, tipo in COLUNAS_EMPRESA.items())
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS empresas ("Chave" TEXT PRIMARY KEY, "Hash" INTEGER, {colunas})')
+        self._adicionar_colunas()
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_empresas_nome ON empresas ("Nome")')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_empresas_cidade ON empresas ("Cidade")')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_empresas_tipo ON empresas ("Tipo")')
+        # Snapshot dos registros da última coleta de cada fonte; "Pendente"
+        # marca os enviados à fila cujo resultado ainda não foi gravado
+        self._conn.execute('CREATE TABLE IF NOT EXISTS registros_fonte ('
+                           '"Fonte" TEXT, "Chave" TEXT, "Hash" INTEGER, "Nome" TEXT, "Pendente" INTEGER DEFAULT 0, '
+                           'PRIMARY KEY ("Fonte", "Chave"))')
+        if 'Pendente' not in {linha[1] for linha in self._conn.execute("PRAGMA table_info(registros_fonte)")}:
+            self._conn.execute('ALTER TABLE registros_fonte ADD COLUMN "Pendente" INTEGER DEFAULT 0')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_registros_fonte_chave ON registros_fonte ("Chave")')
+        self._conn.commit()
+        
+        # Índice em memória: chave -> hash do conteúdo
+        self._hashes = dict(self._conn.execute('SELECT "Chave", "Hash" FROM empresas'))
+        # Nomes canônicos (sem sufixos societários), montados sob demanda
+        self._canonicos = None
+        if antigas is not None:
+            self.ingerir(antigas)
+
+    def _migrar_chave(self):
+        """
+        Converte bases antigas, que usavam o Nome como chave primária.
+        Retorna as linhas a reinserir, ou None se não houver migração.
+        """
+        colunas = [linha[1] for linha in self._conn.execute("PRAGMA table_info(empresas)")]
+        if not colunas or 'Chave' in colunas:
+            return None
+        antigas = pd.read_sql_query('SELECT * FROM empresas ORDER BY rowid', self._conn)
+        self._conn.execute("DROP TABLE empresas")
+        return antigas
+
+    def _adicionar_colunas(self):
+        """
+        Acrescenta às bases antigas as colunas novas de COLUNAS_EMPRESA
+        (por exemplo as de proveniência) e descarta o snapshot desatualizado
+        """
+        existentes = {linha[1] for linha in self._conn.execute("PRAGMA table_info(empresas)")}
+        faltantes = [nome for nome in COLUNAS_EMPRESA if nome not in existentes]
+        for nome in faltantes:
+            self._conn.execute(f'ALTER TABLE empresas ADD COLUMN "{nome}" {COLUNAS_EMPRESA[nome]}')
+        if faltantes:
+            self._conn.execute("DELETE FROM metadados WHERE chave = 'versao_snapshot'")
+
+    def _contador(self, nome):
+        return int(self._conn.execute("SELECT valor FROM metadados WHERE chave = ?", (nome,)).fetchone()[0])
+
+    def _incrementar(self, nome):
+        self._conn.execute("UPDATE metadados SET valor = CAST(valor AS INTEGER) + 1 WHERE chave = ?", (nome,))
+
+    def versao(self):
+        """
+        Contador incrementado a cada escrita, usado para invalidar caches
+        """
+        with self._lock:
+            return self._contador('versao')
+
+    def geracao(self):
+        """
+        Contador incrementado quando linhas existentes mudam ou são removidas
+        (inserções puras só acrescentam linhas ao fim do DataFrame)
+        """
+        with self._lock:
+            return self._contador('geracao')
+
+    def ingerir(self, df, atualizar=True):
+        """
+        Grava apenas as empresas novas ou alteradas do DataFrame.
+        Com atualizar=False, empresas já existentes nunca são sobrescritas.
+        Retorna a contagem {'inseridas', 'atualizadas', 'ignoradas'}.
+        """
+        resumo = {'inseridas': 0, 'atualizadas': 0, 'ignoradas': 0}
+        if df.empty:
+            return resumo
+        
+        lote = df.reindex(columns=list(COLUNAS_EMPRESA)).reset_index(drop=True)
+        lote.insert(0, 'Chave', chaves_empresas(lote['Nome']).to_numpy())
+        lote.insert(1, 'Hash', hashes_conteudo(lote))
+        duplicadas = lote['Chave'].duplicated()
+        resumo['ignoradas'] += int(duplicadas.sum())
+        lote = lote[~duplicadas]
+        
+        with self._lock:
+            existentes = pd.Series([self._hashes.get(chave) for chave in lote['Chave']],
+                                   index=lote.index, dtype=object)
+            novas = lote[existentes.isna()]
+            alteradas = lote[existentes.notna() & (existentes != lote['Hash'])] if atualizar else lote.iloc[0:0]
+            resumo['inseridas'] = len(novas)
+            resumo['atualizadas'] = len(alteradas)
+            resumo['ignoradas'] += len(lote) - len(novas) - len(alteradas)
+            aplicadas = lote['Chave'] if atualizar else novas['Chave']
+            if novas.empty and alteradas.empty:
+                self._confirmar_registros_fonte(aplicadas)
+                self._conn.commit()
+                return resumo
+            
+            versao_anterior = self._contador('versao')
+            colunas = list(lote.columns)
+            nomes_colunas = ', '.join(f'"{c}"' for c in colunas)
+            marcadores = ', '.join('?' * len(colunas))
+            valores = lambda parte: parte.astype(object).where(parte.notna(), None).itertuples(index=False, name=None)
+            self._conn.executemany(
+                f'INSERT INTO empresas ({nomes_colunas}) VALUES ({marcadores})',
+                valores(novas)
+            )
+            self._conn.executemany(
+                'UPDATE empresas SET ' + ', '.join(f'"{c}" = ?' for c in colunas[1:]) + ' WHERE "Chave" = ?',
+                ([*linha[1:], linha[0]] for linha in valores(alteradas))
+            )
+            self._incrementar('versao')
+            if not alteradas.empty:
+                self._incrementar('geracao')
+            self._confirmar_registros_fonte(aplicadas)
+            self._conn.commit()
+            
+            self._hashes.update(zip(novas['Chave'], novas['Hash']))
+            self._hashes.update(zip(alteradas['Chave'], alteradas['Hash']))
+            if self._canonicos is not None:
+                self._canonicos.update(nomes_canonicos(novas['Nome']))
+            
+            # Estende o DataFrame em memória em vez de reler a base inteira
+            if self._df is not None and self._versao_df == versao_anterior:
+                inicio = len(self._posicoes)
+                self._posicoes.update(zip(novas['Chave'], range(inicio, inicio + len(novas))))
+                if not novas.empty:
+                    self._blocos_novos.append(novas.drop(columns='Hash'))
+                if not alteradas.empty:
+                    # Cópia: quem chamou carregar() ainda pode estar lendo a versão anterior
+                    df_novo = self._df_atual().copy()
+                    posicoes = [self._posicoes[chave] for chave in alteradas['Chave']]
+                    for coluna in COLUNAS_EMPRESA:
+                        df_novo.iloc[posicoes, df_novo.columns.get_loc(coluna)] = alteradas[coluna].to_numpy()
+                    self._df = df_novo
+                self._versao_df = versao_anterior + 1
+        
+        return resumo
+
+    def _confirmar_registros_fonte(self, chaves):
+        """
+        Marca como aplicados os registros de fonte que aguardavam a gravação
+        destas empresas (sem commit: faz parte da transação de quem chama)
+        """
+        self._conn.executemany(
+            'UPDATE registros_fonte SET "Pendente" = 0 WHERE "Chave" = ? AND "Pendente" = 1',
+            ((chave,) for chave in chaves)
+        )
+
+    def _df_atual(self):
+        """
+        Concatena ao DataFrame em memória os blocos inseridos desde a última leitura
+        """
+        if self._blocos_novos:
+            self._df = pd.concat([self._df, *self._blocos_novos], ignore_index=True)
+            self._blocos_novos = []
+        return self._df
+
+    def filtrar_novas(self, df):
+        """
+        Mantém apenas as linhas cujas empresas ainda não estão na base,
+        comparando os nomes canônicos ("X Ltda" já existe se "X" existe)
+        """
+        with self._lock:
+            if self._canonicos is None:
+                nomes = [linha[0] for linha in self._conn.execute('SELECT "Nome" FROM empresas')]
+                self._canonicos = set(nomes_canonicos(nomes))
+            return df[~nomes_canonicos(df['Nome']).isin(self._canonicos).to_numpy()]
+
+    def diferencas_fonte(self, fonte, df):
+        """
+        Compara os registros coletados de uma fonte com o snapshot da coleta
+        anterior. Retorna {'adicionadas': DataFrame, 'alteradas': DataFrame,
+        'removidas': [nomes]}.
+
+        Registros enviados à fila cujo resultado nunca foi gravado (tarefa
+        com falha ou cancelada) voltam como adicionados, ou alterados se a
+        empresa já está na base.
+        """
+        lote = df.reset_index(drop=True)
+        chaves = chaves_empresas(lote['Nome']).to_numpy()
+        hashes = hashes_conteudo(lote, COLUNAS_DADOS)
+        with self._lock:
+            anteriores = {
+                chave: (hash_, nome, pendente) for chave, hash_, nome, pendente in self._conn.execute(
+                    'SELECT "Chave", "Hash", "Nome", "Pendente" FROM registros_fonte WHERE "Fonte" = ?', (fonte,)
+                )
+            }
+            na_base = np.array([chave in self._hashes for chave in chaves], dtype=bool)
+        
+        estados = [anteriores.get(chave) for chave in chaves]
+        ausentes = np.array([estado is None for estado in estados], dtype=bool)
+        pendentes = np.array([estado is not None and bool(estado[2]) for estado in estados], dtype=bool)
+        mudaram = np.array([estado is not None and estado[0] != hash_ for estado, hash_ in zip(estados, hashes)], dtype=bool)
+        # Máscaras exclusivas: cada registro é enviado para a fila uma única vez
+        novos = ausentes | (pendentes & ~na_base)
+        alterados = ~novos & (mudaram | (pendentes & na_base))
+        adicionadas, alteradas = lote[novos], lote[alterados]
+        assert adicionadas.index.intersection(alteradas.index).empty
+        presentes = set(chaves)
+        return {
+            'adicionadas': adicionadas,
+            'alteradas': alteradas,
+            'removidas': [nome for chave, (_, nome, _) in anteriores.items() if chave not in presentes]
+        }
+
+    def registrar_fonte(self, fonte, df, enviadas=()):
+        """
+        Substitui o snapshot da fonte pelos registros da coleta atual. Os
+        nomes em `enviadas` (mandados para a fila) ficam pendentes até o
+        resultado ser gravado por ingerir().
+        """
+        lote = df.reset_index(drop=True)
+        chaves = chaves_empresas(lote['Nome'])
+        pendentes = set(chaves_empresas(list(enviadas)))
+        linhas = zip([fonte] * len(lote), chaves, hashes_conteudo(lote, COLUNAS_DADOS).tolist(), lote['Nome'],
+                     [int(chave in pendentes) for chave in chaves])
+        with self._lock:
+            self._conn.execute('DELETE FROM registros_fonte WHERE "Fonte" = ?', (fonte,))
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO registros_fonte ("Fonte", "Chave", "Hash", "Nome", "Pendente") '
+                'VALUES (?, ?, ?, ?, ?)', linhas
+            )
+            self._conn.commit()
+
+    def contem(self, nome):
+        with self._lock:
+            return chaves_empresas([nome]).iloc[0] in self._hashes
+
+    def limpar(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM empresas")
+            self._conn.execute("DELETE FROM registros_fonte")
+            self._incrementar('versao')
+            self._incrementar('geracao')
+            self._conn.commit()
+            self._hashes.clear()
+            self._canonicos = None
+
+    def _salvar_snapshot(self, df, versao):
+        try:
+            df.to_parquet(self.caminho_snapshot, index=False)
+            self._conn.execute("INSERT OR REPLACE INTO metadados VALUES ('versao_snapshot', ?)", (str(versao),))
+            self._conn.commit()
+            self._ultimo_snapshot = time.time()
+        except Exception:
+            # Sem pyarrow o snapshot é apenas ignorado
+            pass
+
+    def carregar(self):
+        """
+        Retorna (DataFrame, versão) lidos juntos, sob o mesmo lock; o
+        DataFrame é somente leitura para quem chama
+        """
+        with self._lock:
+            versao = self._contador('versao')
+            linha_snapshot = self._conn.execute(
+                "SELECT valor FROM metadados WHERE chave = 'versao_snapshot'"
+            ).fetchone()
+            versao_snapshot = int(linha_snapshot[0]) if linha_snapshot else None
+            
+            if self._versao_df != versao:
+                df = None
+                if versao_snapshot == versao and os.path.exists(self.caminho_snapshot):
+                    try:
+                        df = pd.read_parquet(self.caminho_snapshot)
+                    except Exception:
+                        df = None
+                if df is None:
+                    df = pd.read_sql_query('SELECT * FROM empresas ORDER BY rowid', self._conn).drop(columns='Hash')
+                    self._salvar_snapshot(df, versao)
+                self._df, self._versao_df = df, versao
+                self._blocos_novos = []
+                self._posicoes = dict(zip(df['Chave'], range(len(df))))
+            elif versao_snapshot != versao and time.time() - self._ultimo_snapshot > self.INTERVALO_SNAPSHOT:
+                # Versões estendidas em memória atualizam o snapshot com moderação
+                self._salvar_snapshot(self._df_atual(), versao)
+            
+            return self._df_atual(), versao
+
+@st.cache_resource(show_spinner=False)
+def obter_armazem_empresas():
+    return ArmazemEmpresas(DIRETORIO_BASE)
+
+# ==============================================================================
+# FILA DE GEOCODIFICAÇÃO EM SEGUNDO PLANO
+# ==============================================================================
+
+# Valores usados quando a coluna não vem na origem dos dados
+PADROES_TAREFA = {
+    'Nome': '',
+    'Telefone': 'Não Informado',
+    'Email': 'Não Informado',
+    'Tipo': 'Algodoeira',
+    'Cidade': 'Mato Grosso',
+    'Estado': 'MT',
+    'Fonte': 'Web Scraping'
+}
+
+# Colunas levadas para a tarefa só quando presentes (regeocodificação)
+COLUNAS_OPCIONAIS_TAREFA = ['Endereco', 'ConfiancaAnterior']
+
+class FilaGeocodificacao:
+    """
+    Fila durável de geocodificação em SQLite.
+
+    Cada empresa é uma tarefa e cada envio (coleta, arquivo) é um lote.
+    O resultado é gravado assim que a empresa termina (checkpoint por
+    empresa), e tarefas que estavam em andamento quando o processo caiu
+    voltam para a fila ao reabrir.
+    """
+
+    MAX_TENTATIVAS = 3
+
+    def __init__(self, caminho):
+        self._lock = threading.RLock()
+        self.novas_tarefas = threading.Event()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS lotes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                descricao TEXT,
+                atualizar INTEGER,
+                criado_em REAL,
+                inseridas INTEGER DEFAULT 0,
+                atualizadas INTEGER DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS tarefas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lote INTEGER,
+                chave TEXT,
+                dados TEXT,
+                estado TEXT,
+                tentativas INTEGER DEFAULT 0,
+                resultado TEXT,
+                gravada INTEGER DEFAULT 0,
+                prioridade REAL DEFAULT 1
+            );
+            CREATE INDEX IF NOT EXISTS idx_tarefas_estado ON tarefas (estado, id);
+            CREATE INDEX IF NOT EXISTS idx_tarefas_lote ON tarefas (lote, estado);
+            CREATE INDEX IF NOT EXISTS idx_tarefas_chave ON tarefas (chave, estado);
+        """)
+        if 'prioridade' not in {linha[1] for linha in self._conn.execute("PRAGMA table_info(tarefas)")}:
+            self._conn.execute("ALTER TABLE tarefas ADD COLUMN prioridade REAL DEFAULT 1")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_prioridade ON tarefas (estado, prioridade DESC, id)")
+        # Retoma as tarefas interrompidas por uma queda do processo
+        self._conn.execute("UPDATE tarefas SET estado = 'pendente' WHERE estado = 'processando'")
+        self._conn.commit()
+
+    def criar_lote(self, descricao, atualizar=False):
+        """
+        Abre um lote; com atualizar=True os resultados sobrescrevem empresas existentes
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO lotes (descricao, atualizar, criado_em) VALUES (?, ?, ?)",
+                (descricao, int(atualizar), time.time())
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def enfileirar(self, lote, df, prioridades=None):
+        """
+        Adiciona as empresas do DataFrame ao lote. Empresas que já aguardam
+        na fila (mesmo nome canônico) não são enfileiradas de novo.
+        Tarefas de maior prioridade (padrão 1) são processadas primeiro.
+        Retorna quantas tarefas foram criadas.
+        """
+        if df.empty:
+            return 0
+        colunas = list(PADROES_TAREFA) + [c for c in COLUNAS_OPCIONAIS_TAREFA if c in df.columns]
+        registros = df.reindex(columns=colunas).fillna(PADROES_TAREFA)
+        chaves = nomes_canonicos(registros['Nome'])
+        dados = [json.dumps(registro, ensure_ascii=False) for registro in registros.to_dict('records')]
+        prioridades = [1.0] * len(dados) if prioridades is None else [float(p) for p in prioridades]
+        
+        with self._lock:
+            antes = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT INTO tarefas (lote, chave, dados, estado, prioridade) SELECT ?, ?, ?, 'pendente', ? "
+                "WHERE NOT EXISTS (SELECT 1 FROM tarefas WHERE chave = ? AND estado IN ('pendente', 'processando'))",
+                ((lote, chave, dado, prioridade, chave) for chave, dado, prioridade in zip(chaves, dados, prioridades))
+            )
+            self._conn.commit()
+            criadas = self._conn.total_changes - antes
+        
+        self.novas_tarefas.set()
+        return criadas
+
+    def reservar(self, quantidade):
+        """
+        Marca até `quantidade` tarefas pendentes como em processamento, as
+        de maior prioridade primeiro, e retorna [(id, dados)]
+        """
+        with self._lock:
+            tarefas = self._conn.execute(
+                "SELECT id, dados FROM tarefas WHERE estado = 'pendente' ORDER BY prioridade DESC, id LIMIT ?", (quantidade,)
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE tarefas SET estado = 'processando' WHERE id = ?", ((id_,) for id_, _ in tarefas)
+            )
+            self._conn.commit()
+        return [(id_, json.loads(dados)) for id_, dados in tarefas]
+
+    def concluir(self, tarefa, resultado):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tarefas SET estado = 'concluida', resultado = ? WHERE id = ?",
+                (json.dumps(resultado, ensure_ascii=False) if resultado else None, tarefa)
+            )
+            self._conn.commit()
+
+    def falhar(self, tarefas):
+        """
+        Devolve as tarefas à fila, ou as marca como falhas após MAX_TENTATIVAS
+        """
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE tarefas SET tentativas = tentativas + 1, "
+                "estado = CASE WHEN tentativas + 1 >= ? THEN 'falhou' ELSE 'pendente' END "
+                "WHERE id = ? AND estado = 'processando'",
+                ((self.MAX_TENTATIVAS, tarefa) for tarefa in tarefas)
+            )
+            self._conn.commit()
+
+    def resultados_pendentes(self):
+        """
+        Resultados concluídos ainda não gravados na base, agrupados por lote:
+        [(lote, atualizar, ids, DataFrame)]
+        """
+        with self._lock:
+            linhas = self._conn.execute(
+                "SELECT t.lote, l.atualizar, t.id, t.resultado FROM tarefas t JOIN lotes l ON l.id = t.lote "
+                "WHERE t.estado = 'concluida' AND t.gravada = 0 AND t.resultado IS NOT NULL ORDER BY t.id"
+            ).fetchall()
+        grupos = {}
+        for lote, atualizar, id_, resultado in linhas:
+            grupo = grupos.setdefault(lote, (bool(atualizar), [], []))
+            grupo[1].append(id_)
+            grupo[2].append(json.loads(resultado))
+        return [(lote, atualizar, ids, pd.DataFrame(resultados))
+                for lote, (atualizar, ids, resultados) in grupos.items()]
+
+    def marcar_gravadas(self, lote, ids, resumo):
+        with self._lock:
+            self._conn.executemany("UPDATE tarefas SET gravada = 1 WHERE id = ?", ((id_,) for id_ in ids))
+            self._conn.execute(
+                "UPDATE lotes SET inseridas = inseridas + ?, atualizadas = atualizadas + ? WHERE id = ?",
+                (resumo['inseridas'], resumo['atualizadas'], lote)
+            )
+            self._conn.commit()
+
+    def cancelar(self, lote=None):
+        """
+        Cancela as tarefas pendentes de um lote (ou de todos)
+        """
+        with self._lock:
+            if lote is None:
+                self._conn.execute("UPDATE tarefas SET estado = 'cancelada' WHERE estado = 'pendente'")
+            else:
+                self._conn.execute("UPDATE tarefas SET estado = 'cancelada' WHERE estado = 'pendente' AND lote = ?", (lote,))
+            self._conn.commit()
+
+    def em_andamento(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM tarefas WHERE estado IN ('pendente', 'processando'))"
+            ).fetchone()[0] == 1
+
+    def progresso(self, limite=3):
+        """
+        Situação dos lotes mais recentes, do mais novo para o mais antigo
+        """
+        with self._lock:
+            return pd.read_sql_query("""
+                SELECT l.id, l.descricao, l.inseridas, l.atualizadas,
+                       COUNT(t.id) AS total,
+                       COALESCE(SUM(t.estado IN ('concluida', 'falhou', 'cancelada')), 0) AS finalizadas,
+                       COALESCE(SUM(t.estado = 'falhou'), 0) AS falhas,
+                       COALESCE(SUM(t.estado IN ('pendente', 'processando')), 0) AS restantes
+                FROM lotes l LEFT JOIN tarefas t ON t.lote = l.id
+                GROUP BY l.id ORDER BY l.id DESC LIMIT ?
+            """, self._conn, params=(limite,))
+
+class TrabalhadorGeocodificacao(threading.Thread):
+    """
+    Thread de fundo que consome a fila, independente das execuções do
+    script: recarregar a página ou interagir com a interface não
+    interrompe a geocodificação.
+    """
+
+    INTERVALO_GRAVACAO = 5  # segundos entre gravações dos resultados na base
+
+    def __init__(self, fila, armazem):
+        super().__init__(name="geocodificacao", daemon=True)
+        self.fila = fila
+        self.armazem = armazem
+
+    def _gravar_resultados(self):
+        for lote, atualizar, ids, df in self.fila.resultados_pendentes():
+            resumo = self.armazem.ingerir(df, atualizar=atualizar)
+            self.fila.marcar_gravadas(lote, ids, resumo)
+        self._ultima_gravacao = time.time()
+
+    def _processar(self, tarefas):
+        ids = [id_ for id_, _ in tarefas]
+        concluidas = set()
+        try:
+            df = pd.DataFrame([dados for _, dados in tarefas])
+            for posicao, resultado in geocodificar_em_fluxo(df):
+                self.fila.concluir(ids[posicao], resultado)
+                concluidas.add(ids[posicao])
+                if time.time() - self._ultima_gravacao > self.INTERVALO_GRAVACAO:
+                    self._gravar_resultados()
+        finally:
+            # Tarefas não concluídas (erro ou interrupção) voltam para a fila
+            self.fila.falhar([id_ for id_ in ids if id_ not in concluidas])
+
+    def run(self):
+        self._ultima_gravacao = 0
+        while True:
+            try:
+                # Grava também resultados deixados por uma execução anterior
+                self._gravar_resultados()
+                tarefas = self.fila.reservar(int(obter_configuracao("GEOCODE_WORKERS", 4)) * 4)
+                if not tarefas:
+                    self.fila.novas_tarefas.wait(timeout=5)
+                    self.fila.novas_tarefas.clear()
+                    continue
+                self._processar(tarefas)
+            except Exception:
+                time.sleep(5)
+
+def confianca_estimada(df):
+    """
+    Confiança da geocodificação de cada empresa. Registros gravados antes
+    da proveniência recebem uma estimativa: sem coordenadas ou no centroide
+    do estado, localização aproximada (centroide da cidade) ou 0.5
+    """
+    confianca = pd.to_numeric(df['Confianca'], errors='coerce') if 'Confianca' in df.columns else pd.Series(np.nan, index=df.index)
+    latitudes = pd.to_numeric(df['Latitude'], errors='coerce')
+    longitudes = pd.to_numeric(df['Longitude'], errors='coerce')
+    no_estado = latitudes.isna() | (np.isclose(latitudes, CENTROIDE_MT[0]) & np.isclose(longitudes, CENTROIDE_MT[1]))
+    aproximada = df['Endereco'].astype(str).str.startswith("Localização aproximada") if 'Endereco' in df.columns else False
+    estimativa = np.select([no_estado, aproximada], [CONFIANCA_CENTROIDE_ESTADO, CONFIANCA_CENTROIDE_CIDADE], 0.5)
+    return confianca.fillna(pd.Series(estimativa, index=df.index))
+
+def enfileirar_regeocodificacao(fila, df, limiar, limite):
+    """
+    Envia para a fila as empresas com confiança abaixo do limiar, com
+    prioridade maior para as de menor confiança. Essas tarefas usam as
+    estratégias extras de geocodificar_empresa e só substituem o registro
+    se a confiança melhorar. Retorna quantas tarefas foram criadas.
+    """
+    confianca = confianca_estimada(df)
+    baixas = (confianca < limiar).to_numpy()
+    candidatas = df[baixas].assign(ConfiancaAnterior=confianca[baixas].to_numpy())
+    candidatas = candidatas.sort_values('ConfiancaAnterior', kind='stable').head(limite)
+    if candidatas.empty:
+        return 0
+    # "Manual (Aproximado)" volta a ser "Manual": a precisão agora fica na proveniência
+    candidatas['Fonte'] = candidatas['Fonte'].str.replace(r'\s*\(.*\)$', '', regex=True)
+    # O endereço só ajuda se veio dos dados de origem; o display_name devolvido
+    # pelo próprio Nominatim levaria de volta ao mesmo ponto
+    if 'Endereco' in candidatas.columns and 'Metodo' in candidatas.columns:
+        do_nominatim = candidatas['Metodo'].fillna('').astype(str).str.startswith('nominatim')
+        candidatas['Endereco'] = candidatas['Endereco'].where(~do_nominatim, None)
+    lote = fila.criar_lote(f"Regeocodificação (confiança < {limiar:.0%})", atualizar=True)
+    return fila.enfileirar(lote, candidatas, prioridades=1 - candidatas['ConfiancaAnterior'])
+
+@st.cache_resource(show_spinner=False)
+def obter_fila_geocodificacao():
+    """
+    Abre a fila e inicia o trabalhador uma única vez por processo
+    """
+    armazem = obter_armazem_empresas()
+    fila = FilaGeocodificacao(os.path.join(DIRETORIO_BASE, "fila_geocodificacao.sqlite"))
+    TrabalhadorGeocodificacao(fila, armazem).start()
+    return fila
+
+# ==============================================================================
+# EXPORTAÇÃO GIS (GEOJSON, GEOPARQUET E VECTOR TILES)
+# ==============================================================================
+
+DIRETORIO_EXPORTACAO = os.path.join(DIRETORIO_BASE, "exportacao")
+
+COLUNAS_EXPORTACAO = ['Nome', 'Tipo', 'Cidade', 'Estado', 'Endereco', 'Telefone', 'Email', 'Fonte', 'Confianca', 'Metodo', 'Aproximada']
+
+# Atributos dos tiles por faixa de zoom: nos zooms baixos só o essencial
+ATRIBUTOS_POR_ZOOM = [
+    (0, ['Nome', 'Tipo']),
+    (10, ['Nome', 'Tipo', 'Cidade', 'Telefone', 'Email', 'Fonte', 'Confianca', 'Metodo'])
+]
+
+EXTENSAO_TILE = 4096
+LATITUDE_MAXIMA_MERCATOR = 85.0511
+
+def _varint(valor):
+    saida = bytearray()
+    while valor > 0x7f:
+        saida.append((valor & 0x7f) | 0x80)
+        valor >>= 7
+    saida.append(valor)
+    return bytes(saida)
+
+def _campo_varint(numero, valor):
+    return _varint(numero << 3) + _varint(valor)
+
+def _campo_bytes(numero, dados):
+    return _varint(numero << 3 | 2) + _varint(len(dados)) + dados
+
+def _campo_empacotado(numero, valores):
+    return _campo_bytes(numero, b''.join(_varint(v) for v in valores))
+
+def _zigzag(valor):
+    return (valor << 1) ^ (valor >> 31)
+
+def codificar_tile_mvt(camada, ids, px, py, atributos):
+    """
+    Codifica um tile Mapbox Vector Tile (v2) com uma camada de pontos.
+    O protobuf é montado à mão: Tile.layers(3) -> Layer com version(15),
+    name(1), features(2), keys(3), values(4) e extent(5).
+    """
+    chaves, valores = {}, {}
+    features = []
+    for i, (id_, x, y) in enumerate(zip(ids, px, py)):
+        tags = []
+        for coluna, coluna_valores in atributos.items():
+            valor = coluna_valores[i]
+            if pd.isna(valor) or valor == '':
+                continue
+            tags.append(chaves.setdefault(coluna, len(chaves)))
+            tags.append(valores.setdefault(str(valor), len(valores)))
+        features.append(_campo_bytes(2,
+            _campo_varint(1, int(id_))
+            + _campo_empacotado(2, tags)
+            + _campo_varint(3, 1)  # POINT
+            + _campo_empacotado(4, [9, _zigzag(int(x)), _zigzag(int(y))])  # MoveTo(1)
+        ))
+    
+    conteudo = (
+        _campo_varint(15, 2)
+        + _campo_bytes(1, camada.encode('utf-8'))
+        + b''.join(features)
+        + b''.join(_campo_bytes(3, chave.encode('utf-8')) for chave in chaves)
+        + b''.join(_campo_bytes(4, _campo_bytes(1, valor.encode('utf-8'))) for valor in valores)
+        + _campo_varint(5, EXTENSAO_TILE)
+    )
+    return _campo_bytes(3, conteudo)
+
+def coordenadas_tile(latitudes, longitudes, zoom):
+    """
+    Converte coordenadas para o esquema XYZ (Web Mercator): índices do tile
+    e posição do ponto dentro dele, em unidades da extensão do tile
+    """
+    n = 2 ** zoom
+    lat = np.radians(np.clip(latitudes, -LATITUDE_MAXIMA_MERCATOR, LATITUDE_MAXIMA_MERCATOR))
+    x = (np.asarray(longitudes) + 180.0) / 360.0 * n
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * n
+    tx = np.clip(np.floor(x), 0, n - 1).astype(np.int64)
+    ty = np.clip(np.floor(y), 0, n - 1).astype(np.int64)
+    px = np.minimum(((x - tx) * EXTENSAO_TILE).astype(np.int64), EXTENSAO_TILE - 1)
+    py = np.minimum(((y - ty) * EXTENSAO_TILE).astype(np.int64), EXTENSAO_TILE - 1)
+    return tx, ty, px, py
+
+def _gravar_atomico(caminho, dados):
+    """
+    Grava em arquivo temporário e substitui, para que o servidor nunca
+    entregue um arquivo pela metade
+    """
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f"{caminho}.{threading.get_ident()}.tmp"
+    with open(temporario, 'wb') as arquivo:
+        if isinstance(dados, bytes):
+            arquivo.write(dados)
+        else:
+            for parte in dados:
+                arquivo.write(parte)
+    os.replace(temporario, caminho)
+
+def _partes_geojson(df, tamanho_bloco=5000):
+    """
+    Gera o FeatureCollection em blocos, sem montar o documento inteiro na memória
+    """
+    yield b'{"type": "FeatureCollection", "features": ['
+    for inicio in range(0, len(df), tamanho_bloco):
+        bloco = df.iloc[inicio:inicio + tamanho_bloco]
+        propriedades = bloco.reindex(columns=COLUNAS_EXPORTACAO).astype(object)
+        propriedades = propriedades.where(propriedades.notna(), None).to_dict('records')
+        features = (
+            json.dumps({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [round(float(lon), 6), round(float(lat), 6)]},
+                'properties': props
+            }, ensure_ascii=False)
+            for lat, lon, props in zip(bloco['Latitude'], bloco['Longitude'], propriedades)
+        )
+        yield (',' if inicio else '').encode('utf-8') + ',\n'.join(features).encode('utf-8')
+    yield b']}\n'
+
+def escrever_geoparquet(df, caminho):
+    """
+    Grava um GeoParquet 1.1 com a geometria em WKB (Point little-endian:
+    byte de ordem, tipo 1 e as coordenadas x/y em float64)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    n = len(df)
+    wkb = np.zeros(n, dtype=[('ordem', 'u1'), ('tipo', '<u4'), ('x', '<f8'), ('y', '<f8')])
+    wkb['ordem'] = 1
+    wkb['tipo'] = 1
+    wkb['x'] = df['Longitude'].to_numpy(dtype=float)
+    wkb['y'] = df['Latitude'].to_numpy(dtype=float)
+    deslocamentos = np.arange(n + 1, dtype=np.int32) * wkb.dtype.itemsize
+    geometria = pa.Array.from_buffers(pa.binary(), n, [None, pa.py_buffer(deslocamentos), pa.py_buffer(wkb.tobytes())])
+    
+    tabela = pa.Table.from_pandas(df.reindex(columns=COLUNAS_EXPORTACAO).astype(object), preserve_index=False)
+    tabela = tabela.append_column('geometry', geometria)
+    metadados_geo = {
+        'version': '1.1.0',
+        'primary_column': 'geometry',
+        'columns': {'geometry': {
+            'encoding': 'WKB',
+            'geometry_types': ['Point'],
+            'bbox': [float(wkb['x'].min()), float(wkb['y'].min()), float(wkb['x'].max()), float(wkb['y'].max())] if n else []
+        }}
+    }
+    tabela = tabela.replace_schema_metadata({**(tabela.schema.metadata or {}), b'geo': json.dumps(metadados_geo).encode('utf-8')})
+    temporario = f"{caminho}.{threading.get_ident()}.tmp"
+    pq.write_table(tabela, temporario)
+    os.replace(temporario, caminho)
+
+class ExportadorGIS:
+    """
+    Publica a base de empresas em disco para clientes GIS externos:
+    empresas.geojson, empresas.parquet (GeoParquet) e tiles/{z}/{x}/{y}.mvt,
+    com o TileJSON em tiles.json.
+
+    Só reexporta quando a versão da base muda. Os tiles são incrementais:
+    cada tile tem uma impressão digital (soma dos hashes de conteúdo das
+    empresas que contém), e apenas os tiles cuja impressão mudou são
+    recodificados; tiles que ficaram vazios são apagados.
+    """
+
+    CAMADA = 'empresas'
+
+    def __init__(self, diretorio, url_base=''):
+        self.diretorio = diretorio
+        self.url_base = url_base
+        self.zoom_minimo = int(obter_configuracao("EXPORTACAO_ZOOM_MIN", 4))
+        self.zoom_maximo = int(obter_configuracao("EXPORTACAO_ZOOM_MAX", 12))
+        self.caminho_manifesto = os.path.join(diretorio, "manifesto.json")
+        self._lock = threading.Lock()
+        self._thread = None
+        self.ultimo_erro = None
+        try:
+            with open(self.caminho_manifesto, encoding='utf-8') as arquivo:
+                self.manifesto = json.load(arquivo)
+        except (OSError, ValueError):
+            self.manifesto = {'versao': None, 'tiles': {}}
+
+    def versao_exportada(self):
+        return self.manifesto.get('versao')
+
+    def em_andamento(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def agendar(self, armazem):
+        """
+        Inicia a exportação em segundo plano se a base mudou desde a última
+        """
+        with self._lock:
+            if self.em_andamento() or self.manifesto.get('versao') == armazem.versao():
+                return False
+            self._thread = threading.Thread(target=self._executar, args=(armazem,), daemon=True)
+            self._thread.start()
+            return True
+
+    def _executar(self, armazem):
+        try:
+            self.exportar(*armazem.carregar())
+            self.ultimo_erro = None
+        except Exception as erro:
+            self.ultimo_erro = str(erro)
+
+    def exportar(self, df, versao):
+        """
+        Exporta o DataFrame (só empresas com coordenadas válidas) e retorna
+        {'empresas', 'tiles_gravados', 'tiles_removidos'}
+        """
+        latitudes = pd.to_numeric(df['Latitude'], errors='coerce')
+        longitudes = pd.to_numeric(df['Longitude'], errors='coerce')
+        validas = (latitudes.between(-90, 90) & longitudes.between(-180, 180)).to_numpy()
+        df = df[validas].reset_index(drop=True)
+        df['Latitude'], df['Longitude'] = latitudes[validas].to_numpy(), longitudes[validas].to_numpy()
+        
+        _gravar_atomico(os.path.join(self.diretorio, "empresas.geojson"), _partes_geojson(df))
+        try:
+            escrever_geoparquet(df, os.path.join(self.diretorio, "empresas.parquet"))
+        except ImportError:
+            # Sem pyarrow o GeoParquet é apenas ignorado
+            pass
+        
+        tiles, gravados = self._exportar_tiles(df)
+        removidos = [chave for chave in self.manifesto.get('tiles', {}) if chave not in tiles]
+        for chave in removidos:
+            try:
+                os.remove(os.path.join(self.diretorio, "tiles", f"{chave}.mvt"))
+            except OSError:
+                pass
+        
+        _gravar_atomico(os.path.join(self.diretorio, "tiles.json"), json.dumps(self._tilejson(df), ensure_ascii=False).encode('utf-8'))
+        self.manifesto = {'versao': versao, 'tiles': tiles}
+        _gravar_atomico(self.caminho_manifesto, json.dumps(self.manifesto).encode('utf-8'))
+        return {'empresas': len(df), 'tiles_gravados': gravados, 'tiles_removidos': len(removidos)}
+
+    def _exportar_tiles(self, df):
+        anteriores = self.manifesto.get('tiles', {})
+        tiles, gravados = {}, 0
+        if df.empty:
+            return tiles, gravados
+        
+        hashes = hashes_conteudo(df).view(np.uint64)
+        ids = np.arange(len(df))
+        valores = {coluna: df[coluna].to_numpy(dtype=object) for coluna in ATRIBUTOS_POR_ZOOM[-1][1] if coluna in df.columns}
+        for zoom in range(self.zoom_minimo, self.zoom_maximo + 1):
+            colunas = [colunas for minimo, colunas in ATRIBUTOS_POR_ZOOM if zoom >= minimo][-1]
+            tx, ty, px, py = coordenadas_tile(df['Latitude'].to_numpy(), df['Longitude'].to_numpy(), zoom)
+            chave_tile = tx * (2 ** zoom) + ty
+            ordem = np.argsort(chave_tile, kind='stable')
+            inicios = np.flatnonzero(np.r_[True, np.diff(chave_tile[ordem]) != 0])
+            impressoes = np.add.reduceat(hashes[ordem], inicios)
+            
+            for inicio, fim, impressao in zip(inicios, np.r_[inicios[1:], len(ordem)], impressoes):
+                posicoes = ordem[inicio:fim]
+                chave = f"{zoom}/{tx[posicoes[0]]}/{ty[posicoes[0]]}"
+                tiles[chave] = f"{int(impressao):x}-{len(posicoes)}"
+                if anteriores.get(chave) == tiles[chave]:
+                    continue
+                atributos = {coluna: valores[coluna][posicoes] for coluna in colunas if coluna in valores}
+                conteudo = codificar_tile_mvt(self.CAMADA, ids[posicoes], px[posicoes], py[posicoes], atributos)
+                _gravar_atomico(os.path.join(self.diretorio, "tiles", f"{chave}.mvt"), conteudo)
+                gravados += 1
+        return tiles, gravados
+
+    def _tilejson(self, df):
+        campos = {coluna: 'String' for coluna in ATRIBUTOS_POR_ZOOM[-1][1]}
+        return {
+            'tilejson': '3.0.0',
+            'name': 'Empresas do setor algodoeiro de MT',
+            'tiles': [f"{self.url_base}/tiles/{{z}}/{{x}}/{{y}}.mvt"],
+            'minzoom': self.zoom_minimo,
+            'maxzoom': self.zoom_maximo,
+            'bounds': [float(df['Longitude'].min()), float(df['Latitude'].min()),
+                       float(df['Longitude'].max()), float(df['Latitude'].max())] if len(df) else [-180, -85, 180, 85],
+            'vector_layers': [{'id': self.CAMADA, 'fields': campos, 'minzoom': self.zoom_minimo, 'maxzoom': self.zoom_maximo}]
+        }
+
+class ManipuladorExportacao(SimpleHTTPRequestHandler):
+    """
+    Serve os arquivos exportados com ETag (If-None-Match -> 304) e
+    requisições parciais (Range -> 206), para que clientes GIS baixem só
+    os tiles e trechos de que precisam
+    """
+
+    extensions_map = {
+        **SimpleHTTPRequestHandler.extensions_map,
+        '.mvt': 'application/vnd.mapbox-vector-tile',
+        '.geojson': 'application/geo+json',
+        '.parquet': 'application/vnd.apache.parquet',
+        '.json': 'application/json'
+    }
+
+    def do_GET(self):
+        self._responder(com_corpo=True)
+
+    def do_HEAD(self):
+        self._responder(com_corpo=False)
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, com_corpo):
+        caminho = self.translate_path(self.path)
+        if not os.path.isfile(caminho) or caminho.endswith('.tmp'):
+            self.send_error(404)
+            return
+        
+        estado = os.stat(caminho)
+        tamanho = estado.st_size
+        etag = f'"{estado.st_mtime_ns:x}-{tamanho:x}"'
+        if etag in [valor.strip() for valor in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        
+        inicio, fim, status = 0, tamanho - 1, 200
+        intervalo = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', '').strip())
+        if intervalo and (intervalo[1] or intervalo[2]) and self.headers.get('If-Range', etag) == etag:
+            if intervalo[1]:
+                inicio = int(intervalo[1])
+                fim = min(int(intervalo[2]), tamanho - 1) if intervalo[2] else tamanho - 1
+            else:
+                inicio = max(0, tamanho - int(intervalo[2]))
+            if inicio > fim:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{tamanho}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+        
+        self.send_response(status)
+        self.send_header('Content-Type', self.guess_type(caminho))
+        self.send_header('Content-Length', str(fim - inicio + 1))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.date_time_string(estado.st_mtime))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if self.path.startswith('/downloads/'):
+            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(caminho)}"')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {inicio}-{fim}/{tamanho}')
+        self.end_headers()
+        
+        if com_corpo:
+            with open(caminho, 'rb') as arquivo:
+                arquivo.seek(inicio)
+                restante = fim - inicio + 1
+                while restante > 0:
+                    parte = arquivo.read(min(restante, 64 * 1024))
+                    if not parte:
+                        break
+                    self.wfile.write(parte)
+                    restante -= len(parte)
+
+@st.cache_resource(show_spinner=False)
+def obter_servidor_exportacao():
+    """
+    Sobe o servidor HTTP dos arquivos exportados uma única vez por processo.
+    Retorna a URL base, ou None se desativado (EXPORTACAO_PORTA=0) ou se a
+    porta estiver ocupada.
+    """
+    host = obter_configuracao("EXPORTACAO_HOST", "127.0.0.1")
+    porta = int(obter_configuracao("EXPORTACAO_PORTA", 8600))
+    if not porta:
+        return None
+    
+    os.makedirs(DIRETORIO_EXPORTACAO, exist_ok=True)
+    try:
+        servidor = ThreadingHTTPServer((host, porta), partial(ManipuladorExportacao, directory=DIRETORIO_EXPORTACAO))
+    except OSError:
+        return None
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return f"http://{host}:{servidor.server_address[1]}"
+
+@st.cache_resource(show_spinner=False)
+def obter_exportador_gis():
+    return ExportadorGIS(DIRETORIO_EXPORTACAO, url_base=obter_servidor_exportacao() or '')
+
+# ==============================================================================
+# DOWNLOAD SOB DEMANDA (CSV E PARQUET)
+# ==============================================================================
+
+FORMATOS_DOWNLOAD = {
+    'CSV': {'extensao': 'csv', 'mime': 'text/csv'},
+    'CSV compactado (.gz)': {'extensao': 'csv.gz', 'mime': 'application/gzip'},
+    'Parquet': {'extensao': 'parquet', 'mime': 'application/vnd.apache.parquet'}
+}
+
+class ExportadorArquivos:
+    """
+    Gera os arquivos de download só quando pedidos, escrevendo a base em
+    blocos direto para o disco. O arquivo fica guardado por versão da base
+    e é reaproveitado por todas as sessões até a base mudar; versões
+    anteriores do mesmo formato são apagadas.
+
+    Os arquivos ficam dentro do diretório de exportação, de onde o servidor
+    de exportação os envia em blocos (com suporte a Range), sem carregar o
+    arquivo inteiro na memória do app.
+    """
+
+    LINHAS_POR_BLOCO = 50000
+
+    def __init__(self, diretorio):
+        os.makedirs(diretorio, exist_ok=True)
+        self.diretorio = diretorio
+        self._locks = {formato: threading.Lock() for formato in FORMATOS_DOWNLOAD}
+
+    def caminho(self, formato, versao):
+        return os.path.join(self.diretorio, f"algodoeiras_v{versao}.{FORMATOS_DOWNLOAD[formato]['extensao']}")
+
+    def _blocos(self, df):
+        for inicio in range(0, max(len(df), 1), self.LINHAS_POR_BLOCO):
+            yield inicio, df.iloc[inicio:inicio + self.LINHAS_POR_BLOCO]
+
+    def _escrever_csv(self, df, arquivo):
+        for inicio, bloco in self._blocos(df):
+            bloco.to_csv(arquivo, index=False, header=inicio == 0)
+
+    def _escrever_parquet(self, df, caminho):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
         
-        for elemento in elementos_potenciais:
-            texto = elemento.get_text(strip=True)
-            
-            # Filtra elementos muito curtos ou muito longos
-            if len(texto) < 5 or len(texto) > 100:
-                continue
-                
-            # Pula elementos que são claramente não-nomes
-            if texto.lower() in ['associado', 'telefone', 'nome', 'empresa', 'endereço']:
-                continue
-                
-            # Verifica se tem formato de telefone (indicando que pode ser uma linha de dados)
-            tem_telefone = re.search(padrao_telefone, texto)
+        esquema = pa.Schema.from_pandas(df, preserve_index=False)
+        with pq.ParquetWriter(caminho, esquema) as escritor:
+            for _, bloco in self._blocos(df):
+                escritor.write_table(pa.Table.from_pandas(bloco, schema=esquema, preserve_index=False))
+
+    def gerar(self, df, versao, formato):
+        """
+        Retorna o caminho do arquivo da versão, gerando-o se ainda não existir
+        """
+        caminho = self.caminho(formato, versao)
+        with self._locks[formato]:
+            if os.path.exists(caminho):
+                return caminho
             
-            # Se tem telefone, provavelmente é uma linha de dados
-            if tem_telefone:
-                # Tenta extrair o nome (tudo antes do telefone)
-                partes = texto.split(tem_telefone.group())
-                if partes and partes[0].strip():
-                    nome = partes[0].strip()
-                    telefone = tem_telefone.group()
-                    
-                    if is_pessoa_juridica(nome):
-                        lista_associados.append({
-                            'Nome': nome,
-                            'Telefone': telefone,
-                            'Email': "Não Informado",
-                            'Tipo': 'Associado Ativo',
-                            'Cidade': 'Mato Grosso',
-                            'Estado': 'MT'
-                        })
-                        associados_encontrados += 1
-        
-        st.write(f"📊 Total de associados identificados: {associados_encontrados}")
-        
-        if lista_associados:
-            df = pd.DataFrame(lista_associados)
-            df = df.drop_duplicates(subset=['Nome'])
-            st.success(f"✅ Associados ativos: {len(df)} encontrados")
-            return geocodificar_empresas_em_lote(df)
-        else:
-            st.warning("Nenhum associado ativo (PJ) encontrado automaticamente.")
-            return pd.DataFrame()
+            temporario = f"{caminho}.{threading.get_ident()}.tmp"
+            extensao = FORMATOS_DOWNLOAD[formato]['extensao']
+            # Só as colunas da empresa: a chave interna e colunas auxiliares ficam de fora
+            df = df[[coluna for coluna in COLUNAS_EMPRESA if coluna in df.columns]]
+            if extensao == 'parquet':
+                self._escrever_parquet(df, temporario)
+            else:
+                abrir = gzip.open if extensao.endswith('.gz') else open
+                with abrir(temporario, 'wt', encoding='utf-8-sig', newline='') as arquivo:
+                    self._escrever_csv(df, arquivo)
+            os.replace(temporario, caminho)
             
-    except Exception as e:
-        st.error(f"❌ Erro ao coletar associados ativos: {str(e)}")
-        return pd.DataFrame()
+            # Inclui os arquivos "empresas_v*" de versões anteriores do app, que traziam a chave
+            for antigo in glob.glob(os.path.join(self.diretorio, f"*_v*.{extensao}")):
+                if antigo != caminho:
+                    try:
+                        os.remove(antigo)
+                    except OSError:
+                        pass
+        return caminho
+
+    def abrir(self, df, versao, formato):
+        """
+        Arquivo aberto para o st.download_button, chamado só no clique.
+        Usado só sem o servidor de exportação: o Streamlit lê o arquivo
+        inteiro para a memória antes de enviá-lo.
+        """
+        return open(self.gerar(df, versao, formato), 'rb')
+
+@st.cache_resource(show_spinner=False)
+def obter_exportador_arquivos():
+    return ExportadorArquivos(os.path.join(DIRETORIO_EXPORTACAO, "downloads"))
+
+# ==============================================================================
+# RENDERIZAÇÃO DO MAPA
+# ==============================================================================
+
+# Cores por tipo de empresa
+CORES_POR_TIPO = {
+    'Cooperativa': 'blue',
+    'Associado Ativo': 'green',
+    'Algodoeira': 'red',
+    'Outro': 'orange'
+}
+
+# Acima deste número de empresas os marcadores são agrupados em clusters
+LIMITE_MARCADORES_INDIVIDUAIS = int(obter_configuracao("LIMITE_MARCADORES_INDIVIDUAIS", 300))
 
-def geocodificar_empresas_em_lote(df):
+# Monta o marcador no navegador a partir de uma linha do array compacto:
+# [lat, lon, nome, tipo, cidade, telefone, email, fonte, endereco, confiança].
+# O HTML do popup só é gerado quando o marcador é clicado.
+_CALLBACK_MARCADOR_EMPRESA = """
+function (row) {
+    var cores = %s;
+    var esc = function (texto) {
+        var div = document.createElement('div');
+        div.textContent = texto;
+        return div.innerHTML;
+    };
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {
+        icon: L.AwesomeMarkers.icon({icon: 'industry', prefix: 'fa', markerColor: cores[row[3]] || 'gray'})
+    });
+    marker.bindTooltip(esc(row[2]) + ' (' + esc(row[3]) + ')');
+    marker.bindPopup(function () {
+        return '<div style="min-width: 250px">' +
+            '<h4>' + esc(row[2]) + '</h4><hr>' +
+            '<b>🏢 Tipo:</b> ' + esc(row[3]) + '<br>' +
+            '<b>📍 Cidade:</b> ' + esc(row[4]) + '<br>' +
+            '<b>📞 Telefone:</b> ' + esc(row[5]) + '<br>' +
+            '<b>📧 Email:</b> ' + esc(row[6]) + '<br>' +
+            '<b>🔍 Fonte:</b> ' + esc(row[7]) + '<br>' +
+            '<b>🎯 Endereço:</b> ' + esc(row[8]) + '<br>' +
+            '<b>📶 Confiança:</b> ' + esc(row[9]) +
+            '</div>';
+    }, {maxWidth: 300});
+    return marker;
+}
+"""
+
+def formatar_confianca(confianca):
     """
-    Geocodifica empresas em lote
+    Confiança como texto para os popups ("85%")
     """
-    if df.empty:
-        return df
-        
-    st.write("🗺️ Geocodificando empresas...")
-    
-    resultados = []
-    total_empresas = len(df)
+    return (confianca * 100).round().astype(int).astype(str) + '%'
+
+def adicionar_marcadores_agrupados(mapa, df_mapa):
+    """
+    Adiciona as empresas como FastMarkerCluster: os dados vão ao navegador
+    como um único array e os marcadores/popups são criados em JavaScript
+    """
+    def coluna(nome, padrao):
+        if nome in df_mapa.columns:
+            return df_mapa[nome].fillna(padrao).astype(str)
+        return pd.Series(padrao, index=df_mapa.index)
     
-    if total_empresas == 0:
-        return pd.DataFrame()
+    dados = pd.DataFrame({
+        'Latitude': df_mapa['Latitude'].astype(float),
+        'Longitude': df_mapa['Longitude'].astype(float),
+        'Nome': coluna('Nome', ''),
+        'Tipo': coluna('Tipo', 'Algodoeira'),
+        'Cidade': coluna('Cidade', 'Não informada'),
+        'Telefone': coluna('Telefone', 'Não Informado'),
+        'Email': coluna('Email', 'Não Informado'),
+        'Fonte': coluna('Fonte', 'Manual'),
+        'Endereco': coluna('Endereco', 'Localização aproximada'),
+        'Confianca': formatar_confianca(confianca_estimada(df_mapa))
+    }).values.tolist()
     
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    FastMarkerCluster(
+        dados,
+        callback=_CALLBACK_MARCADOR_EMPRESA % json.dumps(CORES_POR_TIPO),
+        name='Empresas'
+    ).add_to(mapa)
 
-    for index, row in df.iterrows():
-        progresso = min((index + 1) / total_empresas, 1.0)
-        progress_bar.progress(progresso)
-        status_text.text(f"Processando: {row['Nome'][:30]}... ({index + 1}/{total_empresas})")
-        
-        # Geocodifica cada empresa
-        empresa_geocodificada = geocodificar_empresa(
-            row['Nome'], 
-            row.get('Cidade', 'Mato Grosso'),
-            row.get('Estado', 'MT'),
-            row.get('Tipo', 'Algodoeira')
-        )
-        
-        if empresa_geocodificada:
-            # Mantém os dados originais
-            empresa_geocodificada['Telefone'] = row.get('Telefone', 'Não Informado')
-            empresa_geocodificada['Email'] = row.get('Email', 'Não Informado')
-            empresa_geocodificada['Tipo'] = row.get('Tipo', 'Algodoeira')
-            empresa_geocodificada['Fonte'] = 'Web Scraping'
-            resultados.append(empresa_geocodificada)
-        
-        time.sleep(1)  # Respeita rate limiting
+def construir_mapa(df_mapa, centro, zoom, rota=None, origem=None, destino=None, roteiro=None):
+    """
+    Monta o folium.Map com as camadas, os marcadores das empresas e as rotas
+    """
+    # Cria mapa
+    mapa = folium.Map(
+        location=centro, 
+        zoom_start=zoom, 
+        tiles="OpenStreetMap"
+    )
+
+    # Adiciona camadas de mapa
+    folium.TileLayer(
+        tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+        attr='Esri',
+        name='Satélite (Esri)',
+        overlay=False,
+        control=True
+    ).add_to(mapa)
+
+    folium.TileLayer(
+        tiles='CartoDB positron',
+        attr='CartoDB',
+        name='Minimalista (CartoDB)',
+        overlay=False,
+        control=True
+    ).add_to(mapa)
+
+    # Adiciona marcadores das empresas
+    if len(df_mapa) > LIMITE_MARCADORES_INDIVIDUAIS:
+        adicionar_marcadores_agrupados(mapa, df_mapa)
+    else:
+        confiancas = formatar_confianca(confianca_estimada(df_mapa))
+        for index, empresa in df_mapa.iterrows():
+            tipo = empresa.get('Tipo', 'Algodoeira')
+            cor = CORES_POR_TIPO.get(tipo, 'gray')
+
+            popup_html = f"""
+            <div style="min-width: 250px">
+                <h4>{empresa['Nome']}</h4>
+                <hr>
+                <b>🏢 Tipo:</b> {tipo}<br>
+                <b>📍 Cidade:</b> {empresa.get('Cidade', 'Não informada')}<br>
+                <b>📞 Telefone:</b> {empresa.get('Telefone', 'Não Informado')}<br>
+                <b>📧 Email:</b> {empresa.get('Email', 'Não Informado')}<br>
+                <b>🔍 Fonte:</b> {empresa.get('Fonte', 'Manual')}<br>
+                <b>🎯 Endereço:</b> {empresa.get('Endereco', 'Localização aproximada')}<br>
+                <b>📶 Confiança:</b> {confiancas[index]}
+            </div>
+            """
+
+            folium.Marker(
+                location=[empresa['Latitude'], empresa['Longitude']],
+                popup=folium.Popup(popup_html, max_width=300),
+                tooltip=f"{empresa['Nome']} ({tipo})",
+                icon=folium.Icon(color=cor, icon='industry', prefix='fa')
+            ).add_to(mapa)
+
+    # Adiciona rota se existir
+    if rota:
+        # Adiciona marcadores de origem e destino
+        folium.Marker(
+            location=[origem['lat'], origem['lon']],
+            popup=f"<b>Origem:</b> {origem['nome']}",
+            tooltip="Origem da Rota",
+            icon=folium.Icon(color='green', icon='home', prefix='fa')
+        ).add_to(mapa)
+
+        folium.Marker(
+            location=[destino['lat'], destino['lon']],
+            popup=f"<b>Destino:</b> {destino['nome']}",
+            tooltip="Destino da Rota",
+            icon=folium.Icon(color='red', icon='flag', prefix='fa')
+        ).add_to(mapa)
+
+        # Adiciona a rota
+        if len(rota['rota_coordenadas']) > 1:
+            AntPath(
+                rota['rota_coordenadas'],
+                color='blue',
+                weight=6,
+                opacity=0.7,
+                dash_array=[10, 20],
+                tooltip=f"Rota: {rota['distancia_km']} km, {rota['duracao_min']} min"
+            ).add_to(mapa)
+
+            # Adiciona também uma linha sólida por baixo
+            folium.PolyLine(
+                rota['rota_coordenadas'],
+                color='blue',
+                weight=3,
+                opacity=0.9,
+                tooltip=f"Rota para {destino['nome']}"
+            ).add_to(mapa)
+
+    # Adiciona roteiro com várias paradas se existir
+    if roteiro:
+        for ordem, parada in enumerate(roteiro['paradas']):
+            folium.CircleMarker(
+                location=[parada['lat'], parada['lon']],
+                radius=8,
+                color='purple',
+                fill=True,
+                fill_opacity=0.9,
+                tooltip=f"{ordem}. {parada['nome']}"
+            ).add_to(mapa)
+
+        AntPath(
+            roteiro['coordenadas'],
+            color='purple',
+            weight=5,
+            opacity=0.8,
+            dash_array=[10, 20],
+            tooltip=f"Roteiro: {roteiro['distancia_km']} km, {roteiro['duracao_min']} min"
+        ).add_to(mapa)
+
+    folium.LayerControl().add_to(mapa)
+
+    return mapa
+
+def obter_mapa(df_mapa, centro, zoom, rota=None, origem=None, destino=None, roteiro=None, chave_empresas=None):
+    """
+    Retorna o HTML do mapa da sessão, construindo e renderizando o mapa
+    apenas quando mudam as empresas exibidas, a rota ou o roteiro (a
+    renderização custa bem mais que a construção). Centro e zoom entram
+    por um script no fim do HTML, sem nova renderização.
+
+    `chave_empresas` (por exemplo versão da base + filtros) identifica as
+    empresas exibidas sem precisar calcular o hash do DataFrame.
+    """
+    if chave_empresas is not None:
+        hash_empresas = json.dumps(chave_empresas, default=str).encode()
+    else:
+        hash_empresas = pd.util.hash_pandas_object(df_mapa, index=False).to_numpy().tobytes()
+    hash_rotas = json.dumps([rota, origem, destino, roteiro, LIMITE_MARCADORES_INDIVIDUAIS],
+                            sort_keys=True, default=str).encode()
+    chave = hashlib.sha1(hash_empresas + hash_rotas).hexdigest()
     
-    progress_bar.empty()
-    status_text.text("✅ Geocodificação concluída!")
+    cache = st.session_state.get('mapa_cache')
+    if cache is None or cache['chave'] != chave:
+        mapa = construir_mapa(df_mapa, centro, zoom, rota, origem, destino, roteiro)
+        cache = {
+            'chave': chave,
+            'nome': mapa.get_name(),
+            'html': mapa.get_root().render()
+        }
+        st.session_state.mapa_cache = cache
     
-    if resultados:
-        return pd.DataFrame(resultados)
-    else:
-        return pd.DataFrame()
+    corpo, fim, resto = cache['html'].rpartition("</html>")
+    vista = f"<script>{cache['nome']}.setView({json.dumps([float(c) for c in centro])}, {int(zoom)});</script>"
+    return corpo + vista + fim + resto
 
 # ==============================================================================
 # INTERFACE PRINCIPAL
 # ==============================================================================
 
+# Carrega as empresas da base local compartilhada quando ela muda
+armazem = obter_armazem_empresas()
+fila = obter_fila_geocodificacao()
+exportador = obter_exportador_gis()
+exportador.agendar(armazem)
+if st.session_state.get('versao_empresas') != armazem.versao():
+    st.session_state.empresas_mapeadas, st.session_state.versao_empresas = armazem.carregar()
+
 # Inicializar session state
-if 'empresas_mapeadas' not in st.session_state:
-    st.session_state.empresas_mapeadas = pd.DataFrame()
 if 'map_center' not in st.session_state:
     st.session_state.map_center = [-12.6819, -56.9211]
 if 'map_zoom' not in st.session_state:
@@ -543,6 +3201,32 @@ if 'rota_atual' not in st.session_state:
 if 'origem_rota' not in st.session_state:
     st.session_state.origem_rota = None
 
+# Função para atualizar o centro do mapa e definir como origem
+def set_map_center(lat, lon, nome):
+    st.session_state.map_center = [lat, lon]
+    st.session_state.map_zoom = 14
+    
+    # Se o usuário quiser usar esta empresa como origem
+    if st.session_state.get('definir_como_origem', False):
+        st.session_state.origem_rota = {
+            'nome': nome,
+            'lat': lat,
+            'lon': lon
+        }
+        st.session_state.origem_lat = lat
+        st.session_state.origem_lon = lon
+        st.session_state.origem_nome = nome
+        st.success(f"✅ {nome} definida como origem da rota!")
+
+# Função para definir a empresa como destino da rota
+def definir_destino(lat, lon, nome):
+    st.session_state.update({
+        'destino_lat': lat,
+        'destino_lon': lon,
+        'destino_nome': nome,
+        'destino_selecionado': nome
+    })
+
 # ==============================================================================
 # SEÇÃO 1: WEB SCRAPING ESPECÍFICO
 # ==============================================================================
@@ -551,37 +3235,59 @@ st.header("🔍 Coleta Automática por Categoria")
 
 col1, col2 = st.columns(2)
 
+def enviar_fonte_para_fila(fonte, df, paginas):
+    """
+    Compara a coleta com o snapshot anterior da fonte e envia para a fila
+    apenas os registros novos ou alterados. Só então as páginas lidas são
+    confirmadas no cache, passando a contar como "sem alterações".
+    """
+    diferencas = armazem.diferencas_fonte(fonte, df)
+    pendentes = pd.concat([diferencas['adicionadas'], diferencas['alteradas']], ignore_index=True)
+    enviadas = 0
+    if not pendentes.empty:
+        lote = fila.criar_lote(fonte, atualizar=True)
+        enviadas = fila.enfileirar(lote, pendentes)
+    armazem.registrar_fonte(fonte, df, enviadas=pendentes['Nome'] if not pendentes.empty else ())
+    obter_cache_paginas().confirmar(paginas)
+    return {
+        'fonte': fonte,
+        'adicionadas': len(diferencas['adicionadas']),
+        'alteradas': len(diferencas['alteradas']),
+        'removidas': len(diferencas['removidas']),
+        'enviadas': enviadas
+    }
+
 with col1:
-    if st.button("🏢 Coletar Cooperativas", type="primary", use_container_width=True):
-        with st.spinner('Coletando dados de cooperativas...'):
-            df_cooperativas = carregar_cooperativas()
-            if not df_cooperativas.empty:
-                if st.session_state.empresas_mapeadas.empty:
-                    st.session_state.empresas_mapeadas = df_cooperativas
-                else:
-                    st.session_state.empresas_mapeadas = pd.concat([
-                        st.session_state.empresas_mapeadas, 
-                        df_cooperativas
-                    ], ignore_index=True).drop_duplicates(subset=['Nome'])
-                st.rerun()
+    fontes_selecionadas = st.multiselect(
+        "Fontes:",
+        options=list(FONTES_DADOS),
+        default=list(FONTES_DADOS),
+        label_visibility="collapsed"
+    )
 
 with col2:
-    if st.button("👥 Coletar Associados Ativos", type="primary", use_container_width=True):
-        with st.spinner('Coletando dados de associados ativos...'):
-            df_associados = carregar_associados_ativos()
-            if not df_associados.empty:
-                if st.session_state.empresas_mapeadas.empty:
-                    st.session_state.empresas_mapeadas = df_associados
-                else:
-                    st.session_state.empresas_mapeadas = pd.concat([
-                        st.session_state.empresas_mapeadas, 
-                        df_associados
-                    ], ignore_index=True).drop_duplicates(subset=['Nome'])
+    if st.button("🔍 Coletar Fontes Selecionadas", type="primary", use_container_width=True,
+                 disabled=not fontes_selecionadas):
+        with st.spinner('Coletando dados das fontes...'):
+            coletas = carregar_fontes(fontes_selecionadas)
+            if coletas:
+                st.session_state.resumos_fontes = [
+                    enviar_fonte_para_fila(fonte, df, paginas) for fonte, (df, paginas) in coletas.items()
+                ]
                 st.rerun()
 
+# Resumo da última coleta (sobrevive ao st.rerun)
+for resumo_fonte in st.session_state.pop('resumos_fontes', []):
+    st.info(f"🔄 {resumo_fonte['fonte']}: {resumo_fonte['adicionadas']} novas • "
+            f"{resumo_fonte['alteradas']} alteradas • {resumo_fonte['removidas']} removidas da fonte — "
+            f"{resumo_fonte['enviadas']} enviadas para geocodificação em segundo plano")
+
 # Botão para limpar dados
 if st.button("🗑️ Limpar Todos os Dados", use_container_width=True):
-    st.session_state.empresas_mapeadas = pd.DataFrame()
+    fila.cancelar()
+    armazem.limpar()
+    # Sem os validadores, a próxima coleta baixa e processa as páginas de novo
+    obter_cache_paginas().limpar()
     st.session_state.rota_atual = None
     st.session_state.origem_rota = None
     st.session_state.map_center = [-12.6819, -56.9211]
@@ -636,12 +3342,8 @@ with st.form("form_insercao_manual"):
         )
     
     with col3:
-        cidades_mt = [
-            "Sinop", "Cuiabá", "Rondonópolis", "Lucas do Rio Verde", "Sorriso",
-            "Tangará da Serra", "Campo Verde", "Nova Mutum", "Primavera do Leste",
-            "Campo Novo do Parecis", "Sapezal", "Outra"
-        ]
-        cidade_empresa = st.selectbox("Cidade:", cidades_mt)
+        cidades_mt = obter_gazetteer().municipios.index.tolist() + ["Outra"]
+        cidade_empresa = st.selectbox("Cidade:", cidades_mt, index=cidades_mt.index("Sinop"))
         
         if cidade_empresa == "Outra":
             cidade_empresa = st.text_input("Digite a cidade:")
@@ -660,22 +3362,14 @@ with st.form("form_insercao_manual"):
             if empresa_geocodificada:
                 nova_empresa_df = pd.DataFrame([empresa_geocodificada])
                 
-                if st.session_state.empresas_mapeadas.empty:
-                    st.session_state.empresas_mapeadas = nova_empresa_df
+                if armazem.ingerir(nova_empresa_df, atualizar=False)['inseridas']:
+                    st.success(f"✅ {nome_final} adicionada ao mapa!")
+                    
+                    # Foca no mapa na nova localização
+                    st.session_state.map_center = [empresa_geocodificada['Latitude'], empresa_geocodificada['Longitude']]
+                    st.session_state.map_zoom = 12
                 else:
-                    nomes_existentes = st.session_state.empresas_mapeadas['Nome'].values
-                    if nome_final not in nomes_existentes:
-                        st.session_state.empresas_mapeadas = pd.concat(
-                            [st.session_state.empresas_mapeadas, nova_empresa_df], 
-                            ignore_index=True
-                        )
-                        st.success(f"✅ {nome_final} adicionada ao mapa!")
-                        
-                        # Foca no mapa na nova localização
-                        st.session_state.map_center = [empresa_geocodificada['Latitude'], empresa_geocodificada['Longitude']]
-                        st.session_state.map_zoom = 12
-                    else:
-                        st.warning("⚠️ Esta empresa já está na lista!")
+                    st.warning("⚠️ Esta empresa já está na lista!")
                 
                 st.rerun()
 
@@ -749,13 +3443,39 @@ with col2:
     st.subheader("🎯 Destino")
     
     if not st.session_state.empresas_mapeadas.empty:
-        empresas_opcoes = st.session_state.empresas_mapeadas['Nome'].tolist()
-        destino_selecionado = st.selectbox("Selecionar empresa destino:", empresas_opcoes)
+        # Busca por trigramas em vez de carregar todos os nomes em um selectbox
+        indice_busca = obter_indice_busca(st.session_state.empresas_mapeadas, armazem.geracao())
+        consulta_destino = st.text_input(
+            "Buscar empresa:",
+            placeholder="Nome, cidade, endereço, telefone ou e-mail",
+            key="busca_empresa"
+        )
+        
+        if consulta_destino:
+            # O índice é compartilhado e pode estar à frente do DataFrame desta sessão
+            total_empresas = len(st.session_state.empresas_mapeadas)
+            resultados = [p for p in indice_busca.buscar(consulta_destino) if p < total_empresas]
+            if resultados:
+                posicao_escolhida = st.selectbox(
+                    "Resultados:",
+                    resultados,
+                    format_func=lambda p: f"{indice_busca.nomes[p]} — {indice_busca.cidades[p] or 'Cidade não informada'}",
+                    key="resultado_busca"
+                )
+                empresa_escolhida = st.session_state.empresas_mapeadas.iloc[posicao_escolhida]
+                dados_escolhida = (empresa_escolhida['Latitude'], empresa_escolhida['Longitude'], empresa_escolhida['Nome'])
+                
+                col_busca1, col_busca2 = st.columns(2)
+                with col_busca1:
+                    st.button("🎯 Definir Destino", key="busca_destino", on_click=definir_destino, args=dados_escolhida)
+                with col_busca2:
+                    st.button("🗺️ Ver no Mapa", key="busca_mapa", on_click=set_map_center, args=dados_escolhida)
+            else:
+                st.info("Nenhuma empresa encontrada")
         
-        if destino_selecionado:
-            empresa_destino = st.session_state.empresas_mapeadas[
-                st.session_state.empresas_mapeadas['Nome'] == destino_selecionado
-            ].iloc[0]
+        posicao_destino = indice_busca.posicao(st.session_state.get('destino_selecionado'))
+        if posicao_destino is not None and posicao_destino < len(st.session_state.empresas_mapeadas):
+            empresa_destino = st.session_state.empresas_mapeadas.iloc[posicao_destino]
             
             destino_lat = empresa_destino['Latitude']
             destino_lon = empresa_destino['Longitude']
@@ -818,6 +3538,156 @@ if st.session_state.rota_atual:
         st.session_state.destino_rota = None
         st.rerun()
 
+# Consultas de proximidade a partir da origem definida
+if not st.session_state.empresas_mapeadas.empty:
+    with st.expander("📍 Empresas Próximas da Origem"):
+        if origem_lat is None or origem_lon is None:
+            st.info("💡 Defina uma origem acima para buscar empresas próximas")
+        else:
+            df_empresas = st.session_state.empresas_mapeadas
+            indice = obter_indice_espacial(df_empresas, armazem.geracao())
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                modo_proximidade = st.radio("Buscar:", ["N mais próximas", "Dentro de um raio"])
+            with col2:
+                if modo_proximidade == "N mais próximas":
+                    quantidade = st.number_input("Quantidade:", min_value=1, max_value=500, value=5)
+                else:
+                    raio_km = st.number_input("Raio (km):", min_value=1.0, max_value=2000.0, value=50.0)
+            with col3:
+                tipos_proximidade = st.multiselect(
+                    "Tipos:",
+                    sorted(df_empresas['Tipo'].dropna().unique().tolist()) if 'Tipo' in df_empresas.columns else []
+                )
+            
+            mascara = df_empresas['Tipo'].isin(tipos_proximidade).to_numpy() if tipos_proximidade else None
+            if modo_proximidade == "N mais próximas":
+                posicoes, distancias = indice.mais_proximos(origem_lat, origem_lon, int(quantidade), mascara)
+            else:
+                posicoes, distancias = indice.dentro_do_raio(origem_lat, origem_lon, raio_km, mascara)
+            
+            if len(posicoes):
+                colunas = [c for c in ['Nome', 'Tipo', 'Cidade'] if c in df_empresas.columns]
+                df_proximas = df_empresas.iloc[posicoes][colunas].copy()
+                df_proximas['Distancia_km'] = np.round(distancias, 1)
+                st.dataframe(df_proximas, hide_index=True, use_container_width=True)
+            else:
+                st.info("Nenhuma empresa encontrada com esses critérios.")
+
+# Roteiro com várias paradas a partir da origem
+if not st.session_state.empresas_mapeadas.empty:
+    with st.expander("🧭 Roteiro com Várias Paradas"):
+        empresas_roteiro = st.session_state.empresas_mapeadas.dropna(subset=['Latitude', 'Longitude'])
+        paradas_roteiro = st.multiselect(
+            "Empresas a visitar:",
+            empresas_roteiro['Nome'].tolist(),
+            key="paradas_roteiro"
+        )
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            criterio_roteiro = st.radio("Minimizar:", ["Distância", "Tempo"], horizontal=True)
+        with col2:
+            retornar_origem = st.checkbox("Retornar à origem", value=True)
+        with col3:
+            tracar_estradas = st.checkbox("Traçar pelas estradas", value=False,
+                                          help="Busca a geometria de cada trecho no OpenRouteService")
+        
+        if st.button("🧭 Otimizar Roteiro", use_container_width=True):
+            if origem_lat is None or origem_lon is None:
+                st.error("❌ Defina uma origem para o roteiro")
+            elif not paradas_roteiro:
+                st.error("❌ Selecione ao menos uma empresa")
+            else:
+                coords = empresas_roteiro.drop_duplicates(subset=['Nome']).set_index('Nome')[['Latitude', 'Longitude']]
+                nomes = [origem_nome] + paradas_roteiro
+                pontos = [(origem_lat, origem_lon)] + list(coords.loc[paradas_roteiro].itertuples(index=False, name=None))
+                
+                with st.spinner('Otimizando roteiro...'):
+                    matriz = calcular_matriz_distancias(pontos, pontos)
+                    custos = matriz['distancia_km'] if criterio_roteiro == "Distância" else matriz['duracao_min']
+                    ordem = otimizar_roteiro(custos, retornar=retornar_origem)
+                    if retornar_origem:
+                        ordem = ordem + [0]
+                    
+                    trechos = list(zip(ordem[:-1], ordem[1:]))
+                    coordenadas = [list(pontos[ordem[0]])]
+                    for a, b in trechos:
+                        if tracar_estradas:
+                            trecho = calcular_rota(*pontos[a], *pontos[b])
+                            coordenadas.extend(trecho['rota_coordenadas'][1:])
+                        else:
+                            coordenadas.append(list(pontos[b]))
+                
+                st.session_state.roteiro_atual = {
+                    'paradas': [{'nome': nomes[p], 'lat': pontos[p][0], 'lon': pontos[p][1]} for p in ordem],
+                    'coordenadas': coordenadas,
+                    'distancia_km': round(float(sum(matriz['distancia_km'][a, b] for a, b in trechos)), 1),
+                    'duracao_min': round(float(sum(matriz['duracao_min'][a, b] for a, b in trechos)), 1)
+                }
+        
+        if st.session_state.get('roteiro_atual'):
+            roteiro = st.session_state.roteiro_atual
+            st.success(f"✅ Roteiro: {len(roteiro['paradas'])} pontos • {roteiro['distancia_km']} km • {roteiro['duracao_min']} min")
+            st.dataframe(
+                pd.DataFrame(roteiro['paradas']).rename(columns={'nome': 'Parada', 'lat': 'Latitude', 'lon': 'Longitude'}),
+                use_container_width=True
+            )
+            
+            if st.button("🗑️ Limpar Roteiro", use_container_width=True):
+                st.session_state.roteiro_atual = None
+                st.rerun()
+
+# Matriz de distâncias entre várias origens e destinos
+if not st.session_state.empresas_mapeadas.empty:
+    with st.expander("📐 Matriz de Distâncias (várias origens x vários destinos)"):
+        empresas_matriz = st.session_state.empresas_mapeadas.dropna(subset=['Latitude', 'Longitude'])
+        nomes_matriz = empresas_matriz['Nome'].tolist()
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            origens_matriz = st.multiselect("Origens (ex: pátios):", nomes_matriz, key="origens_matriz")
+        with col2:
+            destinos_matriz = st.multiselect("Destinos (ex: algodoeiras):", nomes_matriz, key="destinos_matriz")
+        
+        if st.button("📐 Calcular Matriz", use_container_width=True):
+            if origens_matriz and destinos_matriz:
+                coords = empresas_matriz.drop_duplicates(subset=['Nome']).set_index('Nome')[['Latitude', 'Longitude']]
+                with st.spinner('Calculando matriz de distâncias...'):
+                    matriz = calcular_matriz_distancias(
+                        coords.loc[origens_matriz].itertuples(index=False, name=None),
+                        coords.loc[destinos_matriz].itertuples(index=False, name=None)
+                    )
+                st.session_state.matriz_distancias = pd.DataFrame({
+                    'Origem': np.repeat(origens_matriz, len(destinos_matriz)),
+                    'Destino': np.tile(destinos_matriz, len(origens_matriz)),
+                    'Distancia_km': matriz['distancia_km'].ravel(),
+                    'Duracao_min': matriz['duracao_min'].ravel(),
+                    'Aproximado': matriz['aproximado'].ravel()
+                })
+            else:
+                st.error("❌ Selecione ao menos uma origem e um destino")
+        
+        if st.session_state.get('matriz_distancias') is not None:
+            df_matriz = st.session_state.matriz_distancias
+            metrica = st.radio("Exibir:", ["Distancia_km", "Duracao_min"], horizontal=True)
+            st.dataframe(
+                df_matriz.pivot(index='Origem', columns='Destino', values=metrica),
+                use_container_width=True
+            )
+            
+            if df_matriz['Aproximado'].any():
+                st.warning(f"⚠️ {int(df_matriz['Aproximado'].sum())} pares calculados em linha reta (API indisponível)")
+            
+            st.download_button(
+                label="📥 Baixar Matriz (CSV)",
+                data=df_matriz.to_csv(index=False, encoding='utf-8-sig'),
+                file_name=f"matriz_distancias_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
+
 # ==============================================================================
 # SEÇÃO 4: VISUALIZAÇÃO DOS DADOS E MAPA
 # ==============================================================================
@@ -827,189 +3697,104 @@ if not st.session_state.empresas_mapeadas.empty:
     
     df_final = st.session_state.empresas_mapeadas
     
-    # Estatísticas
+    indice_filtros = obter_indice_filtros(df_final, st.session_state.versao_empresas)
+    
+    # Estatísticas (contagens pré-calculadas no índice)
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.metric("Total de Empresas", len(df_final))
     
     with col2:
-        cidades_count = df_final['Cidade'].nunique() if 'Cidade' in df_final.columns else 1
-        st.metric("Cidades", cidades_count)
+        st.metric("Cidades", indice_filtros.contagem('Cidade'))
     
     with col3:
-        if 'Tipo' in df_final.columns:
-            tipos_count = df_final['Tipo'].nunique()
-        else:
-            tipos_count = 1
-        st.metric("Tipos Diferentes", tipos_count)
+        st.metric("Tipos Diferentes", indice_filtros.contagem('Tipo'))
     
     with col4:
-        if 'Fonte' in df_final.columns:
-            web_count = len(df_final[df_final['Fonte'] == 'Web Scraping'])
-        else:
-            web_count = 0
-        st.metric("Coleta Automática", web_count)
-    
-    # Filtros
-    st.subheader("🎛️ Filtros")
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if 'Tipo' in df_final.columns and not df_final.empty:
-            tipos = ["Exibir Todos"] + sorted(df_final['Tipo'].unique().tolist())
-        else:
-            tipos = ["Exibir Todos"]
-        tipo_selecionado = st.selectbox("Filtrar por Tipo:", tipos)
+        st.metric("Coleta Automática", indice_filtros.contagem('Fonte', 'Web Scraping'))
     
-    with col2:
-        if 'Cidade' in df_final.columns and not df_final.empty:
-            cidades = ["Exibir Todas"] + sorted(df_final['Cidade'].unique().tolist())
-        else:
-            cidades = ["Exibir Todas"]
-        cidade_selecionada = st.selectbox("Filtrar por Cidade:", cidades)
+    # Qualidade da geocodificação e regeocodificação direcionada
+    with st.expander("🎯 Qualidade da Geocodificação"):
+        confianca = confianca_estimada(df_final)
+        limiar_padrao = float(obter_configuracao("REGEOCODE_LIMIAR", 0.5))
+        
+        col_q1, col_q2, col_q3 = st.columns(3)
+        with col_q1:
+            st.metric("Confiança Média", f"{confianca.mean():.0%}" if len(confianca) else "-")
+        with col_q2:
+            st.metric("Abaixo do Limiar", int((confianca < limiar_padrao).sum()))
+        with col_q3:
+            st.metric("Posição Aproximada", int((confianca <= CONFIANCA_CENTROIDE_CIDADE).sum()))
+        
+        if 'Metodo' in df_final.columns:
+            st.dataframe(
+                df_final['Metodo'].fillna('sem registro').value_counts().rename_axis('Método').reset_index(name='Empresas'),
+                hide_index=True,
+                use_container_width=True
+            )
+        
+        limiar_regeocodificacao = st.slider(
+            "Regeocodificar empresas com confiança abaixo de:",
+            min_value=0.05, max_value=1.0, value=limiar_padrao, step=0.05,
+            help="As de menor confiança vão primeiro; o registro só muda se a nova posição for mais confiável"
+        )
+        if st.button("🔁 Regeocodificar Baixa Confiança", key="regeocodificar"):
+            criadas = enfileirar_regeocodificacao(
+                fila, df_final, limiar_regeocodificacao, int(obter_configuracao("REGEOCODE_LIMITE", 200))
+            )
+            if criadas:
+                st.success(f"✅ {criadas} empresas enviadas para regeocodificação em segundo plano")
+            else:
+                st.info("Nenhuma empresa abaixo do limiar precisa de nova tentativa")
     
-    # Aplica filtros
-    df_filtrado = df_final.copy()
+    # Filtros (vazio = exibir todos)
+    st.subheader("🎛️ Filtros")
+    col1, col2, col3 = st.columns(3)
+    selecoes = {}
     
-    if tipo_selecionado != "Exibir Todos" and 'Tipo' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['Tipo'] == tipo_selecionado]
+    for coluna_ui, coluna, rotulo in ((col1, 'Tipo', "Filtrar por Tipo:"),
+                                      (col2, 'Cidade', "Filtrar por Cidade:"),
+                                      (col3, 'Fonte', "Filtrar por Fonte:")):
+        with coluna_ui:
+            selecoes[coluna] = st.multiselect(
+                rotulo,
+                indice_filtros.opcoes(coluna),
+                format_func=lambda valor, coluna=coluna: f"{valor} ({indice_filtros.contagem(coluna, valor)})",
+                placeholder="Exibir todos"
+            )
     
-    if cidade_selecionada != "Exibir Todas" and 'Cidade' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['Cidade'] == cidade_selecionada]
+    # Aplica filtros pela interseção dos índices (sem cópia do DataFrame inteiro)
+    df_filtrado = indice_filtros.aplicar(df_final, selecoes)
+    # Identifica as empresas exibidas (base + filtros) para os caches do mapa e da lista
+    chave_filtros = (st.session_state.versao_empresas, sorted((c, sorted(v)) for c, v in selecoes.items()))
 
     # MAPA INTERATIVO
     st.subheader("🗺️ Mapa de Localizações")
     
-    # Filtra empresas com coordenadas válidas
-    df_mapa = df_filtrado.dropna(subset=['Latitude', 'Longitude']).copy()
+    # Empresas com coordenadas válidas
+    df_mapa = indice_filtros.aplicar(df_final, selecoes, apenas_com_coordenadas=True)
     
     if df_mapa.empty:
         st.warning("Nenhuma empresa com coordenadas válidas para exibir no mapa com os filtros atuais.")
     else:
-        # Cria mapa
-        mapa = folium.Map(
-            location=st.session_state.map_center, 
-            zoom_start=st.session_state.map_zoom, 
-            tiles="OpenStreetMap"
+        html_mapa = obter_mapa(
+            df_mapa,
+            st.session_state.map_center,
+            st.session_state.map_zoom,
+            st.session_state.rota_atual,
+            st.session_state.origem_rota if st.session_state.rota_atual else None,
+            st.session_state.get('destino_rota') if st.session_state.rota_atual else None,
+            st.session_state.get('roteiro_atual'),
+            chave_empresas=chave_filtros
         )
 
-        # Adiciona camadas de mapa
-        folium.TileLayer(
-            tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
-            attr='Esri',
-            name='Satélite (Esri)',
-            overlay=False,
-            control=True
-        ).add_to(mapa)
-
-        folium.TileLayer(
-            tiles='CartoDB positron',
-            attr='CartoDB',
-            name='Minimalista (CartoDB)',
-            overlay=False,
-            control=True
-        ).add_to(mapa)
-
-        # Cores por tipo de empresa
-        cores = {
-            'Cooperativa': 'blue',
-            'Associado Ativo': 'green',
-            'Algodoeira': 'red',
-            'Outro': 'orange'
-        }
-
-        # Adiciona marcadores das empresas
-        for index, empresa in df_mapa.iterrows():
-            tipo = empresa.get('Tipo', 'Algodoeira')
-            cor = cores.get(tipo, 'gray')
-            
-            popup_html = f"""
-            <div style="min-width: 250px">
-                <h4>{empresa['Nome']}</h4>
-                <hr>
-                <b>🏢 Tipo:</b> {tipo}<br>
-                <b>📍 Cidade:</b> {empresa.get('Cidade', 'Não informada')}<br>
-                <b>📞 Telefone:</b> {empresa.get('Telefone', 'Não Informado')}<br>
-                <b>📧 Email:</b> {empresa.get('Email', 'Não Informado')}<br>
-                <b>🔍 Fonte:</b> {empresa.get('Fonte', 'Manual')}<br>
-                <b>🎯 Endereço:</b> {empresa.get('Endereco', 'Localização aproximada')}
-            </div>
-            """
-            
-            folium.Marker(
-                location=[empresa['Latitude'], empresa['Longitude']],
-                popup=folium.Popup(popup_html, max_width=300),
-                tooltip=f"{empresa['Nome']} ({tipo})",
-                icon=folium.Icon(color=cor, icon='industry', prefix='fa')
-            ).add_to(mapa)
-
-        # Adiciona rota se existir
-        if st.session_state.rota_atual:
-            rota = st.session_state.rota_atual
-            origem = st.session_state.origem_rota
-            destino = st.session_state.destino_rota
-            
-            # Adiciona marcadores de origem e destino
-            folium.Marker(
-                location=[origem['lat'], origem['lon']],
-                popup=f"<b>Origem:</b> {origem['nome']}",
-                tooltip="Origem da Rota",
-                icon=folium.Icon(color='green', icon='home', prefix='fa')
-            ).add_to(mapa)
-            
-            folium.Marker(
-                location=[destino['lat'], destino['lon']],
-                popup=f"<b>Destino:</b> {destino['nome']}",
-                tooltip="Destino da Rota",
-                icon=folium.Icon(color='red', icon='flag', prefix='fa')
-            ).add_to(mapa)
-            
-            # Adiciona a rota
-            if len(rota['rota_coordenadas']) > 1:
-                AntPath(
-                    rota['rota_coordenadas'],
-                    color='blue',
-                    weight=6,
-                    opacity=0.7,
-                    dash_array=[10, 20],
-                    tooltip=f"Rota: {rota['distancia_km']} km, {rota['duracao_min']} min"
-                ).add_to(mapa)
-                
-                # Adiciona também uma linha sólida por baixo
-                folium.PolyLine(
-                    rota['rota_coordenadas'],
-                    color='blue',
-                    weight=3,
-                    opacity=0.9,
-                    tooltip=f"Rota para {destino['nome']}"
-                ).add_to(mapa)
-        
-        folium.LayerControl().add_to(mapa)
-
-        # Exibe o mapa
-        st_folium(mapa, width='100%', height=500, returned_objects=[])
+        # Exibe o mapa: com o mesmo HTML o navegador mantém o iframe (e o zoom do usuário)
+        st.iframe(html_mapa, height=500)
 
     # LISTA DE EMPRESAS INTERATIVA
     st.subheader("📋 Lista de Empresas")
 
-    # Função para atualizar o centro do mapa e definir como origem
-    def set_map_center(lat, lon, nome):
-        st.session_state.map_center = [lat, lon]
-        st.session_state.map_zoom = 14
-        
-        # Se o usuário quiser usar esta empresa como origem
-        if st.session_state.get('definir_como_origem', False):
-            st.session_state.origem_rota = {
-                'nome': nome,
-                'lat': lat,
-                'lon': lon
-            }
-            st.session_state.origem_lat = lat
-            st.session_state.origem_lon = lon
-            st.session_state.origem_nome = nome
-            st.success(f"✅ {nome} definida como origem da rota!")
-
     # Checkbox para definir como origem ao clicar
     definir_como_origem = st.checkbox(
         "Definir como origem ao clicar em 'Ver no Mapa'", 
@@ -1017,71 +3802,132 @@ if not st.session_state.empresas_mapeadas.empty:
     )
     st.session_state.definir_como_origem = definir_como_origem
 
-    # Cabeçalho da lista
-    col1, col2, col3, col4, col5 = st.columns([3, 2, 2, 1, 1])
+    # Paginação e ordenação feitas no servidor: só a página atual é renderizada
+    colunas_lista = [c for c in ['Nome', 'Tipo', 'Cidade', 'Telefone', 'Email'] if c in df_filtrado.columns]
+    
+    col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
     with col1:
-        st.markdown("**Nome**")
+        ordenar_por = st.selectbox("Ordenar por:", [c for c in ['Nome', 'Tipo', 'Cidade'] if c in colunas_lista])
     with col2:
-        st.markdown("**Tipo**")
+        crescente = st.toggle("Crescente", value=True)
     with col3:
-        st.markdown("**Cidade**")
+        tamanho_pagina = st.selectbox("Por página:", [25, 50, 100, 250], index=1)
+    
+    total_paginas = max(1, -(-len(df_filtrado) // tamanho_pagina))
     with col4:
-        st.markdown("**Ação**")
-    with col5:
-        st.markdown("**Rota**")
-
-    # Itera sobre o dataframe filtrado
-    for index, row in df_filtrado.reset_index(drop=True).iterrows():
-        st.divider()
-        col1, col2, col3, col4, col5 = st.columns([3, 2, 2, 1, 1])
-        with col1:
-            st.write(row.get('Nome', 'N/A'))
-        with col2:
-            st.write(row.get('Tipo', 'N/A'))
-        with col3:
-            st.write(row.get('Cidade', 'N/A'))
-        with col4:
-            # Botão para focar no mapa
-            if pd.notna(row['Latitude']) and pd.notna(row['Longitude']):
+        pagina = st.number_input(f"Página (de {total_paginas}):", min_value=1, max_value=total_paginas, value=1)
+    
+    # A ordenação só é refeita quando mudam as empresas exibidas ou a coluna;
+    # trocar de página ou de sentido reaproveita a ordem da sessão
+    cache_ordem = st.session_state.get('ordem_lista')
+    if cache_ordem is None or cache_ordem['chave'] != (chave_filtros, ordenar_por):
+        cache_ordem = {
+            'chave': (chave_filtros, ordenar_por),
+            'ordem': df_filtrado[ordenar_por].astype(str).str.lower().to_numpy().argsort(kind='stable')
+        }
+        st.session_state.ordem_lista = cache_ordem
+    ordem = cache_ordem['ordem']
+    if not crescente:
+        ordem = ordem[::-1]
+    inicio = (pagina - 1) * tamanho_pagina
+    df_pagina = df_filtrado.iloc[ordem[inicio:inicio + tamanho_pagina]]
+    
+    evento_lista = st.dataframe(
+        df_pagina[colunas_lista],
+        key=f"lista_empresas_{ordenar_por}_{crescente}_{tamanho_pagina}_{pagina}",
+        on_select="rerun",
+        selection_mode="single-row",
+        hide_index=True,
+        use_container_width=True
+    )
+    st.caption(f"Exibindo {inicio + 1 if len(df_pagina) else 0}–{inicio + len(df_pagina)} de {len(df_filtrado)} empresas. "
+               "Selecione uma linha para ver as ações.")
+    
+    # Ações da empresa selecionada
+    if evento_lista.selection.rows:
+        row = df_pagina.iloc[evento_lista.selection.rows[0]]
+        
+        if pd.notna(row['Latitude']) and pd.notna(row['Longitude']):
+            col1, col2 = st.columns(2)
+            with col1:
+                # Botão para focar no mapa
                 st.button(
-                    "🗺️ Ver Mapa", 
-                    key=f"goto_{index}", 
+                    f"🗺️ Ver {row['Nome'][:30]} no Mapa", 
+                    key="goto_selecionada", 
                     on_click=set_map_center, 
                     args=(row['Latitude'], row['Longitude'], row['Nome']),
                     use_container_width=True
                 )
-        with col5:
-            # Botão para calcular rota até esta empresa
-            if (pd.notna(row['Latitude']) and pd.notna(row['Longitude']) and 
-                st.session_state.get('origem_rota')):
+            with col2:
+                # Botão para calcular rota até esta empresa
                 st.button(
-                    "🚗 Rota", 
-                    key=f"route_{index}", 
-                    on_click=lambda lat=row['Latitude'], lon=row['Longitude'], nome=row['Nome']: 
-                        st.session_state.update({
-                            'destino_lat': lat,
-                            'destino_lon': lon,
-                            'destino_nome': nome
-                        }),
+                    "🚗 Definir como Destino da Rota", 
+                    key="route_selecionada", 
+                    on_click=definir_destino,
+                    args=(row['Latitude'], row['Longitude'], row['Nome']),
                     use_container_width=True
                 )
+        else:
+            st.warning("⚠️ Empresa sem coordenadas válidas")
     
     st.divider()
     
-    # Download
-    st.download_button(
-        label="📥 Baixar Dados Completos (CSV)",
-        data=df_final.to_csv(index=False, encoding='utf-8-sig'),
-        file_name=f"empresas_algodao_mt_{datetime.now().strftime('%Y%m%d')}.csv",
-        mime="text/csv",
-        use_container_width=True
-    )
+    # Download: o arquivo só é gerado no clique e fica guardado por versão da base
+    col_formato, col_download = st.columns([1, 2])
+    with col_formato:
+        formato_download = st.selectbox("Formato:", list(FORMATOS_DOWNLOAD), key="formato_download", label_visibility="collapsed")
+    with col_download:
+        exportador_arquivos = obter_exportador_arquivos()
+        arquivo_download = exportador_arquivos.caminho(formato_download, st.session_state.versao_empresas)
+        url_exportacao = obter_servidor_exportacao()
+        if url_exportacao and os.path.exists(arquivo_download):
+            # O servidor de exportação envia o arquivo em blocos, direto do disco
+            st.link_button(
+                f"📥 Baixar Dados Completos ({formato_download})",
+                f"{url_exportacao}/downloads/{os.path.basename(arquivo_download)}",
+                use_container_width=True
+            )
+        elif url_exportacao:
+            if st.button(f"📦 Preparar Download ({formato_download})", use_container_width=True):
+                with st.spinner("Gerando o arquivo..."):
+                    exportador_arquivos.gerar(df_final, st.session_state.versao_empresas, formato_download)
+                st.rerun()
+        else:
+            st.download_button(
+                label=f"📥 Baixar Dados Completos ({formato_download})",
+                data=partial(exportador_arquivos.abrir, df_final, st.session_state.versao_empresas, formato_download),
+                file_name=f"empresas_algodao_mt_{datetime.now().strftime('%Y%m%d')}.{FORMATOS_DOWNLOAD[formato_download]['extensao']}",
+                mime=FORMATOS_DOWNLOAD[formato_download]['mime'],
+                use_container_width=True
+            )
+    
+    # Camada publicada para clientes GIS externos
+    with st.expander("🌐 Exportação GIS (QGIS e dashboards)"):
+        url_exportacao = obter_servidor_exportacao()
+        if exportador.em_andamento():
+            st.info("⏳ Atualizando os arquivos exportados...")
+        elif exportador.ultimo_erro:
+            st.error(f"❌ Falha na exportação: {exportador.ultimo_erro}")
+        else:
+            st.caption(f"Arquivos atualizados até a versão {exportador.versao_exportada()} da base.")
+        
+        if url_exportacao:
+            st.code(
+                f"{url_exportacao}/empresas.geojson\n"
+                f"{url_exportacao}/empresas.parquet\n"
+                f"{url_exportacao}/tiles/{{z}}/{{x}}/{{y}}.mvt\n"
+                f"{url_exportacao}/tiles.json",
+                language=None
+            )
+            st.caption("No QGIS: Camada > Adicionar Camada > Vector Tiles, com a URL dos tiles acima.")
+        else:
+            st.warning(f"⚠️ Servidor de exportação desativado ou porta ocupada. Arquivos em: {DIRETORIO_EXPORTACAO}")
 
 else:
     st.info("""
     👆 **Para começar:**
     
-    1. **Coleta Automática:** Escolha entre cooperativas ou associados ativos.
+    1. **Coleta Automática:** Escolha as fontes e clique em coletar; só o que mudou vai para a geocodificação.
     2. **Inserção Manual:** Adicione empresas específicas manualmente.
     3. **Sistema de Rotas:** Defina sua origem e calcule rotas para as empresas.
     4. **Mapa Interativo:** Visualize todas as localizações e rotas.
@@ -1101,56 +3947,133 @@ uploaded_file = st.sidebar.file_uploader(
     help="CSV deve ter coluna 'Nome' com os nomes das empresas"
 )
 
+COLUNAS_CSV = ['Nome', 'Telefone', 'Email', 'Tipo']
+
+def processar_bloco_csv(bloco, ingestao):
+    """
+    Processa um bloco do CSV: filtra PJs, une duplicatas, descarta empresas
+    já presentes na base e envia o restante para a fila de geocodificação
+    """
+    ingestao['lidas'] += len(bloco)
+    bloco = bloco[classificar_pessoa_juridica(bloco['Nome']).to_numpy()]
+    ingestao['pjs'] += len(bloco)
+    if bloco.empty:
+        return
+    
+    df_para_geocodificar = bloco.reindex(columns=list(PADROES_TAREFA)).fillna(PADROES_TAREFA)
+    df_para_geocodificar = armazem.filtrar_novas(resolver_entidades(df_para_geocodificar))
+    enfileiradas = fila.enfileirar(ingestao['lote'], df_para_geocodificar)
+    ingestao['duplicadas'] += len(bloco) - enfileiradas
+    ingestao['enfileiradas'] += enfileiradas
+
 if uploaded_file is not None:
     try:
-        df_upload = pd.read_csv(uploaded_file)
-        if 'Nome' in df_upload.columns:
-            st.sidebar.success(f"📊 {len(df_upload)} empresas carregadas")
+        # Só o cabeçalho é lido aqui; os dados são lidos em blocos durante a importação
+        colunas_arquivo = pd.read_csv(uploaded_file, nrows=0).columns
+        uploaded_file.seek(0)
+        if 'Nome' in colunas_arquivo:
+            st.sidebar.success(f"📊 Arquivo com {uploaded_file.size / 1e6:.1f} MB pronto para importação")
             
-            if st.sidebar.button("🗺️ Geocodificar Empresas do Arquivo"):
-                with st.spinner('Processando empresas do arquivo...'):
-                    df_upload['É_PJ'] = df_upload['Nome'].apply(is_pessoa_juridica)
-                    df_pjs = df_upload[df_upload['É_PJ']].copy()
-                    
-                    if not df_pjs.empty:
-                        st.sidebar.write(f"🏢 {len(df_pjs)} empresas são PJs")
-                        
-                        df_para_geocodificar = pd.DataFrame({
-                            'Nome': df_pjs['Nome'],
-                            'Telefone': df_pjs.get('Telefone', 'Não Informado'),
-                            'Email': df_pjs.get('Email', 'Não Informado'),
-                            'Tipo': df_pjs.get('Tipo', 'Algodoeira'),
-                            'Cidade': 'Mato Grosso',
-                            'Estado': 'MT'
-                        })
-                        
-                        df_geocodificado = geocodificar_empresas_em_lote(df_para_geocodificar)
-                        
-                        if not df_geocodificado.empty:
-                            if st.session_state.empresas_mapeadas.empty:
-                                st.session_state.empresas_mapeadas = df_geocodificado
-                            else:
-                                nomes_existentes = set(st.session_state.empresas_mapeadas['Nome'].values)
-                                df_novas = df_geocodificado[~df_geocodificado['Nome'].isin(nomes_existentes)]
-                                
-                                if not df_novas.empty:
-                                    st.session_state.empresas_mapeadas = pd.concat(
-                                        [st.session_state.empresas_mapeadas, df_novas], 
-                                        ignore_index=True
-                                    )
-                                    st.sidebar.success(f"✅ {len(df_novas)} novas empresas adicionadas!")
-                                else:
-                                    st.sidebar.info("ℹ️ Todas as empresas do arquivo já estão mapeadas")
-                            
-                            st.rerun()
-                    else:
-                        st.sidebar.warning("ℹ️ Nenhuma pessoa jurídica encontrada no arquivo")
+            if 'ingestao_csv' not in st.session_state and st.sidebar.button("🗺️ Geocodificar Empresas do Arquivo"):
+                st.session_state.ingestao_csv = {
+                    'arquivo': uploaded_file.file_id,
+                    'lote': fila.criar_lote(f"Arquivo {uploaded_file.name}"),
+                    'leitor': pd.read_csv(
+                        uploaded_file,
+                        usecols=[c for c in COLUNAS_CSV if c in colunas_arquivo],
+                        dtype=str,
+                        chunksize=int(obter_configuracao("CSV_LINHAS_POR_BLOCO", 1000))
+                    ),
+                    'lidas': 0, 'pjs': 0, 'duplicadas': 0, 'enfileiradas': 0,
+                    'fila_exibida': False
+                }
         else:
             st.sidebar.error("❌ Arquivo deve ter coluna 'Nome'")
             
     except Exception as e:
         st.sidebar.error(f"❌ Erro ao processar arquivo: {e}")
 
+# Leitura em andamento num fragmento: cada execução lê blocos até esgotar
+# CSV_SEGUNDOS_POR_EXECUCAO e só o painel de importação é reexecutado, sem
+# recarregar a página inteira; a geocodificação segue na fila de fundo
+@st.fragment(run_every=float(obter_configuracao("CSV_INTERVALO_LEITURA", 1)))
+def painel_importacao_csv():
+    ingestao = st.session_state.get('ingestao_csv')
+    if ingestao is None:
+        return
+    
+    interromper = st.button("⏹️ Interromper importação")
+    aviso = None
+    if interromper or uploaded_file is None or uploaded_file.file_id != ingestao['arquivo']:
+        aviso = ('warning', f"⏹️ Importação interrompida após {ingestao['lidas']} linhas")
+    else:
+        orcamento = float(obter_configuracao("CSV_SEGUNDOS_POR_EXECUCAO", 0.5))
+        inicio = time.time()
+        try:
+            while time.time() - inicio < orcamento:
+                processar_bloco_csv(next(ingestao['leitor']), ingestao)
+        except StopIteration:
+            aviso = ('success', f"✅ Leitura concluída: {ingestao['enfileiradas']} empresas enviadas para geocodificação")
+        except Exception as e:
+            aviso = ('error', f"❌ Erro ao processar arquivo: {e}")
+    
+    if aviso:
+        del st.session_state.ingestao_csv
+        st.session_state.aviso_csv = aviso
+        st.rerun(scope="app")
+    
+    st.info(f"📥 {ingestao['lidas']} linhas lidas • {ingestao['pjs']} PJs • "
+            f"{ingestao['duplicadas']} duplicadas/existentes • {ingestao['enfileiradas']} na fila")
+    # A página inteira só é recarregada quando a fila recebe as primeiras
+    # tarefas, para o painel da fila passar a se atualizar sozinho
+    if ingestao['enfileiradas'] and not ingestao['fila_exibida']:
+        ingestao['fila_exibida'] = True
+        st.rerun(scope="app")
+
+if 'aviso_csv' in st.session_state:
+    tipo, mensagem = st.session_state.pop('aviso_csv')
+    getattr(st.sidebar, tipo)(mensagem)
+
+if 'ingestao_csv' in st.session_state:
+    with st.sidebar:
+        painel_importacao_csv()
+
+# ==============================================================================
+# ACOMPANHAMENTO DA FILA DE GEOCODIFICAÇÃO
+# ==============================================================================
+
+# Enquanto houver tarefas na fila, o painel se atualiza sozinho a cada poucos segundos
+fila_ativa = fila.em_andamento()
+
+@st.fragment(run_every=float(obter_configuracao("FILA_INTERVALO_ATUALIZACAO", 2)) if fila_ativa else None)
+def painel_fila_geocodificacao():
+    lotes = fila.progresso()
+    if lotes.empty:
+        return
+    
+    st.subheader("⏳ Geocodificação em Segundo Plano")
+    for lote in lotes.itertuples():
+        texto = (f"{lote.descricao}: {lote.finalizadas}/{lote.total} • "
+                 f"{lote.inseridas} novas • {lote.atualizadas} atualizadas")
+        if lote.falhas:
+            texto += f" • {lote.falhas} falhas"
+        st.progress(lote.finalizadas / lote.total if lote.total else 1.0, text=texto)
+        if lote.restantes and st.button("⏹️ Cancelar", key=f"cancelar_lote_{lote.id}"):
+            fila.cancelar(lote.id)
+            st.rerun(scope="app")
+    
+    # Atualiza o mapa com o que o trabalhador já gravou, sem recarregar a
+    # página inteira a cada consulta (no máximo a cada FILA_INTERVALO_MAPA s)
+    ativa = fila.em_andamento()
+    if armazem.versao() != st.session_state.versao_empresas or ativa != fila_ativa:
+        ultima = st.session_state.get('ultima_atualizacao_fila', 0)
+        if not ativa or time.time() - ultima > float(obter_configuracao("FILA_INTERVALO_MAPA", 10)):
+            st.session_state.ultima_atualizacao_fila = time.time()
+            st.rerun(scope="app")
+
+with st.sidebar:
+    painel_fila_geocodificacao()
+
 # ==============================================================================
 # INSTRUÇÕES
 # ==============================================================================
@@ -1164,7 +4087,7 @@ with st.expander("📖 Guia de Uso Completo"):
        - 🏠 **Digitar Endereço:** Busque por endereço completo
        - 🗺️ **Selecionar do Mapa:** Clique em "Ver no Mapa" + marque "Definir como origem"
     
-    2. **Selecione o Destino:** Escolha uma empresa da lista
+    2. **Selecione o Destino:** Busque a empresa por nome, cidade, endereço, telefone ou e-mail
     
     3. **Calcule a Rota:** Clique em "Calcular Rota"
     
@@ -1172,7 +4095,7 @@ with st.expander("📖 Guia de Uso Completo"):
     
     - Agora detectamos automaticamente cidades nos nomes das empresas
     - Inclua a cidade no nome para melhor precisão: "Algodoeira São João Sinop"
-    - Coordenadas aprimoradas para cidades principais de MT
+    - Coordenadas de todos os municípios de MT disponíveis sem consulta à internet
     
     **🔧 Funcionalidades:**
     
@@ -1180,12 +4103,13 @@ with st.expander("📖 Guia de Uso Completo"):
     - 🗺️ **Mapa Interativo** com múltiplas camadas
     - 📍 **Geocodificação Inteligente** com fallback para cidades
     - 📊 **Filtros Avançados** por tipo e cidade
-    - 📥 **Exportação de Dados** em CSV
+    - 📥 **Exportação de Dados** em CSV, GeoJSON, GeoParquet e vector tiles
     
     **💡 Dicas:**
     
     - Para máxima precisão, inclua a cidade no nome da empresa
     - Use o filtro "Definir como origem" para rápido planejamento de rotas
+    - Em "Qualidade da Geocodificação", regeocodifique só as empresas de baixa confiança
     - A rota em azul no mapa mostra o trajeto calculado
     - Use a camada de satélite para ver a região em detalhes
     """)
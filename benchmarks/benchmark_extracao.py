@@ -0,0 +1,168 @@
+"""
+Benchmark da extração das páginas da AMPA: parser antigo (BeautifulSoup +
+html.parser, get_text em todos os elementos) contra o extrator lxml do app.
+
+Uso:
+    python benchmarks/benchmark_extracao.py [--repeticoes N] [--gerar]
+
+As fixtures ficam em benchmarks/fixtures/. Páginas reais salvas pelo
+navegador podem ser colocadas lá como cooperativas*.html / associados*.html;
+--gerar recria as fixtures sintéticas.
+"""
+
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+DIRETORIO_FIXTURES = os.path.join(DIRETORIO, "fixtures")
+
+# ==============================================================================
+# FIXTURES SINTÉTICAS
+# ==============================================================================
+
+CIDADES = ["Sinop", "Sorriso", "Sapezal", "Campo Verde", "Primavera do Leste", "Rondonópolis"]
+PALAVRAS = ["Agro", "Algodoeira", "Agropecuária", "Sementes", "Fazenda", "Grupo", "Comercial"]
+SOBRENOMES = ["Silva", "Maggi", "Scheffer", "Rosa", "Boa Vista", "Santa Maria", "Três Irmãos"]
+
+def _telefone(aleatorio):
+    return f"({aleatorio.randint(60, 69)}) 9{aleatorio.randint(1000, 9999)}-{aleatorio.randint(1000, 9999)}"
+
+def _envolver(conteudo, profundidade):
+    """
+    Aninha o conteúdo em divs, como os construtores de página do WordPress
+    """
+    for nivel in range(profundidade):
+        conteudo = f'<div class="elementor-widget-wrap nivel-{nivel}"><div class="elementor-element">{conteudo}</div></div>'
+    return conteudo
+
+def gerar_cooperativas(linhas=400, semente=1):
+    aleatorio = random.Random(semente)
+    corpo = []
+    for i in range(linhas):
+        sobrenome = aleatorio.choice(SOBRENOMES)
+        fantasia = f"{aleatorio.choice(PALAVRAS)} {sobrenome} {i}"
+        nome = f"Cooperativa Agroindustrial {sobrenome} {aleatorio.choice(CIDADES)} {i}"
+        email = f"contato{i}@coop{i}.com.br"
+        corpo.append(f"<tr><td>{fantasia}</td><td>{nome}</td><td>{email}</td><td>{_telefone(aleatorio)}</td></tr>")
+    tabela = ("<table><thead><tr><th>Fantasia</th><th>Cooperativa</th><th>Email</th><th>Telefone</th></tr></thead>"
+              f"<tbody>{''.join(corpo)}</tbody></table>")
+    # Parte da lista em parágrafos de texto corrido, como em páginas sem tabela
+    paragrafos = "\n".join(
+        f"<p>{aleatorio.choice(SOBRENOMES)} Agro  Cooperativa Agroindustrial {aleatorio.choice(SOBRENOMES)}  "
+        f"contato{i}@coop.com.br  {_telefone(aleatorio)}</p>"
+        for i in range(linhas // 2)
+    )
+    return (f"<html><head><script>var x = 1;</script></head>"
+            f"<body>{_envolver(tabela, 25)}\n{_envolver(paragrafos, 10)}</body></html>")
+
+def gerar_associados(linhas=1200, semente=2):
+    aleatorio = random.Random(semente)
+    blocos = []
+    for i in range(linhas):
+        nome = f"{aleatorio.choice(PALAVRAS)} {aleatorio.choice(SOBRENOMES)} {i} Ltda"
+        if i % 3 == 0:
+            nome = f"{aleatorio.choice(SOBRENOMES)} {aleatorio.choice(SOBRENOMES)}"  # pessoa física
+        blocos.append(_envolver(f"<p><span>{nome}</span> <span>{_telefone(aleatorio)}</span></p>", 4))
+    return f"<html><body>{_envolver(''.join(blocos), 8)}</body></html>"
+
+def gravar_fixtures():
+    os.makedirs(DIRETORIO_FIXTURES, exist_ok=True)
+    for nome, html in (("cooperativas.html", gerar_cooperativas()), ("associados.html", gerar_associados())):
+        with open(os.path.join(DIRETORIO_FIXTURES, nome), "w", encoding="utf-8") as arquivo:
+            arquivo.write(html)
+
+# ==============================================================================
+# EXTRAÇÃO ANTIGA (REFERÊNCIA)
+# ==============================================================================
+
+def cooperativas_html_parser(html, is_pessoa_juridica):
+    soup = BeautifulSoup(html, 'html.parser')
+    soup.find_all('table')
+    soup.find_all('div', class_=re.compile(r'table|wrapper|content', re.I))
+    padroes_cooperativas = [
+        r'([A-Z][A-Za-z\s&]+)\s+([A-Z][A-Za-z\s]+Cooperativa[A-Za-z\s]+)\s+([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})\s+(\(?\d{2}\)?[\s-]?\d{4,5}[\s-]?\d{4})',
+        r'([A-Z][A-Za-z\s&]+)\s+([A-Z][A-Za-z\s]+)\s+([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})\s+(\(?\d{2}\)?[\s-]?\d{4,5}[\s-]?\d{4})',
+    ]
+    registros = []
+    for linha in soup.get_text().split('\n'):
+        linha_limpa = linha.strip()
+        if len(linha_limpa) < 10 or len(linha_limpa) > 200:
+            continue
+        if any(palavra in linha_limpa.lower() for palavra in ['cooperativa', 'caap', 'email', '@', '(', ')']):
+            for padrao in padroes_cooperativas:
+                for match in re.findall(padrao, linha_limpa):
+                    nome = match[1].strip() if 'cooperativa' in match[1].lower() else match[0].strip()
+                    if nome and is_pessoa_juridica(nome):
+                        registros.append(nome)
+    return registros
+
+def associados_html_parser(html, is_pessoa_juridica):
+    soup = BeautifulSoup(html, 'html.parser')
+    padrao_telefone = r'\(?\d{2}\)?[\s-]?\d{4,5}[\s-]?\d{4}'
+    registros = []
+    for elemento in soup.find_all(['div', 'p', 'span', 'li', 'td', 'tr']):
+        texto = elemento.get_text(strip=True)
+        if len(texto) < 5 or len(texto) > 100:
+            continue
+        if texto.lower() in ['associado', 'telefone', 'nome', 'empresa', 'endereço']:
+            continue
+        tem_telefone = re.search(padrao_telefone, texto)
+        if tem_telefone:
+            partes = texto.split(tem_telefone.group())
+            if partes and partes[0].strip() and is_pessoa_juridica(partes[0].strip()):
+                registros.append(partes[0].strip())
+    return registros
+
+# ==============================================================================
+# EXECUÇÃO
+# ==============================================================================
+
+def importar_extracao():
+    """
+    Importa os extratores do app (módulo extracao, sem Streamlit)
+    """
+    sys.path.insert(0, os.path.dirname(DIRETORIO))
+    import extracao
+    return extracao
+
+def cronometrar(funcao, repeticoes):
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor, resultado
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--gerar", action="store_true", help="recria as fixtures sintéticas")
+    argumentos = parser.parse_args()
+    
+    if argumentos.gerar or not glob.glob(os.path.join(DIRETORIO_FIXTURES, "*.html")):
+        gravar_fixtures()
+    extracao = importar_extracao()
+    
+    casos = [
+        ("cooperativas", cooperativas_html_parser, extracao.extrair_cooperativas),
+        ("associados", associados_html_parser, extracao.extrair_associados),
+    ]
+    print(f"{'fixture':<32} {'html.parser':>12} {'lxml':>10} {'ganho':>8} {'registros (antigo/novo)':>25}")
+    for prefixo, antigo, novo in casos:
+        for caminho in sorted(glob.glob(os.path.join(DIRETORIO_FIXTURES, f"{prefixo}*.html"))):
+            with open(caminho, "rb") as arquivo:
+                html = arquivo.read()
+            tempo_antigo, registros_antigos = cronometrar(lambda: antigo(html, extracao.is_pessoa_juridica), argumentos.repeticoes)
+            tempo_novo, registros_novos = cronometrar(lambda: novo(html), argumentos.repeticoes)
+            print(f"{os.path.basename(caminho):<32} {tempo_antigo:>11.3f}s {tempo_novo:>9.3f}s "
+                  f"{tempo_antigo / tempo_novo:>7.1f}x {len(registros_antigos):>12}/{len(registros_novos)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Extração dos registros das páginas da AMPA e classificação de nomes de
+pessoa jurídica. Fica fora do app.py para poder ser importado sem o
+Streamlit (por exemplo pelo benchmark em benchmarks/).
+"""
+
+import re
+import unicodedata
+
+import lxml.html
+import pandas as pd
+from lxml import etree
+
+# ==============================================================================
+# NORMALIZAÇÃO DE TEXTO
+# ==============================================================================
+
+def normalizar_texto(texto):
+    """
+    Normaliza um texto para comparação: minúsculas, sem acentos e com espaços simples
+    """
+    if texto is None:
+        return ""
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', texto.lower()).strip()
+
+def normalizar_serie(serie):
+    """
+    Versão vetorizada de normalizar_texto para uma coluna inteira, trocando
+    pontuação por espaço para facilitar a busca por nomes
+    """
+    return (serie.fillna("").astype(str)
+            .str.normalize('NFKD')
+            .str.encode('ascii', 'ignore').str.decode('ascii')
+            .str.lower()
+            .str.replace(r'[^a-z0-9]+', ' ', regex=True)
+            .str.strip())
+
+def regex_de_trie(termos):
+    """
+    Compila os termos em uma única regex estruturada como trie (prefixos
+    comuns fatorados), preferindo sempre o termo mais longo
+    """
+    trie = {}
+    for termo in termos:
+        no = trie
+        for caractere in termo:
+            no = no.setdefault(caractere, {})
+        no[''] = {}
+    
+    def montar(no):
+        fim = '' in no
+        ramos = [re.escape(c) + montar(filho) for c, filho in sorted(no.items()) if c]
+        if not ramos:
+            return ''
+        if len(ramos) == 1 and not fim:
+            return ramos[0]
+        grupo = '(?:' + '|'.join(ramos) + ')'
+        return grupo + '?' if fim else grupo
+    
+    return re.compile(r'\b(' + montar(trie) + r')\b')
+
+# ==============================================================================
+# CLASSIFICAÇÃO DE PESSOA JURÍDICA
+# ==============================================================================
+
+# Sufixos societários que identificam pessoa jurídica (também removidos na deduplicação)
+SUFIXOS_JURIDICOS = ['ltda', 's.a', 's/a', 'eireli', 'mei', 'me', 'inc']
+
+# Termos que indicam empresa quando iniciam uma palavra ("agro" casa "Agrosul", não "Milagros")
+TERMOS_PESSOA_JURIDICA = [
+    'empresa', 'agropecuária', 'agropecuaria', 'agrícola', 'agricola',
+    'fazenda', 'grupo', 'agro', 'produtos', 'investimentos',
+    'comércio', 'comercio', 'algodão', 'algodao', 'cotton',
+    'industrial', 'exportação', 'exportadora', 'comercial',
+    'holding', 'corporation', 'cooperative',
+    'cooperativa', 'agrônoma', 'agronoma', 'sementes',
+    'agricultura', 'agribusiness',
+    'algodoeira', 'agroindustrial'
+]
+
+# Termos curtos em inglês só valem como palavra inteira: como prefixo,
+# "farm" casaria "Farmacia", "corp" "Corporal" e "ranch" "Ranchos"
+TERMOS_PALAVRA_INTEIRA = ['corp', 'farm', 'farms', 'ranch', 'ranches', 'ltd', 'llc']
+
+def _compilar_padrao_pessoa_juridica():
+    """
+    Une sufixos e termos curtos (palavra inteira) e os demais termos (início
+    de palavra) em uma única regex estruturada como trie, aplicada ao texto
+    já normalizado
+    """
+    def interno(termos):
+        # Remove o "\b(" ... ")\b" que envolve a trie
+        return regex_de_trie(normalizar_serie(pd.Series(termos)).unique()).pattern[3:-3]
+    
+    # Os termos casam também como prefixo, então ficam sem o \b final
+    return re.compile(r'\b(?:' + interno(SUFIXOS_JURIDICOS + TERMOS_PALAVRA_INTEIRA) + r')\b'
+                      r'|\b(?:' + interno(TERMOS_PESSOA_JURIDICA) + ')')
+
+PADRAO_PESSOA_JURIDICA = _compilar_padrao_pessoa_juridica()
+
+def is_pessoa_juridica(nome):
+    """
+    Verifica se um nome provavelmente pertence a uma empresa.
+
+    >>> [is_pessoa_juridica(n) for n in ["Agrosul Ltda", "Fazenda Boa Vista", "Rio Verde Farms", "XYZ Corp."]]
+    [True, True, True, True]
+    >>> [is_pessoa_juridica(n) for n in ["Maria Milagros", "Farmacia Central", "Corporal Silva", "Ranchos Gomes"]]
+    [False, False, False, False]
+    """
+    if not nome or pd.isna(nome):
+        return False
+    nome_normalizado = re.sub(r'[^a-z0-9]+', ' ', normalizar_texto(nome))
+    return PADRAO_PESSOA_JURIDICA.search(nome_normalizado) is not None
+
+def classificar_pessoa_juridica(nomes):
+    """
+    Versão vetorizada de is_pessoa_juridica para uma coluna inteira
+    """
+    nomes = pd.Series(nomes)
+    return normalizar_serie(nomes).str.contains(PADRAO_PESSOA_JURIDICA, regex=True) & nomes.notna()
+
+# ==============================================================================
+# EXTRAÇÃO DE DADOS DAS PÁGINAS (LXML)
+# ==============================================================================
+
+PADRAO_TELEFONE = re.compile(r'\(?\d{2}\)?[\s-]?\d{4,5}[\s-]?\d{4}')
+PADRAO_EMAIL = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+
+# Linhas de texto no formato "Fantasia  Nome da Cooperativa  email  telefone"
+PADROES_COOPERATIVAS = [
+    re.compile(r'([A-Z][A-Za-z\s&]+)\s+([A-Z][A-Za-z\s]+Cooperativa[A-Za-z\s]+)\s+([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})\s+(\(?\d{2}\)?[\s-]?\d{4,5}[\s-]?\d{4})'),
+    re.compile(r'([A-Z][A-Za-z\s&]+)\s+([A-Z][A-Za-z\s]+)\s+([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})\s+(\(?\d{2}\)?[\s-]?\d{4,5}[\s-]?\d{4})'),
+]
+PALAVRAS_COOPERATIVAS = ('cooperativa', 'caap', 'email', '@', '(', ')')
+PALAVRAS_CABECALHO = {'associado', 'telefone', 'nome', 'empresa', 'endereço'}
+
+# Linhas "folha": linhas de tabela e blocos de texto sem outros blocos dentro,
+# de modo que cada trecho de texto da página é lido uma única vez
+XPATH_LINHAS = etree.XPath(
+    "//tr[td][not(.//table)]"
+    " | //li[not(.//li or .//table)][not(ancestor::tr)]"
+    " | //p[not(.//p or .//div or .//li or .//table)][not(ancestor::tr or ancestor::li)]"
+    " | //div[not(.//div or .//p or .//li or .//table)][not(ancestor::tr or ancestor::li or ancestor::p)]"
+)
+
+def _texto(no):
+    return ' '.join(' '.join(no.itertext()).split())
+
+def linhas_pagina(html):
+    """
+    Gera (texto, células) para cada linha folha da página, na ordem do
+    documento; células só existem para linhas de tabela
+    """
+    raiz = lxml.html.fromstring(html)
+    etree.strip_elements(raiz, 'script', 'style', with_tail=False)
+    for no in XPATH_LINHAS(raiz):
+        if no.tag == 'tr':
+            celulas = [_texto(celula) for celula in no.iterchildren('td', 'th')]
+            yield ' '.join(c for c in celulas if c), celulas
+        else:
+            yield _texto(no), None
+
+def _registro(nome, telefone, email, tipo):
+    return {
+        'Nome': nome,
+        'Telefone': telefone or "Não Informado",
+        'Email': email or "Não Informado",
+        'Tipo': tipo,
+        'Cidade': 'Mato Grosso',
+        'Estado': 'MT'
+    }
+
+def _apenas_pessoas_juridicas(registros):
+    if not registros:
+        return []
+    df = pd.DataFrame(registros)
+    return df[classificar_pessoa_juridica(df['Nome']).to_numpy()].to_dict('records')
+
+def extrair_cooperativas(html):
+    """
+    Extrai as cooperativas da página da AMPA em uma única passada.
+    Linhas de tabela são lidas por célula; blocos de texto passam pelos
+    padrões de linha "fantasia / cooperativa / email / telefone".
+    """
+    registros = []
+    for texto, celulas in linhas_pagina(html):
+        if celulas and len(celulas) >= 2:
+            email = next((m.group() for m in map(PADRAO_EMAIL.search, celulas) if m), None)
+            telefone = next((m.group() for m in map(PADRAO_TELEFONE.search, celulas) if m), None)
+            nomes = [c for c in celulas if c and not PADRAO_EMAIL.search(c) and not PADRAO_TELEFONE.search(c)]
+            if nomes and (email or telefone):
+                # Prefere o nome completo da cooperativa
+                nome = next((n for n in nomes if 'cooperativa' in n.lower()), nomes[0])
+                registros.append(_registro(nome, telefone, email, 'Cooperativa'))
+            continue
+        
+        # Pula linhas muito curtas ou claramente não-dados
+        if len(texto) < 10 or len(texto) > 200:
+            continue
+        texto_lower = texto.lower()
+        if not any(palavra in texto_lower for palavra in PALAVRAS_COOPERATIVAS):
+            continue
+        for padrao in PADROES_COOPERATIVAS:
+            encontrados = padrao.findall(texto)
+            for fantasia, nome_cooperativa, email, telefone in encontrados:
+                fantasia, nome_cooperativa = fantasia.strip(), nome_cooperativa.strip()
+                nome = nome_cooperativa if 'cooperativa' in nome_cooperativa.lower() else fantasia
+                registros.append(_registro(nome, telefone, email, 'Cooperativa'))
+            if encontrados:
+                break
+    
+    return _apenas_pessoas_juridicas(registros)
+
+def extrair_associados(html):
+    """
+    Extrai os associados ativos (nome seguido de telefone) da página da
+    AMPA em uma única passada
+    """
+    registros = []
+    for texto, celulas in linhas_pagina(html):
+        if celulas:
+            telefone = next((m.group() for m in map(PADRAO_TELEFONE.search, celulas) if m), None)
+            nomes = [c for c in celulas if c and not PADRAO_EMAIL.search(c) and not PADRAO_TELEFONE.search(c)]
+            if telefone and nomes and nomes[0].lower() not in PALAVRAS_CABECALHO:
+                registros.append(_registro(nomes[0], telefone, None, 'Associado Ativo'))
+            continue
+        
+        # Filtra elementos muito curtos ou muito longos e rótulos de cabeçalho
+        if len(texto) < 5 or len(texto) > 100 or texto.lower() in PALAVRAS_CABECALHO:
+            continue
+        # Um telefone indica linha de dados: o nome é tudo o que vem antes dele
+        telefone = PADRAO_TELEFONE.search(texto)
+        if telefone:
+            nome = texto[:telefone.start()].strip(' -–:|')
+            if nome:
+                registros.append(_registro(nome, telefone.group(), None, 'Associado Ativo'))
+    
+    return _apenas_pessoas_juridicas(registros)